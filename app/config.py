@@ -1,17 +1,92 @@
 import json
 import os
 
+# Candidates per beam path, paths kept, how many leading iterations branch, and how
+# candidates are scored: "heuristic", "self_evaluation" or "combined"
+DEFAULT_BRANCHING = {
+    "branches": 1,
+    "beam_width": 1,
+    "depth": 0,
+    "temperature": 0.7,
+    "scorer": "heuristic"
+}
+
 DEFAULT_CONFIG = {
     "iterations_before_feedback": 1,
     "max_iterations": 5,
-    "confidence_threshold": 0.8
+    "confidence_threshold": 0.8,
+    "response_cache_enabled": False,
+    "response_cache_path": "",
+    "response_cache_memory_entries": 256,
+    "response_cache_max_bytes": 67108864,
+    "response_cache_ttl": 86400,
+    "context_token_budget": 4000,
+    "context_recent_iterations": 2,
+    "context_summary_tokens": 120,
+    "history_limit": 10,
+    "history_token_budget": 2000,
+    "task_keywords": None,
+    "confidence_keywords": None,
+    "confidence_keyword_weight": 1.0,
+    "uncertainty_keyword_weight": 1.0,
+    "self_evaluation_enabled": False,
+    "speculative_final_answer": False,
+    "structured_trailer_enabled": False,
+    "self_evaluation_max_tokens": 16,
+    "transport_connect_timeout": 5.0,
+    "transport_read_timeout": 120.0,
+    "transport_max_connections": 100,
+    "transport_max_keepalive": 20,
+    "transport_keepalive_expiry": 30.0,
+    "transport_max_retries": 4,
+    "transport_backoff_base": 0.5,
+    "transport_backoff_max": 20.0,
+    "transport_retry_after_max": 60.0,
+    "transport_rate_limit": 0,
+    "transport_rate_burst": 10,
+    "transport_max_streams": 0,
+    "backends": [],
+    "model_routes": {},
+    "backend_selection": "least_loaded",
+    "backend_eject_after": 3,
+    "backend_eject_seconds": 30.0,
+    "backend_hedge_percentile": 0.0,
+    "backend_hedge_min_samples": 20,
+    "prompt_layout": "classic",
+    "thought_dedup_enabled": False,
+    "thought_dedup_threshold": 0.8,
+    "thought_dedup_min_words": 8,
+    "semantic_cache_enabled": False,
+    "semantic_cache_path": "",
+    "semantic_cache_max_entries": 1000,
+    "semantic_cache_dimensions": 4096,
+    "semantic_cache_threshold": 0.8,
+    "semantic_cache_mode": "answer",
+    "output_mode": "auto",
+    "output_frame_interval": 0.033,
+    "transcript_path": "",
+    "session_store_path": "",
+    "session_history_window": 20,
+    "session_idle_seconds": 3600,
+    "instrumentation_enabled": True,
+    "instrumentation_trace_path": "",
+    "instrumentation_metrics_path": "",
+    "early_stop_enabled": False,
+    "early_stop_policy": "threshold",
+    "early_stop_min_words": 60,
+    "early_stop_plateau_words": 200,
+    "early_stop_plateau_epsilon": 0.005,
+    "branching": {
+        "default": dict(DEFAULT_BRANCHING)
+    }
 }
 
 def load_config():
     config_path = os.path.join(os.path.dirname(__file__), 'config.json')
     if os.path.exists(config_path):
         with open(config_path, 'r') as f:
-            return json.load(f)
+            # Settings added after the file was written fall back to their defaults
+            return {**DEFAULT_CONFIG, **json.load(f)}
     return DEFAULT_CONFIG
 
 def save_config(config):
@@ -0,0 +1,92 @@
+import json
+import string
+from collections import Counter
+
+TASK_KEYWORDS = {
+    'product_development': ['product', 'business', 'market', 'customer', 'innovation'],
+    'scientific_research': ['research', 'experiment', 'hypothesis', 'data', 'analysis'],
+    'creative_writing': ['story', 'character', 'plot', 'writing', 'narrative'],
+    'coding': ['code', 'programming', 'function', 'algorithm', 'debug']
+}
+
+CONFIDENCE_KEYWORDS = {
+    'confidence': ['certain', 'confident', 'sure', 'likely', 'probable', 'definitely', 'undoubtedly'],
+    'uncertainty': ['uncertain', 'unsure', 'maybe', 'perhaps', 'possible', 'might', 'could']
+}
+
+# Punctuation becomes whitespace, so split() yields exactly the words a \b-delimited match would see
+_WORD_BREAKS = str.maketrans({char: ' ' for char in
+                              string.punctuation.replace('_', '') + '‘’“”–—…•«»'})
+
+def words(text):
+    """
+    Splits text into lowercase words, treating punctuation (including apostrophes) as breaks.
+    """
+    return text.lower().translate(_WORD_BREAKS).split()
+
+class KeywordMatcher:
+    """
+    Counts several keyword families with a single tokenization of the text.
+
+    Keywords match whole words only, case-insensitively, with an optional plural
+    's'/'es': "data" matches "data" but not "database", "could" does not match inside
+    "couldn't", and "certain" does not match inside "uncertain". Keywords of several
+    words match as a phrase. The cost does not grow with the number of keywords.
+    """
+
+    def __init__(self, families):
+        self.families = {family: list(keywords) for family, keywords in families.items()}
+        self._forms = {}
+        self._phrases = {}
+        for family, keywords in self.families.items():
+            for keyword in keywords:
+                parts = words(keyword)
+                if len(parts) == 1:
+                    for suffix in ('', 's', 'es'):
+                        self._forms.setdefault(parts[0] + suffix, family)
+                elif parts:
+                    self._phrases.setdefault(f" {' '.join(parts)} ", family)
+
+    def _count_words(self, tokens):
+        counts = dict.fromkeys(self.families, 0)
+        # Maps each word to its family (or None) and tallies them without a Python-level loop
+        counts.update(Counter(filter(None, map(self._forms.get, tokens))))
+        if self._phrases:
+            joined = f" {' '.join(tokens)} "
+            for phrase, family in self._phrases.items():
+                counts[family] += joined.count(phrase)
+        return counts
+
+    def count(self, text, start=0, end=None):
+        """
+        Returns {family: occurrences} for text[start:end].
+        """
+        if start or end is not None:
+            text = text[start:end]
+        return self._count_words(words(text))
+
+    def count_many(self, texts):
+        """
+        Returns the counts of every text in texts, in order. Each text is tokenized once and
+        all families are counted from those tokens; the texts themselves are handled one by one.
+        """
+        return [self._count_words(words(text)) for text in texts]
+
+_matchers = {}
+_matchers_by_table = {}
+
+def get_matcher(families):
+    """
+    Returns a matcher for a keyword table, building each distinct table only once.
+    Tables are treated as immutable; replace a table rather than editing it in place.
+    """
+    cached = _matchers_by_table.get(id(families))
+    if cached is not None and cached[0] is families:
+        return cached[1]
+
+    key = json.dumps(families, sort_keys=True)
+    matcher = _matchers.get(key)
+    if matcher is None:
+        matcher = _matchers[key] = KeywordMatcher(families)
+    _matchers_by_table[id(families)] = (families, matcher)
+    return matcher
@@ -1,23 +1,32 @@
+import argparse
 import os
-import sys
-from dotenv import load_dotenv
-from app.services.chat_service import chat
 from app.utils import BOLD, GREEN, RED, RESET
-import argparse
 from app.config import CONFIG, save_config
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run the chat application')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose logging')
+    parser.add_argument('-i', '--iterations', type=int, help='Set the number of iterations before feedback')
+    parser.add_argument('--batch', metavar='INPUT', help='Answer every prompt in a JSONL file without feedback')
+    parser.add_argument('--output', metavar='OUTPUT', help='JSONL file the batch results are appended to')
+    parser.add_argument('--workers', type=int, default=4, help='Number of batch records processed concurrently')
+    parser.add_argument('--session', metavar='ID', help='Resume a session from the session store')
+    parser.add_argument('--record', metavar='PATH', help='Append a transcript of every turn to a JSONL file')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    # Parsed before anything else so --help and argument errors return without loading the app
+    args = parse_args(argv)
     try:
+        from dotenv import load_dotenv
         load_dotenv()
 
-        parser = argparse.ArgumentParser(description='Run the chat application')
-        parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose logging')
-        parser.add_argument('-i', '--iterations', type=int, help='Set the number of iterations before feedback')
-        args = parser.parse_args()
-
         if args.verbose:
             os.environ['VERBOSE_LOGGING'] = '1'
 
+        if args.record:
+            CONFIG['transcript_path'] = args.record
+
         if args.iterations is not None:
             CONFIG['iterations_before_feedback'] = args.iterations
             save_config(CONFIG)
@@ -31,7 +40,21 @@ def main():
             print("Please run the setup script again.")
             return
 
-        chat()
+        if args.batch:
+            if not args.output:
+                print(f"{BOLD}{RED}Error: --batch requires --output.{RESET}")
+                return
+            import asyncio
+            from app.services.batch_service import run_batch
+            asyncio.run(run_batch(args.batch, args.output, workers=args.workers))
+            return
+
+        if args.session and not CONFIG['session_store_path']:
+            print(f"{BOLD}{RED}Error: --session requires session_store_path in the config.{RESET}")
+            return
+
+        from app.services.chat_service import chat
+        chat(args.session)
     except Exception as e:
         print(f"{BOLD}{RED}An error occurred while starting the application:{RESET}")
         print(f"{str(e)}")
@@ -42,13 +65,4 @@ def main():
             traceback.print_exc()
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Run the chat application')
-    parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose logging')
-    parser.add_argument('-i', '--iterations', type=int, help='Set the number of iterations before feedback')
-    args = parser.parse_args()
     main()
-
-    if args.iterations is not None:
-        CONFIG['iterations_before_feedback'] = args.iterations
-        save_config(CONFIG)
-        print(f"{BOLD}{GREEN}Updated iterations before feedback to {args.iterations}{RESET}")
\ No newline at end of file
@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from aiohttp import web
+from app.prompts import TRAILER_MARKER
+
+# Generated completions mix markdown, keyword hits and filler, like a real reasoning model
+GENERATED_WORDS = [
+    'the', 'a', 'we', 'should', 'consider', 'approach', 'results', 'users', 'data', 'analysis',
+    'likely', 'certain', 'perhaps', 'might', 'market', 'function', 'step', 'because', 'then', 'and',
+]
+
+def _score_reply(rng):
+    return f"{rng.uniform(0.5, 0.95):.2f}"
+
+def _trailer_tokens(rng):
+    score = rng.uniform(0.5, 0.95)
+    trailer = {'score': round(score, 2), 'criteria_covered': [], 'ready': score > 0.85}
+    return [f"\n{TRAILER_MARKER}\n", json.dumps(trailer)]
+
+def generate_tokens(rng, count):
+    """
+    Returns `count` generated tokens (words with their trailing whitespace).
+    """
+    tokens = []
+    for position in range(count):
+        roll = rng.random()
+        if roll < 0.03 and position:
+            tokens.append(f"\n## {rng.choice(GENERATED_WORDS).title()}\n")
+        elif roll < 0.08:
+            tokens.append(f"**{rng.choice(GENERATED_WORDS)}** ")
+        elif roll < 0.12:
+            tokens.append("\n- ")
+        else:
+            tokens.append(rng.choice(GENERATED_WORDS) + " ")
+    return tokens
+
+def load_script(path):
+    """
+    Reads scripted completions: a JSON list of strings, or a JSONL file of
+    {"content": ...} objects. Completions are served in order, round robin.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    try:
+        script = json.loads(text)
+    except json.JSONDecodeError:
+        script = [json.loads(line)['content'] for line in text.splitlines() if line.strip()]
+    if not isinstance(script, list) or not script:
+        raise ValueError('The script must contain at least one completion.')
+    return [str(entry) for entry in script]
+
+def _split_tokens(text):
+    # Keeps the whitespace so the joined stream matches the script exactly
+    tokens = []
+    start = 0
+    for index in range(1, len(text)):
+        if text[index - 1].isspace() and not text[index].isspace():
+            tokens.append(text[start:index])
+            start = index
+    tokens.append(text[start:])
+    return tokens
+
+def _completion_tokens(app, body):
+    settings = app['mock']
+    rng = app['rng']
+    max_tokens = body.get('max_tokens')
+    # Short requests are the self-evaluation stage, which expects a bare score
+    if max_tokens is not None and max_tokens < 32:
+        return [_score_reply(rng)]
+    if settings['script']:
+        text = settings['script'][app['stats']['requests'] % len(settings['script'])]
+        return _split_tokens(text)
+    count = settings['completion_tokens']
+    if max_tokens:
+        count = min(count, max_tokens)
+    tokens = generate_tokens(rng, count)
+    # Iterations asked for a structured trailer end with one, as an instruction-following model's would.
+    # Only the messages after the last reply count: earlier requests replayed in the history do not.
+    messages = body.get('messages', [])
+    replies = [index for index, message in enumerate(messages) if message.get('role') == 'assistant']
+    request = messages[replies[-1] + 1:] if replies else messages
+    if any(TRAILER_MARKER in (message.get('content') or '') for message in request):
+        tokens.extend(_trailer_tokens(rng))
+    return tokens
+
+def _failure(app):
+    settings = app['mock']
+    if settings['failure_rate'] and app['rng'].random() < settings['failure_rate']:
+        app['stats']['failures'] += 1
+        status = settings['failure_status']
+        headers = {'Retry-After': str(settings['retry_after'])} if status == 429 else {}
+        return web.json_response(
+            {'error': {'message': 'Injected failure', 'type': 'mock_error', 'code': status}},
+            status=status, headers=headers
+        )
+    return None
+
+def _chunk(completion_id, model, created, delta, finish_reason=None):
+    payload = {
+        'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n".encode('utf-8')
+
+async def chat_completions_handler(request):
+    app = request.app
+    settings = app['mock']
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return web.json_response({'error': {'message': 'Invalid JSON body.'}}, status=400)
+
+    failure = _failure(app)
+    if failure is not None:
+        return failure
+
+    tokens = _completion_tokens(app, body)
+    app['stats']['requests'] += 1
+    app['stats']['tokens'] += len(tokens)
+    model = body.get('model', 'mock')
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    interval = 1 / settings['tokens_per_sec'] if settings['tokens_per_sec'] else 0
+
+    await asyncio.sleep(settings['ttft'])
+    if not body.get('stream'):
+        await asyncio.sleep(interval * len(tokens))
+        return web.json_response({
+            'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': "".join(tokens)},
+                         'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': len(tokens), 'total_tokens': len(tokens)},
+        })
+
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+    await response.prepare(request)
+    disconnect_at = None
+    if settings['disconnect_rate'] and app['rng'].random() < settings['disconnect_rate']:
+        disconnect_at = app['rng'].randrange(len(tokens))
+        app['stats']['disconnects'] += 1
+
+    await response.write(_chunk(completion_id, model, created, {'role': 'assistant', 'content': ''}))
+    # Sleeps are scheduled against the start time so event loop jitter does not accumulate
+    started = time.perf_counter()
+    for index, token in enumerate(tokens):
+        if disconnect_at is not None and index == disconnect_at:
+            # Drops the connection mid-stream without the closing [DONE]
+            request.transport.close()
+            return response
+        delay = started + index * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await response.write(_chunk(completion_id, model, created, {'content': token}))
+    await response.write(_chunk(completion_id, model, created, {}, 'stop'))
+    await response.write(b"data: [DONE]\n\n")
+    return response
+
+async def models_handler(request):
+    return web.json_response({'object': 'list', 'data': [{'id': 'mock', 'object': 'model', 'owned_by': 'mock'}]})
+
+async def stats_handler(request):
+    return web.json_response(request.app['stats'])
+
+def create_mock_app(ttft=0.05, tokens_per_sec=200.0, completion_tokens=200, failure_rate=0.0,
+                    failure_status=500, retry_after=1, disconnect_rate=0.0, script=None, seed=None):
+    """
+    Builds an OpenAI-compatible chat completions server for local benchmarking.
+
+    :param ttft: Seconds before the first token of every completion.
+    :param tokens_per_sec: Streaming rate; 0 streams as fast as possible.
+    :param completion_tokens: Length of generated completions (capped by max_tokens).
+    :param failure_rate: Share of requests answered with `failure_status` instead.
+    :param disconnect_rate: Share of streams cut off at a random token.
+    :param script: List of completions to serve in order instead of generated text.
+    """
+    app = web.Application()
+    app['mock'] = {
+        'ttft': ttft,
+        'tokens_per_sec': tokens_per_sec,
+        'completion_tokens': completion_tokens,
+        'failure_rate': failure_rate,
+        'failure_status': failure_status,
+        'retry_after': retry_after,
+        'disconnect_rate': disconnect_rate,
+        'script': script,
+    }
+    app['rng'] = random.Random(seed)
+    app['stats'] = {'requests': 0, 'tokens': 0, 'failures': 0, 'disconnects': 0}
+    app.router.add_post('/v1/chat/completions', chat_completions_handler)
+    app.router.add_get('/v1/models', models_handler)
+    app.router.add_get('/mock/stats', stats_handler)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a mock OpenAI-compatible server')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to bind to')
+    parser.add_argument('--port', type=int, default=1234, help='Port to listen on')
+    parser.add_argument('--ttft', type=float, default=0.05, help='Seconds before the first token')
+    parser.add_argument('--tokens-per-sec', type=float, default=200, help='Streaming rate (0 for unthrottled)')
+    parser.add_argument('--completion-tokens', type=int, default=200, help='Tokens per generated completion')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Share of requests that fail')
+    parser.add_argument('--failure-status', type=int, default=500, help='HTTP status of injected failures')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429 failures')
+    parser.add_argument('--disconnect-rate', type=float, default=0.0, help='Share of streams cut off mid-way')
+    parser.add_argument('--script', metavar='PATH', help='JSON list or JSONL file of completions to serve')
+    parser.add_argument('--seed', type=int, help='Seed for generated text and failure injection')
+    args = parser.parse_args()
+
+    app = create_mock_app(
+        ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, completion_tokens=args.completion_tokens,
+        failure_rate=args.failure_rate, failure_status=args.failure_status, retry_after=args.retry_after,
+        disconnect_rate=args.disconnect_rate, script=load_script(args.script) if args.script else None,
+        seed=args.seed
+    )
+    web.run_app(app, host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
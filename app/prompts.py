@@ -64,6 +64,38 @@ Explore hypothetical "what-if" scenarios and potential counterarguments.
 Incorporate quantitative analysis where appropriate.
 Do not return a final answer, just return the step-by-step thought process."""
 
+def get_stable_thought_process_prompt(task_type='general'):
+    """
+    The thought process prompt without anything that changes between iterations,
+    for the prefix-stable layout; get_iteration_instruction() carries the rest.
+    """
+    task_type = task_type if task_type in task_specific_prompts else 'general'
+
+    return f"""You will think through the user's request over several iterations.
+You will follow the structured process laid out below to ensure a logical flow:
+{task_specific_prompts[task_type]}
+Explore hypothetical "what-if" scenarios and potential counterarguments.
+Incorporate quantitative analysis where appropriate.
+Your earlier iterations appear as your previous replies.
+Do not return a final answer, just return the step-by-step thought process."""
+
+TRAILER_MARKER = "<<<ASSESSMENT>>>"
+
+def get_trailer_instruction(evaluation_criteria):
+    return f"""After your thoughts, end your reply with the line {TRAILER_MARKER} followed by one line of JSON and nothing else:
+{{"score": <0 to 1, how sound and complete the thought process is so far>, "criteria_covered": [<the criteria your thoughts already address>], "ready": <true if the thoughts are enough to write the final answer>}}
+The criteria are: {', '.join(evaluation_criteria)}."""
+
+def get_iteration_instruction(iteration):
+    return f"""This is iteration {iteration} of the thought process.{' Refine and expand upon the previous thoughts.' if iteration > 1 else ''}"""
+
+def get_final_answer_instruction(evaluation_criteria):
+    return f"""Now provide a final answer based on the thought process above.
+Evaluate the solution based on these criteria: {', '.join(evaluation_criteria)}.
+Provide citations for any factual claims or data points.
+Consider potential limitations or areas for further research.
+Provide a concise and clear final answer to the user's request."""
+
 def get_final_answer_prompt(thought_process, evaluation_criteria):
     return f"""You are an AI assistant providing a final answer based on the following thought process:
 
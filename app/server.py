@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import json
+import time
+from aiohttp import web
+from app.config import CONFIG
+from app.services.reasoning_engine import create_session, resume_session, run_turn
+from app.services.session_store import get_session_store
+from app.services.response_cache import get_response_cache
+from app.services.instrumentation import get_prometheus_sink, get_route_summary
+from app.services.openai_service import get_pool
+
+# Idle SSE streams get a comment line this often so proxies keep them open
+KEEPALIVE_SECONDS = 15
+
+def _json_error(status, message):
+    return web.json_response({'error': message}, status=status)
+
+# How often idle sessions are dropped from memory when a session store keeps them on disk
+EVICT_INTERVAL_SECONDS = 60
+
+# Events buffered per session for its SSE clients; the oldest are dropped beyond this
+EVENT_BUFFER_SIZE = 1000
+
+def _new_entry(session):
+    return {
+        'session': session,
+        'events': asyncio.Queue(EVENT_BUFFER_SIZE),
+        'feedback': asyncio.Queue(),
+        'task': None,
+        'awaiting_feedback': False,
+        'last_used': time.monotonic(),
+        'subscribers': 0,
+    }
+
+def _get_entry(request):
+    """
+    Returns a session's entry, reloading it from the session store when it is not in memory.
+    """
+    sessions = request.app['sessions']
+    session_id = request.match_info['session_id']
+    entry = sessions.get(session_id)
+    if entry is None:
+        session = resume_session(session_id)
+        if session is None:
+            return None
+        entry = sessions[session_id] = _new_entry(session)
+    entry['last_used'] = time.monotonic()
+    return entry
+
+async def _read_json(request):
+    if not request.can_read_body:
+        return {}
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return body if isinstance(body, dict) else None
+
+def _publish(entry, event):
+    """
+    Queues an event for the session's SSE clients. A full queue, as when nobody is
+    subscribed, drops its oldest event, so memory stays flat however long a session runs.
+    """
+    events = entry['events']
+    if events.full():
+        events.get_nowait()
+    events.put_nowait(event)
+
+async def _run_session_turn(entry, user_message):
+    """
+    Runs one engine turn for a session, forwarding every event to its SSE queue.
+    """
+    feedback = entry['feedback']
+
+    async def get_feedback():
+        entry['awaiting_feedback'] = True
+        try:
+            return await feedback.get()
+        finally:
+            entry['awaiting_feedback'] = False
+
+    try:
+        async for event in run_turn(entry['session'], user_message, get_feedback=get_feedback):
+            _publish(entry, event)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        _publish(entry, {'type': 'error', 'stage': 'server', 'error': str(e)})
+    finally:
+        entry['task'] = None
+        _publish(entry, {'type': 'turn_end'})
+
+async def create_session_handler(request):
+    body = await _read_json(request)
+    if body is None:
+        return _json_error(400, 'Request body must be a JSON object.')
+
+    config = body.get('config', {})
+    if not isinstance(config, dict):
+        return _json_error(400, "'config' must be a JSON object.")
+
+    # Only known settings may be overridden per session
+    overrides = {key: value for key, value in config.items() if key in CONFIG}
+    session = create_session(overrides)
+    request.app['sessions'][session['id']] = _new_entry(session)
+    return web.json_response({'session_id': session['id'], 'config': session['config']}, status=201)
+
+async def get_session_handler(request):
+    entry = _get_entry(request)
+    if entry is None:
+        return _json_error(404, 'Unknown session.')
+
+    session = entry['session']
+    chat_history = session['chat_history']
+    history_offset = session['history_offset']
+    store = get_session_store()
+    # ?history=full reads the turns that were trimmed from memory back from disk
+    if request.query.get('history') == 'full' and store is not None and history_offset:
+        chat_history = store.history(session['id'], 0, history_offset) + chat_history
+        history_offset = 0
+    return web.json_response({
+        'session_id': session['id'],
+        'config': session['config'],
+        'task_type': session['task_type'],
+        'iteration': session['iteration'],
+        'thought_process': session['thought_process'],
+        'chat_history': chat_history,
+        'history_offset': history_offset,
+        'turns': session['turn'],
+        'prefix_stats': session['prefix_stats'],
+        'pending_message': session['pending_turn']['message'] if session['pending_turn'] else None,
+        'running': entry['task'] is not None,
+        'awaiting_feedback': entry['awaiting_feedback'],
+    })
+
+async def delete_session_handler(request):
+    session_id = request.match_info['session_id']
+    entry = request.app['sessions'].pop(session_id, None)
+    store = get_session_store()
+    # An evicted session is only on disk
+    stored = store is not None and store.exists(session_id)
+    if entry is None and not stored:
+        return _json_error(404, 'Unknown session.')
+
+    task = entry['task'] if entry is not None else None
+    if task is not None:
+        task.cancel()
+        # Waited for, so a turn being cancelled cannot write its log again after it is removed
+        await asyncio.gather(task, return_exceptions=True)
+    if stored:
+        store.delete(session_id)
+    return web.json_response({'deleted': True})
+
+async def send_message_handler(request):
+    entry = _get_entry(request)
+    if entry is None:
+        return _json_error(404, 'Unknown session.')
+
+    body = await _read_json(request)
+    user_message = (body or {}).get('message', '')
+    if not isinstance(user_message, str) or not user_message.strip():
+        return _json_error(400, 'Empty message.')
+    if entry['task'] is not None:
+        return _json_error(409, 'A message is already being processed for this session.')
+
+    entry['task'] = asyncio.create_task(_run_session_turn(entry, user_message.strip()))
+    return web.json_response({'accepted': True}, status=202)
+
+async def _submit_feedback(request, feedback):
+    entry = _get_entry(request)
+    if entry is None:
+        return _json_error(404, 'Unknown session.')
+    if not entry['awaiting_feedback']:
+        return _json_error(409, 'The session is not waiting for feedback.')
+
+    await entry['feedback'].put(feedback)
+    return web.json_response({'accepted': True}, status=202)
+
+async def feedback_handler(request):
+    body = await _read_json(request)
+    if body is None:
+        return _json_error(400, 'Request body must be a JSON object.')
+
+    # Mirrors get_user_feedback(): empty text continues, stop words finalize
+    feedback = str(body.get('feedback', '')).strip()
+    if feedback.lower() in ['', 'continue', 'next']:
+        feedback = None
+    elif feedback.lower() in ['stop', 'exit', 'finalize']:
+        feedback = 'finalize'
+    return await _submit_feedback(request, feedback)
+
+async def finalize_handler(request):
+    return await _submit_feedback(request, 'finalize')
+
+async def events_handler(request):
+    """
+    Streams a session's engine events as Server-Sent Events.
+    """
+    entry = _get_entry(request)
+    if entry is None:
+        return _json_error(404, 'Unknown session.')
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    await response.prepare(request)
+
+    events = entry['events']
+    # A session with a connected client is never evicted: a reloaded entry would get a new event queue
+    entry['subscribers'] += 1
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                await response.write(b": keepalive\n\n")
+                continue
+            except asyncio.CancelledError:
+                break
+
+            payload = json.dumps(event)
+            await response.write(f"event: {event['type']}\ndata: {payload}\n\n".encode('utf-8'))
+    finally:
+        entry['subscribers'] -= 1
+        entry['last_used'] = time.monotonic()
+
+    return response
+
+async def stats_handler(request):
+    # Imported on demand; the client stack is otherwise loaded by the first model request
+    from app.services import transport
+
+    cache = get_response_cache()
+    semantic_cache = None
+    if CONFIG['semantic_cache_enabled']:
+        from app.services.semantic_cache import get_semantic_cache
+        semantic_cache = get_semantic_cache()
+    return web.json_response({
+        'sessions': len(request.app['sessions']),
+        'response_cache': cache.stats() if cache is not None else None,
+        'semantic_cache': semantic_cache.stats() if semantic_cache is not None else None,
+        'transport': transport.stats,
+        'backends': get_pool().describe(),
+        'routes': get_route_summary(),
+    })
+
+async def metrics_handler(request):
+    sink = get_prometheus_sink()
+    if sink is None:
+        return _json_error(404, 'Instrumentation is disabled.')
+    return web.Response(text=sink.render(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+async def _evict_idle_sessions(app):
+    """
+    Drops sessions idle for longer than session_idle_seconds; they reload from the store on next use.
+    """
+    while True:
+        await asyncio.sleep(EVICT_INTERVAL_SECONDS)
+        cutoff = time.monotonic() - CONFIG['session_idle_seconds']
+        sessions = app['sessions']
+        for session_id in [key for key, entry in sessions.items()
+                           if entry['task'] is None and not entry['subscribers'] and entry['last_used'] < cutoff]:
+            del sessions[session_id]
+
+async def _start_eviction(app):
+    if get_session_store() is not None:
+        app['evictor'] = asyncio.create_task(_evict_idle_sessions(app))
+
+async def _stop_eviction(app):
+    task = app.get('evictor')
+    if task is not None:
+        task.cancel()
+
+async def _cancel_sessions(app):
+    for entry in app['sessions'].values():
+        if entry['task'] is not None:
+            entry['task'].cancel()
+
+def create_app():
+    app = web.Application()
+    app['sessions'] = {}
+    app.router.add_post('/sessions', create_session_handler)
+    app.router.add_get('/sessions/{session_id}', get_session_handler)
+    app.router.add_delete('/sessions/{session_id}', delete_session_handler)
+    app.router.add_post('/sessions/{session_id}/messages', send_message_handler)
+    app.router.add_post('/sessions/{session_id}/feedback', feedback_handler)
+    app.router.add_post('/sessions/{session_id}/finalize', finalize_handler)
+    app.router.add_get('/sessions/{session_id}/events', events_handler)
+    app.router.add_get('/stats', stats_handler)
+    app.router.add_get('/metrics', metrics_handler)
+    app.on_startup.append(_start_eviction)
+    app.on_shutdown.append(_stop_eviction)
+    app.on_shutdown.append(_cancel_sessions)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the PyThoughtChain HTTP server')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to bind to')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    args = parser.parse_args()
+
+    # Same as the CLI: the key and endpoint written by setup.py live in .env
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,419 @@
+import asyncio
+import threading
+import time
+import weakref
+from collections import deque
+import openai
+from app.config import CONFIG
+from app.services import transport
+
+# Weight of the newest sample in a backend's moving average of time to first token
+LATENCY_SMOOTHING = 0.2
+# Recent first-token latencies kept for the hedging percentile
+LATENCY_WINDOW = 200
+
+def _counts_against_health(error):
+    """
+    Connection failures, timeouts and server errors count against a backend; rate
+    limiting and client errors do not, since the backend itself is working.
+    """
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return isinstance(error, (openai.APIConnectionError, openai.APITimeoutError))
+
+class Backend:
+    """
+    One OpenAI-compatible server with its clients, load and health.
+    """
+
+    def __init__(self, name, base_url, api_key, weight=1.0, max_concurrency=0, model=None):
+        self.name = name
+        self.base_url = base_url
+        self.weight = weight if weight > 0 else 1.0
+        self.max_concurrency = max_concurrency
+        self.model = model
+        self.client, self.async_client = transport.create_clients(base_url, api_key)
+        self.in_flight = 0
+        self.latency = None
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.probing = False
+        self.stats = {'requests': 0, 'errors': 0, 'ejections': 0, 'hedges': 0, 'hedge_wins': 0}
+
+    def available(self, now):
+        if self.ejected_until > now:
+            return False
+        return not self.max_concurrency or self.in_flight < self.max_concurrency
+
+    def describe(self):
+        return {
+            'name': self.name,
+            'base_url': self.base_url,
+            'weight': self.weight,
+            'in_flight': self.in_flight,
+            'max_concurrency': self.max_concurrency,
+            'latency': self.latency,
+            'healthy': self.ejected_until <= time.monotonic(),
+            **self.stats,
+        }
+
+class BackendPool:
+    """
+    Spreads requests over several backends. Each request goes to the available
+    backend with the lowest load per unit of weight ('least_loaded') or the
+    lowest expected first-token latency ('latency'). Backends that keep failing
+    are ejected and health-checked until they answer again.
+    """
+
+    def __init__(self, backends, selection='least_loaded', eject_after=3, eject_seconds=30.0,
+                 hedge_percentile=0.0, hedge_min_samples=20):
+        self.backends = backends
+        self.selection = selection
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._freed = threading.Condition(self._lock)
+        self._async_freed = weakref.WeakKeyDictionary()
+
+    def _cost(self, backend):
+        if self.selection != 'latency':
+            return (backend.in_flight + 1) / backend.weight
+        if backend.latency is None:
+            return 0.0
+        return backend.latency * (backend.in_flight + 1) / backend.weight
+
+    def _pick(self, exclude=()):
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b not in exclude and b.available(now)]
+        if not candidates:
+            return None
+        # Ties go to the faster backend; those without a latency sample yet are tried first
+        backend = min(candidates, key=lambda b: (self._cost(b), b.latency or 0.0))
+        backend.in_flight += 1
+        return backend
+
+    def _all_ejected(self, exclude):
+        now = time.monotonic()
+        return all(b.ejected_until > now for b in self.backends if b not in exclude)
+
+    def _fallback(self, exclude):
+        # With every backend ejected, the one due back soonest is tried rather than failing outright
+        candidates = [b for b in self.backends if b not in exclude] or self.backends
+        backend = min(candidates, key=lambda b: b.ejected_until)
+        backend.in_flight += 1
+        return backend
+
+    def acquire(self, exclude=()):
+        """
+        Returns the backend for a request, waiting while every backend is at its cap.
+        """
+        with self._freed:
+            while True:
+                backend = self._pick(exclude)
+                if backend is not None:
+                    return backend
+                if self._all_ejected(exclude):
+                    return self._fallback(exclude)
+                self._freed.wait(timeout=1.0)
+
+    async def acquire_async(self, exclude=()):
+        while True:
+            with self._lock:
+                backend = self._pick(exclude)
+                if backend is None and self._all_ejected(exclude):
+                    backend = self._fallback(exclude)
+                if backend is not None:
+                    return backend
+                loop = asyncio.get_running_loop()
+                freed = self._async_freed.get(loop)
+                if freed is None:
+                    freed = self._async_freed[loop] = asyncio.Event()
+                freed.clear()
+            try:
+                await asyncio.wait_for(freed.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, backend, error=None, latency=None, completed=True):
+        """
+        Returns a backend's slot and records the outcome of its request.
+        Requests abandoned before they finished (completed=False) say nothing about health.
+        """
+        with self._freed:
+            backend.in_flight -= 1
+            backend.stats['requests'] += 1
+            if latency is not None:
+                self.latencies.append(latency)
+                backend.latency = latency if backend.latency is None else (
+                    LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * backend.latency
+                )
+            if error is not None:
+                backend.stats['errors'] += 1
+                if _counts_against_health(error):
+                    backend.failures += 1
+                    if backend.failures >= self.eject_after:
+                        self._eject(backend)
+            elif completed:
+                backend.failures = 0
+            self._freed.notify_all()
+        for loop, freed in list(self._async_freed.items()):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(freed.set)
+
+    def _eject(self, backend):
+        backend.failures = 0
+        backend.ejected_until = time.monotonic() + self.eject_seconds
+        backend.stats['ejections'] += 1
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Without an event loop the backend simply becomes eligible again once the time is up
+            return
+        if not backend.probing:
+            backend.probing = True
+            asyncio.ensure_future(self._health_check(backend))
+
+    async def _health_check(self, backend):
+        """
+        Polls an ejected backend's model list and lets it back in as soon as it answers.
+        """
+        delay = self.eject_seconds
+        try:
+            while True:
+                await asyncio.sleep(max(0.0, backend.ejected_until - time.monotonic()))
+                try:
+                    await backend.async_client.models.list()
+                except Exception:
+                    delay = min(delay * 2, 300.0)
+                    backend.ejected_until = time.monotonic() + delay
+                    continue
+                backend.ejected_until = 0.0
+                return
+        finally:
+            backend.probing = False
+
+    def hedge_delay(self):
+        """
+        Returns how long to wait for a first token before hedging, or None when hedging is off.
+        """
+        if not self.hedge_percentile or len(self.backends) < 2 or len(self.latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))]
+
+    def describe(self):
+        return [backend.describe() for backend in self.backends]
+
+def _request(backend, kwargs):
+    # A model chosen by the caller's route wins over the backend's own
+    if kwargs.get('model') is None:
+        return {**kwargs, 'model': backend.model}
+    return kwargs
+
+class BackendStream:
+    """
+    Passes a stream through and returns its backend's slot when it ends, fails or
+    is closed. The first chunk may already have been read while hedging.
+    """
+
+    def __init__(self, pool, backend, stream, started, first=None, iterator=None, first_latency=None):
+        self._pool = pool
+        self._backend = backend
+        self._stream = stream
+        self._started = started
+        self._first = first
+        self._iterator = iterator
+        self._first_latency = first_latency
+        self._released = False
+
+    def _release(self, error=None, latency=None, completed=True):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._backend, error=error, latency=latency, completed=completed)
+
+    def __iter__(self):
+        latency = None
+        try:
+            for chunk in self._stream:
+                if latency is None:
+                    latency = time.perf_counter() - self._started
+                yield chunk
+        except Exception as e:
+            self._release(error=e, latency=latency)
+            raise
+        finally:
+            self._release(latency=latency)
+
+    async def __aiter__(self):
+        latency = None
+        try:
+            if self._iterator is not None:
+                latency = self._first_latency
+                yield self._first
+                iterator = self._iterator
+            else:
+                iterator = self._stream.__aiter__()
+            async for chunk in iterator:
+                if latency is None:
+                    latency = time.perf_counter() - self._started
+                yield chunk
+        except Exception as e:
+            self._release(error=e, latency=latency)
+            raise
+        finally:
+            self._release(latency=latency)
+
+    def close(self):
+        self._release(latency=self._first_latency, completed=False)
+        return self._stream.close()
+
+def _claim(pool, tried, excluded):
+    # Once every allowed backend has been tried, retries may go to any of them again
+    if len(tried) + len(excluded) >= len(pool.backends):
+        tried.clear()
+    return tried | excluded
+
+def _sync_attempt(pool, tried, excluded):
+    def attempt(**kwargs):
+        backend = pool.acquire(exclude=_claim(pool, tried, excluded))
+        tried.add(backend)
+        started = time.perf_counter()
+        try:
+            completion = backend.client.chat.completions.create(**_request(backend, kwargs))
+        except Exception as e:
+            pool.release(backend, error=e)
+            raise
+        if kwargs.get('stream'):
+            return BackendStream(pool, backend, completion, started)
+        pool.release(backend)
+        return completion
+    return attempt
+
+async def _open(pool, backend, kwargs):
+    """
+    Opens a stream on a backend and reads its first chunk, for hedging.
+    """
+    started = time.perf_counter()
+    stream = None
+    try:
+        stream = await backend.async_client.chat.completions.create(**_request(backend, kwargs))
+        iterator = stream.__aiter__()
+        first = await iterator.__anext__()
+    except BaseException as e:
+        if stream is not None:
+            await stream.close()
+        # A cancelled hedge loser was not at fault
+        failed = isinstance(e, Exception)
+        pool.release(backend, error=e if failed else None, completed=failed)
+        raise
+    return BackendStream(pool, backend, stream, started, first, iterator, time.perf_counter() - started)
+
+async def _hedged(pool, backend, kwargs, delay, excluded):
+    """
+    Starts a duplicate on a second backend if the first token is slower than `delay`,
+    keeps whichever stream answers first and closes the other.
+    """
+    primary = asyncio.ensure_future(_open(pool, backend, kwargs))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+
+    with pool._lock:
+        second = pool._pick(exclude={backend} | excluded)
+    if second is None:
+        return await primary
+    second.stats['hedges'] += 1
+    secondary = asyncio.ensure_future(_open(pool, second, kwargs))
+
+    pending = {primary, secondary}
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        winners = [task for task in done if task.exception() is None]
+        for task in done:
+            error = error or task.exception()
+        if winners:
+            for loser in pending:
+                loser.cancel()
+            # Both may have answered in the same instant; the spare stream is closed
+            for spare in winners[1:]:
+                await spare.result().close()
+            if winners[0] is secondary:
+                second.stats['hedge_wins'] += 1
+            return winners[0].result()
+    raise error
+
+def _async_attempt(pool, tried, excluded):
+    async def attempt(**kwargs):
+        backend = await pool.acquire_async(exclude=_claim(pool, tried, excluded))
+        tried.add(backend)
+        delay = pool.hedge_delay() if kwargs.get('stream') else None
+        if delay is not None:
+            return await _hedged(pool, backend, kwargs, delay, excluded)
+
+        started = time.perf_counter()
+        try:
+            completion = await backend.async_client.chat.completions.create(**_request(backend, kwargs))
+        except BaseException as e:
+            failed = isinstance(e, Exception)
+            pool.release(backend, error=e if failed else None, completed=failed)
+            raise
+        if kwargs.get('stream'):
+            return BackendStream(pool, backend, completion, started)
+        # Only first-token latencies feed the latency estimates, so full completions are left out
+        pool.release(backend)
+        return completion
+    return attempt
+
+def _excluded(pool, names):
+    """
+    Returns the backends a request may not use when it is limited to the backends in `names`.
+    """
+    if not names:
+        return set()
+    excluded = {backend for backend in pool.backends if backend.name not in names}
+    if len(excluded) == len(pool.backends):
+        raise ValueError(f"No backend named {', '.join(names)}.")
+    return excluded
+
+def create_completion(pool, backends=None, **kwargs):
+    """
+    Sends a chat completion to the pool, or only to the backends named in `backends`;
+    retries move on to backends not tried yet. A model of None uses each backend's own.
+    """
+    return transport.create_completion(_sync_attempt(pool, set(), _excluded(pool, backends)), **kwargs)
+
+async def create_completion_async(pool, backends=None, **kwargs):
+    return await transport.create_completion_async(_async_attempt(pool, set(), _excluded(pool, backends)), **kwargs)
+
+def create_pool(default_base_url, default_api_key, config=None, default_model=None):
+    """
+    Builds the pool described by config['backends'], a list of
+    {"name", "base_url", "api_key", "weight", "max_concurrency", "model"} entries. When
+    the list is empty, the single backend given by the defaults is used. Backends
+    without a model of their own serve `default_model`.
+    """
+    config = config or CONFIG
+    entries = config.get('backends') or [{'base_url': default_base_url}]
+    backends = [
+        Backend(
+            entry.get('name') or entry['base_url'],
+            entry['base_url'],
+            entry.get('api_key') or default_api_key,
+            weight=entry.get('weight', 1.0),
+            max_concurrency=entry.get('max_concurrency', 0),
+            model=entry.get('model') or default_model
+        )
+        for entry in entries
+    ]
+    return BackendPool(
+        backends,
+        selection=config['backend_selection'],
+        eject_after=config['backend_eject_after'],
+        eject_seconds=config['backend_eject_seconds'],
+        hedge_percentile=config['backend_hedge_percentile'],
+        hedge_min_samples=config['backend_hedge_min_samples']
+    )
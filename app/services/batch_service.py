@@ -0,0 +1,194 @@
+import asyncio
+import json
+import os
+import time
+from app.config import CONFIG
+from app.utils import BOLD, RED, GREEN, CYAN, RESET
+from app.services.reasoning_engine import create_session, run_turn
+
+def _completed_ids(output_path):
+    """
+    Returns the ids already answered successfully in an existing results file.
+    Records that failed are not included, so a resumed run retries them.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a truncated last line behind
+                continue
+            if result.get('status') == 'ok':
+                completed.add(str(result.get('id')))
+    return completed
+
+def _drop_partial_line(output_path):
+    """
+    Cuts a truncated last line off a results file, so the next result starts on a line of its own.
+    """
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if not size:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Read back in blocks until the last complete line's newline is found
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                f.truncate(start + newline + 1)
+                return
+            end = start
+        f.truncate(0)
+
+def _read_records(input_path, skip_ids):
+    """
+    Lazily yields (id, record) pairs from a JSONL file, skipping ids in skip_ids.
+    A record is either a JSON string or an object with a 'message' (or 'prompt') key.
+    Records without an 'id' are identified by their line number.
+    """
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                record = {'error': f"Invalid JSON on line {line_number}: {e}"}
+            if isinstance(record, str):
+                record = {'message': record}
+            elif not isinstance(record, dict):
+                record = {'error': f"Line {line_number} is not a JSON object or string."}
+
+            record_id = str(record.get('id', line_number))
+            if record_id not in skip_ids:
+                yield record_id, record
+
+async def process_record(record_id, record):
+    """
+    Runs one record through the engine with feedback disabled and collects the result.
+    """
+    user_message = record.get('message', record.get('prompt', ''))
+    result = {
+        'id': record_id,
+        'message': user_message,
+        'status': 'ok',
+        'task_type': None,
+        'criteria': [],
+        'iterations': [],
+        'final_answer': None,
+        'errors': [],
+        'timings': {},
+    }
+
+    if 'error' in record or not isinstance(user_message, str) or not user_message.strip():
+        result['status'] = 'error'
+        result['errors'].append(record.get('error', 'Empty message.'))
+        result['timings']['total'] = 0.0
+        return result
+
+    config = record.get('config') if isinstance(record.get('config'), dict) else {}
+    overrides = {key: value for key, value in config.items() if key in CONFIG}
+    session = create_session(overrides)
+
+    started = time.perf_counter()
+    mark = started
+    first_token = None
+    current = None
+    branches = None
+
+    try:
+        async for event in run_turn(session, user_message.strip()):
+            kind = event['type']
+            now = time.perf_counter()
+
+            if kind == 'task_type':
+                result['task_type'] = event['task_type']
+                result['criteria'] = event['criteria']
+                mark = now
+            elif kind in ('thought', 'final') and first_token is None:
+                first_token = now - mark
+            elif kind == 'branches':
+                branches = {key: event[key] for key in ('candidates', 'wall_time', 'prompt_tokens', 'completion_tokens')}
+            elif kind == 'iteration_end':
+                current = {
+                    'iteration': event['iteration'],
+                    'thoughts': event['thoughts'],
+                    'confidence': None,
+                    'duration': round(now - mark, 4),
+                    'first_token': round(first_token, 4) if first_token is not None else None,
+                }
+                if branches is not None:
+                    current['branches'] = branches
+                    branches = None
+                result['iterations'].append(current)
+            elif kind == 'early_stop':
+                current['early_stop'] = {key: event[key] for key in ('reason', 'tokens_received', 'tokens_saved', 'latency_saved')}
+            elif kind == 'self_evaluation':
+                # Scores arrive one iteration late and belong to the iteration they evaluated
+                for record in result['iterations']:
+                    if record['iteration'] == event['iteration']:
+                        record['self_evaluation'] = event['score']
+            elif kind == 'confidence':
+                current['confidence'] = event['score']
+            elif kind == 'mind_map':
+                mark = now
+                first_token = None
+            elif kind == 'final_answer':
+                result['final_answer'] = event['answer']
+                result['timings']['final_answer'] = round(now - mark, 4)
+                result['timings']['final_first_token'] = round(first_token, 4) if first_token is not None else None
+            elif kind == 'error':
+                result['errors'].append(f"{event['stage']}: {event['error']}")
+    except Exception as e:
+        result['errors'].append(str(e))
+
+    if result['final_answer'] is None:
+        result['status'] = 'error'
+    result['timings']['total'] = round(time.perf_counter() - started, 4)
+    return result
+
+async def run_batch(input_path, output_path, workers=4):
+    """
+    Processes a JSONL file of prompts with at most `workers` records in flight.
+    Results are appended to output_path as each record finishes, and records already
+    answered there are skipped, so an interrupted run can simply be started again.
+    """
+    if workers <= 0:
+        raise ValueError("workers must be a positive integer.")
+
+    completed = _completed_ids(output_path)
+    if completed:
+        print(f"{BOLD}{CYAN}Resuming: skipping {len(completed)} records already in {output_path}{RESET}")
+
+    records = _read_records(input_path, completed)
+    summary = {'ok': 0, 'error': 0}
+    _drop_partial_line(output_path)
+
+    with open(output_path, 'a', encoding='utf-8') as out:
+        async def worker():
+            # The generator is shared; next() never awaits, so workers cannot interleave inside it
+            for record_id, record in records:
+                result = await process_record(record_id, record)
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+
+                summary[result['status']] += 1
+                color = GREEN if result['status'] == 'ok' else RED
+                print(f"{color}[{result['status']}]{RESET} {record_id} "
+                      f"({len(result['iterations'])} iterations, {result['timings']['total']:.2f}s)")
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+
+    print(f"{BOLD}{GREEN}Batch complete: {summary['ok']} succeeded, {summary['error']} failed.{RESET}")
+    return summary
@@ -1,144 +1,189 @@
-import os
+import asyncio
+import threading
 from app.config import CONFIG
-from app.utils import (
-    stream_format, process_buffer, format_bold_text, get_user_feedback,
-    calculate_confidence_score, generate_mind_map, BOLD, RED, GREEN, CYAN, YELLOW, RESET
-)
-from app.services.openai_service import call_openai, prepare_messages, determine_task_type_and_criteria
-from app.prompts import get_task_type_prompt, get_thought_process_prompt, get_final_answer_prompt
-
-def chat():
-    chat_history = []
-    
-    print(f"{BOLD}{GREEN}Welcome to PyThoughtChain.{RESET}")
-    print(f"Type your messages below. Type 'exit' to quit the application.")
-    print(f"You can provide feedback after each thought iteration, press Enter to continue, or type 'finalize' to get the final answer.\n")
+from app.utils import MarkdownRenderer, OutputSink, get_user_feedback, BOLD, RED, GREEN, CYAN, YELLOW, RESET
+from app.services.reasoning_engine import create_session, resume_session, run_turn
+from app.services.session_store import get_session_store
+
+async def _in_daemon_thread(func):
+    """
+    Runs a blocking call such as input() without blocking the event loop, so background
+    requests keep streaming meanwhile. The thread is a daemon so it never holds up exit.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def set_result(result, error):
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def run():
+        try:
+            result = func()
+        except BaseException as e:
+            loop.call_soon_threadsafe(set_result, None, e)
+        else:
+            loop.call_soon_threadsafe(set_result, result, None)
+
+    threading.Thread(target=run, daemon=True).start()
+    return await future
+
+async def _cli_feedback(out):
+    # Everything shown so far must be on screen before the prompt
+    out.flush()
+    return await _in_daemon_thread(lambda: get_user_feedback(out))
+
+async def _render_turn(session, user_message, out):
+    """
+    Writes the events of one engine turn to the output sink. Returns False when the chat should stop.
+    """
+    renderer = MarkdownRenderer()
+
+    async def get_feedback():
+        return await _cli_feedback(out)
+
+    async for event in run_turn(session, user_message, get_feedback=get_feedback):
+        kind = event['type']
+
+        if kind == 'task_type':
+            out.line(f"\n{BOLD}{YELLOW}=== Task Type ==={RESET}")
+            out.line(f"{BOLD}{CYAN}{event['task_type']}{RESET}")
+            out.line(f"\n{BOLD}{YELLOW}=== Evaluation Criteria ==={RESET}")
+            out.line(f"{BOLD}{CYAN}{', '.join(event['criteria'])}{RESET}")
+
+        elif kind == 'resumed':
+            out.line(f"{BOLD}{CYAN}Resuming turn {event['turn']} after {event['iterations']} stored iterations.{RESET}")
+
+        elif kind == 'semantic_cache':
+            if event['mode'] == 'answer':
+                action = "answering from the cache"
+            else:
+                action = f"starting from its {event['seeded']} stored iterations"
+            out.line(f"{BOLD}{CYAN}Similar to an earlier question ({event['similarity']:.2f}), {action}:{RESET}")
+            out.line(f"{CYAN}{event['matched']}{RESET}")
+
+        elif kind == 'iteration_start':
+            out.line(f"\n{BOLD}{YELLOW}=== Thought Process (Iteration {event['iteration']}) ==={RESET}")
+
+        elif kind == 'final_start':
+            drafted = " (drafted while you were reading)" if event.get('speculative') else ""
+            out.line(f"\n{BOLD}{YELLOW}=== Final Answer ==={RESET}{drafted}")
+
+        elif kind in ('thought', 'final'):
+            # Plain output keeps the markdown as it is; it reads fine in a log
+            out.write(event['content'] if out.plain else renderer.feed(event['content']))
+
+        elif kind in ('iteration_end', 'final_answer'):
+            out.line("" if out.plain else renderer.flush())
+
+        elif kind == 'early_stop':
+            saved = ""
+            if event['tokens_saved'] is not None:
+                saved = f", ~{event['tokens_saved']} tokens and {event['latency_saved']:.2f}s saved"
+            out.line(f"{BOLD}{YELLOW}Stopped early ({event['reason']}, confidence {event['score']:.2f}){saved}{RESET}")
+
+        elif kind == 'branches':
+            out.line(f"\n{BOLD}{YELLOW}=== Branches (Iteration {event['iteration']}) ==={RESET}")
+            for candidate in event['candidates']:
+                marker = f"{GREEN}*{RESET}" if candidate['selected'] else " "
+                if candidate['error']:
+                    out.line(f"{marker} #{candidate['branch']} {RED}error: {candidate['error']}{RESET}")
+                    continue
+                out.line(f"{marker} #{candidate['branch']} (from path {candidate['parent']}) "
+                         f"score {candidate['score']:.2f}, {candidate['latency']:.2f}s, "
+                         f"{candidate['prompt_tokens']} prompt / {candidate['completion_tokens']} completion tokens")
+            out.line(f"{CYAN}Wall time {event['wall_time']:.2f}s, "
+                     f"{event['prompt_tokens'] + event['completion_tokens']} tokens in total{RESET}")
+
+        elif kind == 'self_evaluation':
+            out.line(f"{BOLD}{CYAN}Self-evaluation of iteration {event['iteration']}: {event['score']:.2f}{RESET}")
+
+        elif kind == 'trailer':
+            covered = ', '.join(event['criteria_covered']) or 'none'
+            ready = ", ready to answer" if event['ready'] else ""
+            out.line(f"{BOLD}{CYAN}Self-assessment: {event['score']:.2f}{ready} (covers: {covered}){RESET}")
+
+        elif kind == 'dedup' and event['duplicates']:
+            out.line(f"{BOLD}{CYAN}Left out {event['duplicates']} of {event['segments']} points repeated from "
+                     f"earlier iterations ({event['bytes_saved']} bytes).{RESET}")
+
+        elif kind == 'confidence':
+            out.line(f"\n{BOLD}{YELLOW}=== Confidence Score ==={RESET}")
+            out.line(f"{BOLD}{CYAN}{event['score']:.2f}{RESET}")
+
+        elif kind == 'mind_map':
+            out.line(f"\n{BOLD}{YELLOW}=== Mind Map ==={RESET}\n{BOLD}{CYAN}{event['mind_map']}{RESET}")
+
+        elif kind == 'error':
+            out.line(f"{BOLD}{RED}Error: {event['error']}{RESET}")
+            if event.get('fatal'):
+                return False
+
+    out.flush()
+    return True
+
+async def _chat_loop(out, session_id=None):
+    if session_id:
+        session = resume_session(session_id)
+        if session is None:
+            out.line(f"{BOLD}{RED}Error: Unknown session {session_id}.{RESET}")
+            return
+        out.line(f"{BOLD}{GREEN}Resumed session {session['id']} ({session['turn']} turns).{RESET}")
+        pending = session['pending_turn']
+        if pending is not None:
+            out.line(f"{BOLD}{CYAN}You: {RESET}{pending['message']}")
+            if not await _render_turn(session, pending['message'], out):
+                return
+    else:
+        session = create_session()
+        if get_session_store() is not None:
+            out.line(f"{BOLD}{GREEN}Session {session['id']} (resume it with --session {session['id']}).{RESET}")
+
+    while True:
+        out.flush()
+        user_message = input(out.styled(f"{BOLD}{CYAN}You: {RESET}")).strip()
+
+        if user_message.lower() == 'exit':
+            out.line(f"{BOLD}{GREEN}Exiting chat...{RESET}")
+            break
+
+        if not user_message:
+            out.line(f"{BOLD}{RED}Error: Empty message.{RESET}")
+            continue
+
+        if not await _render_turn(session, user_message, out):
+            return
+
+def create_output_sink():
+    """
+    Builds the CLI's output sink from CONFIG: output_mode 'auto' picks plain output when
+    stdout is not a terminal, 'tty' and 'plain' force either.
+    """
+    mode = CONFIG['output_mode']
+    return OutputSink(frame_interval=CONFIG['output_frame_interval'],
+                      plain=None if mode == 'auto' else mode == 'plain')
+
+def chat(session_id=None):
+    out = create_output_sink()
+    out.line(f"{BOLD}{GREEN}Welcome to PyThoughtChain.{RESET}")
+    out.line(f"Type your messages below. Type 'exit' to quit the application.")
+    out.line(f"You can provide feedback after each thought iteration, press Enter to continue, or type 'finalize' to get the final answer.\n")
 
     try:
-        while True:
-            user_message = input(f"{BOLD}{CYAN}You: {RESET}").strip()
-            
-            if user_message.lower() == 'exit':
-                print(f"{BOLD}{GREEN}Exiting chat...{RESET}")
-                break
-
-            if not user_message:
-                print(f"{BOLD}{RED}Error: Empty message.{RESET}")
-                continue
-
-            # Determine task type and evaluation criteria
-            task_type, evaluation_criteria = determine_task_type_and_criteria(user_message)
-            print(f"\n{BOLD}{YELLOW}=== Task Type ==={RESET}")
-            print(f"{BOLD}{CYAN}{task_type}{RESET}")
-            print(f"\n{BOLD}{YELLOW}=== Evaluation Criteria ==={RESET}")
-            print(f"{BOLD}{CYAN}{', '.join(evaluation_criteria)}{RESET}")
-
-            thought_process = ""
-            iteration = 1
-            max_iterations = CONFIG['max_iterations']
-            iterations_before_feedback = CONFIG['iterations_before_feedback']
-
-            while iteration <= max_iterations:
-                # Prepare the system prompt and messages
-                system_prompt = get_thought_process_prompt(iteration=iteration, task_type=task_type)
-                messages = prepare_messages(chat_history, user_message, system_prompt, thought_process)
-                
-                if os.environ.get('VERBOSE_LOGGING') == '1':
-                    print(f"Prepared messages: {messages}")
-                
-                # Call OpenAI and stream the response
-                response = call_openai(messages)
-                
-                if isinstance(response, dict) and 'error' in response:
-                    print(f"{BOLD}{RED}Error: {response['error']}{RESET}")
-                    break
-
-                new_thoughts = ""
-                print(f"\n{BOLD}{YELLOW}=== Thought Process (Iteration {iteration}) ==={RESET}", end="", flush=True)
-                print(f"")
-                for formatted_content in stream_format(response, process_buffer):
-                    print(formatted_content, end="", flush=True)
-                    new_thoughts += formatted_content
-                print()
-
-                # Calculate and display the confidence score
-                confidence_score = calculate_confidence_score(
-                    new_thoughts, 
-                    iteration, 
-                    max_iterations, 
-                    correct_answers=0,  # You need to implement a way to track correct answers
-                    total_answers=iteration,
-                    self_evaluation_score=1.0  # You need to implement a way to get self-evaluation score
-                )
-                print(f"\n{BOLD}{YELLOW}=== Confidence Score ==={RESET}")
-                print(f"{BOLD}{CYAN}{confidence_score:.2f}{RESET}")
-
-                # Generate and display the mind map
-                mind_map = generate_mind_map(new_thoughts)
-                print(f"\n{BOLD}{YELLOW}=== Mind Map ==={RESET}\n{BOLD}{CYAN}{mind_map}{RESET}")
-
-                thought_process += f"\n\nIteration {iteration}:\n{new_thoughts}"
-
-                # Check if confidence score exceeds threshold
-                if confidence_score > CONFIG['confidence_threshold']:
-                    break
-
-                # User feedback mechanism
-                if iterations_before_feedback <= 0:
-                    print(f"{BOLD}{RED}Error: iterations_before_feedback must be a positive integer.{RESET}")
-                    return
-
-                if iteration > 0 and iteration % iterations_before_feedback == 0:
-                    user_feedback = get_user_feedback()
-                    if user_feedback == 'finalize':
-                        break
-                    elif user_feedback:
-                        user_message += f"\n\nUser feedback: {user_feedback}"
-
-                iteration += 1
-
-            # Final answer generation and streaming response
-            final_system_prompt = get_final_answer_prompt(thought_process, evaluation_criteria)
-            final_response = call_openai(prepare_messages(chat_history, user_message, final_system_prompt), stream=True)
-            
-            if isinstance(final_response, dict) and 'error' in final_response:
-                print(f"{BOLD}{RED}Error: {final_response['error']}{RESET}")
-                continue
-
-            final_answer = ""
-            print(f"\n{BOLD}{YELLOW}=== Final Answer ==={RESET}", end="", flush=True)
-            print(f"")
-            buffer = ""
-            for chunk in final_response:
-                if chunk.choices[0].delta.content is not None:
-                    content = chunk.choices[0].delta.content
-                    buffer += content
-                    formatted_content, remaining_buffer = process_buffer(buffer)
-                    if formatted_content:
-                        print(formatted_content, end="", flush=True)
-                        final_answer += formatted_content
-                    buffer = remaining_buffer
-            
-            if buffer:
-                formatted_content = format_bold_text(buffer)
-                print(formatted_content, end="", flush=True)
-                final_answer += formatted_content
-            print()  # New line after streaming is complete
-
-            # Update chat history
-            chat_history.append({'sender': 'user', 'text': user_message})
-            chat_history.append({'sender': 'assistant', 'text': final_answer})
-    
+        asyncio.run(_chat_loop(out, session_id))
     except KeyboardInterrupt:
-        print(f"\n{BOLD}{RED}Chat interrupted. Exiting gracefully...{RESET}")
+        out.line(f"\n{BOLD}{RED}Chat interrupted. Exiting gracefully...{RESET}")
         return
     except ConnectionError as e:
-        print(f"{BOLD}{RED}Failed to connect to a resource: {str(e)}{RESET}")
+        out.line(f"{BOLD}{RED}Failed to connect to a resource: {str(e)}{RESET}")
     except TimeoutError as e:
-        print(f"{BOLD}{RED}Timeout occurred: {str(e)}{RESET}")
+        out.line(f"{BOLD}{RED}Timeout occurred: {str(e)}{RESET}")
     except Exception as e:
-        print(f"{BOLD}{RED}An unexpected error occurred: {str(e)}{RESET}")
+        out.line(f"{BOLD}{RED}An unexpected error occurred: {str(e)}{RESET}")
 
     finally:
         # Clean up any resources or finalize your chat logic here...
-        pass
\ No newline at end of file
+        out.flush()
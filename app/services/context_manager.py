@@ -0,0 +1,241 @@
+import hashlib
+import heapq
+import os
+import re
+
+# Words are split into pieces of up to four characters, which tracks BPE token counts
+# closely enough for budgeting without loading a tokenizer
+_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+# A period after a digit is a list number ("1. "), not the end of a sentence
+_SENTENCE_END_RE = re.compile(r"(?<=[^\d\s][.!?])\s")
+_OUTLINE_RE = re.compile(r"^\s{0,3}(#+\s|\d+[.)]\s|[-*•]\s|\*\*)")
+_WORD_RE = re.compile(r"\w+")
+
+# Bottom-k MinHash over word trigrams: one hash per shingle, the 64 smallest kept.
+# Similarity is exact for segments under 64 shingles and within about ±0.06 above
+_SHINGLE_WORDS = 3
+_SIGNATURE_SIZE = 64
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens in text.
+    """
+    return len(_TOKEN_RE.findall(text))
+
+def _truncate(text, max_tokens):
+    pieces = 0
+    for match in _TOKEN_RE.finditer(text):
+        pieces += 1
+        if pieces > max_tokens:
+            return text[:match.start()].rstrip() + " …"
+    return text
+
+def summarize_iteration(thoughts, max_tokens=120):
+    """
+    Builds a compact extractive summary of one iteration: the first sentence of every
+    outline line (headings, numbered steps, bullets), or of every paragraph when the
+    text has no outline, cut to max_tokens.
+    """
+    lines = [line.strip() for line in thoughts.split('\n') if line.strip()]
+    outline = [line for line in lines if _OUTLINE_RE.match(line)]
+    if not outline:
+        outline = [paragraph.strip() for paragraph in thoughts.split('\n\n') if paragraph.strip()]
+
+    summary = []
+    used = 0
+    for line in outline:
+        marker = _OUTLINE_RE.match(line)
+        start = marker.end() if marker else 0
+        sentence = line[:start] + _SENTENCE_END_RE.split(line[start:], 1)[0]
+        tokens = estimate_tokens(sentence)
+        if used + tokens > max_tokens:
+            if not summary:
+                summary.append(_truncate(sentence, max_tokens))
+            break
+        summary.append(sentence)
+        used += tokens
+    return "\n".join(summary)
+
+def split_segments(thoughts):
+    """
+    Splits thoughts into paragraphs, and paragraphs into their list items and headings.
+    """
+    segments = []
+    for paragraph in re.split(r"\n\s*\n", thoughts):
+        current = []
+        for line in paragraph.split('\n'):
+            if current and _OUTLINE_RE.match(line):
+                segments.append("\n".join(current))
+                current = []
+            if line.strip():
+                current.append(line)
+        if current:
+            segments.append("\n".join(current))
+    return segments
+
+def minhash(text):
+    """
+    Returns the MinHash signature of a text's word trigrams, or None when it has fewer than three words.
+    """
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < _SHINGLE_WORDS:
+        return None
+    hashes = {hashlib.blake2b(" ".join(words[i:i + _SHINGLE_WORDS]).encode('utf-8'), digest_size=8).digest()
+              for i in range(len(words) - _SHINGLE_WORDS + 1)}
+    return frozenset(heapq.nsmallest(_SIGNATURE_SIZE, hashes))
+
+def similarity(first, second):
+    """
+    Estimates the Jaccard similarity of two texts from their MinHash signatures.
+    """
+    union = heapq.nsmallest(_SIGNATURE_SIZE, first | second)
+    return sum(value in first and value in second for value in union) / len(union)
+
+def _deduplicate(record, earlier, threshold, min_words):
+    """
+    Marks the record's segments that nearly repeat a segment of an earlier iteration
+    and sets record['text'] to the rest, which is all that is sent to the model.
+    """
+    seen = [(other['iteration'], index, segment['signature'])
+            for other in earlier for index, segment in enumerate(other.get('segments') or ())
+            if segment['signature'] is not None]
+    segments = []
+    for text in split_segments(record['thoughts']):
+        signature = minhash(text) if len(_WORD_RE.findall(text)) >= min_words else None
+        duplicate_of = None
+        if signature is not None:
+            for iteration, index, other in seen:
+                if similarity(signature, other) >= threshold:
+                    duplicate_of = [iteration, index]
+                    break
+        segments.append({'text': text, 'signature': signature, 'duplicate_of': duplicate_of})
+
+    record['segments'] = segments
+    record['duplicates'] = sum(segment['duplicate_of'] is not None for segment in segments)
+    if record['duplicates']:
+        novel = "\n\n".join(segment['text'] for segment in segments if segment['duplicate_of'] is None)
+        record['text'] = novel or "(Repeats the earlier iterations.)"
+    record['bytes_saved'] = max(0, len(record['thoughts'].encode('utf-8')) - len(record['text'].encode('utf-8')))
+
+def add_iteration(iterations, iteration, thoughts, dedup_threshold=None, dedup_min_words=8):
+    """
+    Appends an iteration record; its token estimate is computed once here.
+    With a dedup_threshold, segments whose estimated similarity to a segment of an earlier
+    iteration in `iterations` reaches it are left out of the text sent to the model;
+    segments shorter than dedup_min_words are always kept.
+    """
+    record = {'iteration': iteration, 'thoughts': thoughts, 'text': thoughts, 'summary': None}
+    if dedup_threshold:
+        _deduplicate(record, iterations, dedup_threshold, dedup_min_words)
+    record['tokens'] = estimate_tokens(record['text'])
+    iterations.append(record)
+    return record
+
+def thought_outline(iterations):
+    """
+    Renders the distinct points of every iteration as an indented outline for
+    generate_mind_map(), noting how many repeated points were left out.
+    """
+    lines = []
+    for record in iterations:
+        lines.append(f"Iteration {record['iteration']}")
+        segments = record.get('segments')
+        if segments is None:
+            segments = [{'text': text, 'duplicate_of': None} for text in split_segments(record['thoughts'])]
+        for segment in segments:
+            if segment['duplicate_of'] is None:
+                lines.extend(f"  {line.rstrip()}" for line in segment['text'].split('\n'))
+        if record.get('duplicates'):
+            lines.append(f"  ({record['duplicates']} points repeated from earlier iterations)")
+    return "\n".join(lines)
+
+def _summary(record, summary_tokens):
+    # Each iteration is summarized at most once; the result is kept on the record
+    if record['summary'] is None:
+        text = summarize_iteration(record['text'], summary_tokens)
+        record['summary'] = {'text': text, 'tokens': estimate_tokens(text)}
+    return record['summary']
+
+def thought_blocks(iterations, token_budget=None, keep_recent=2, summary_tokens=120):
+    """
+    Selects how each iteration appears in the prompt, oldest first, as
+    {'iteration', 'kind', 'text'} blocks where kind is 'full', 'summary' or 'omitted'.
+
+    The newest `keep_recent` iterations are always kept verbatim. Older iterations
+    stay verbatim while the budget allows, are replaced by their summaries once it
+    does not, and are left out altogether when even the summaries do not fit.
+    """
+    if not token_budget:
+        return [{'iteration': r['iteration'], 'kind': 'full', 'text': r['text']} for r in iterations]
+
+    blocks = []
+    used = 0
+    newest_first = list(reversed(iterations))
+    for position, record in enumerate(newest_first):
+        if position < keep_recent or used + record['tokens'] <= token_budget:
+            blocks.append({'iteration': record['iteration'], 'kind': 'full', 'text': record['text']})
+            used += record['tokens']
+            continue
+
+        summary = _summary(record, summary_tokens)
+        if used + summary['tokens'] > token_budget:
+            oldest = newest_first[-1]['iteration']
+            blocks.append({'iteration': record['iteration'], 'kind': 'omitted',
+                           'text': f"(Iterations {oldest}-{record['iteration']} omitted to fit the context budget.)"})
+            break
+        blocks.append({'iteration': record['iteration'], 'kind': 'summary', 'text': summary['text']})
+        used += summary['tokens']
+
+    blocks.reverse()
+    return blocks
+
+def build_thought_process(iterations, token_budget=None, keep_recent=2, summary_tokens=120):
+    """
+    Renders iteration records into the thought process text sent to the model.
+    See thought_blocks() for how the budget is applied.
+    """
+    rendered = []
+    for block in thought_blocks(iterations, token_budget, keep_recent, summary_tokens):
+        if block['kind'] == 'omitted':
+            rendered.append(f"\n\n{block['text']}")
+        elif block['kind'] == 'summary':
+            rendered.append(f"\n\nIteration {block['iteration']} (summary):\n{block['text']}")
+        else:
+            rendered.append(f"\n\nIteration {block['iteration']}:\n{block['text']}")
+    return "".join(rendered)
+
+def select_history(chat_history, limit=10, token_budget=None):
+    """
+    Returns the most recent chat history entries, at most `limit` of them and, when a
+    budget is given, only as many as fit in it. Token estimates are cached on the entries.
+    """
+    recent = chat_history[-limit:] if limit else []
+    if not token_budget:
+        return recent
+
+    selected = []
+    used = 0
+    for entry in reversed(recent):
+        if 'tokens' not in entry:
+            entry['tokens'] = estimate_tokens(entry['text'])
+        if used + entry['tokens'] > token_budget:
+            break
+        selected.append(entry)
+        used += entry['tokens']
+    selected.reverse()
+    return selected
+
+def prefix_overlap(previous, messages):
+    """
+    Returns how many characters at the start of `messages` repeat `previous`
+    exactly: the part of the prompt a server-side prefix cache can reuse.
+    """
+    reused = 0
+    for old, new in zip(previous, messages):
+        if old['role'] != new['role']:
+            break
+        if old['content'] != new['content']:
+            reused += len(os.path.commonprefix([old['content'], new['content']]))
+            break
+        reused += len(new['content'])
+    return reused
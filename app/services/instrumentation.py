@@ -0,0 +1,382 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from app.config import CONFIG
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_PREFIX = 'pythoughtchain'
+
+class JSONLSink:
+    """
+    Appends every record to a JSON Lines trace file. Writes are buffered and
+    flushed every `flush_every` records and at exit.
+    """
+
+    def __init__(self, path, flush_every=64):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.flush_every = flush_every
+        self._file = open(path, 'a', encoding='utf-8')
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._pending += 1
+            if self._pending >= self.flush_every:
+                self._file.flush()
+                self._pending = 0
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def _labels(labels):
+    return ",".join(f'{name}="{str(value)}"' for name, value in labels)
+
+class PrometheusSink:
+    """
+    Aggregates records into counters and histograms and renders them in the
+    Prometheus text exposition format. With a path, the text is also written
+    there (for node_exporter's textfile collector) at most every `interval` seconds.
+    """
+
+    def __init__(self, path=None, interval=10.0):
+        self.path = path
+        self.interval = interval
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._written = 0.0
+
+    def _count(self, name, labels, value=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, name, labels, value):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = _Histogram(LATENCY_BUCKETS)
+        histogram.observe(value)
+
+    def emit(self, record):
+        with self._lock:
+            if record['kind'] == 'call':
+                labels = (('stage', record['stage']), ('route', record['route']))
+                status = 'error' if record['error'] else 'closed' if record['closed'] else 'ok'
+                self._count('llm_requests_total', labels + (('status', status),))
+                if record['cached']:
+                    self._count('llm_cached_requests_total', labels)
+                self._observe('llm_request_duration_seconds', labels, record['duration'])
+                if record['ttft'] is not None:
+                    self._observe('llm_time_to_first_token_seconds', labels, record['ttft'])
+                if record['itl_mean'] is not None:
+                    self._observe('llm_inter_token_latency_seconds', labels, record['itl_mean'])
+                self._count('llm_prompt_tokens_total', labels, record['prompt_tokens'])
+                self._count('llm_prompt_chars_total', labels, record['prompt_chars'])
+                self._count('llm_completion_tokens_total', labels, record['completion_tokens'])
+            elif record['kind'] == 'stage':
+                self._observe('stage_duration_seconds', (('stage', record['stage']),), record['duration'])
+            elif record['kind'] == 'prefix':
+                labels = (('stage', record['stage']),)
+                self._count('llm_prefix_prompt_chars_total', labels, record['prompt_chars'])
+                self._count('llm_prefix_reused_chars_total', labels, record['reused_chars'])
+
+        if self.path and time.monotonic() - self._written >= self.interval:
+            self.flush()
+
+    def render(self):
+        """
+        Returns the current metrics in the Prometheus text format.
+        """
+        lines = []
+        with self._lock:
+            declared = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in declared:
+                    lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+                    declared.add(name)
+                lines.append(f"{METRIC_PREFIX}_{name}{{{_labels(labels)}}} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                if name not in declared:
+                    lines.append(f"# TYPE {METRIC_PREFIX}_{name} histogram")
+                    declared.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    bucket_labels = _labels(labels + (('le', bound),))
+                    lines.append(f"{METRIC_PREFIX}_{name}_bucket{{{bucket_labels}}} {cumulative}")
+                lines.append(f"{METRIC_PREFIX}_{name}_sum{{{_labels(labels)}}} {histogram.sum}")
+                lines.append(f"{METRIC_PREFIX}_{name}_count{{{_labels(labels)}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        if not self.path:
+            return
+        self._written = time.monotonic()
+        # Written to a temporary file first so scrapers never read a partial file
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(temporary, self.path)
+
+class RouteSummarySink:
+    """
+    Totals calls per model route, for comparing the cost and latency of each route.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        if record['kind'] != 'call' or record['cached']:
+            return
+        with self._lock:
+            route = self._routes.get(record['route'])
+            if route is None:
+                route = self._routes[record['route']] = {
+                    'calls': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                    'duration': 0.0, 'ttft': 0.0, 'ttft_samples': 0,
+                }
+            route['calls'] += 1
+            route['errors'] += record['error'] is not None
+            route['prompt_tokens'] += record['prompt_tokens']
+            route['completion_tokens'] += record['completion_tokens']
+            route['duration'] += record['duration']
+            if record['ttft'] is not None:
+                route['ttft'] += record['ttft']
+                route['ttft_samples'] += 1
+
+    def summary(self):
+        """
+        Returns {route: totals} with the mean duration and time to first token of each route.
+        """
+        with self._lock:
+            return {
+                name: {
+                    'calls': route['calls'],
+                    'errors': route['errors'],
+                    'prompt_tokens': route['prompt_tokens'],
+                    'completion_tokens': route['completion_tokens'],
+                    'duration_mean': route['duration'] / route['calls'],
+                    'ttft_mean': route['ttft'] / route['ttft_samples'] if route['ttft_samples'] else None,
+                }
+                for name, route in self._routes.items()
+            }
+
+    def flush(self):
+        pass
+
+_sinks = None
+
+def set_sinks(sinks):
+    """
+    Installs the sinks every record is sent to; pass [] to turn instrumentation off.
+    """
+    global _sinks
+    _sinks = list(sinks)
+
+def get_sinks():
+    """
+    Returns the active sinks, building them from CONFIG on first use.
+    """
+    global _sinks
+    if _sinks is None:
+        sinks = []
+        if CONFIG.get('instrumentation_enabled'):
+            sinks.append(PrometheusSink(CONFIG.get('instrumentation_metrics_path') or None))
+            sinks.append(RouteSummarySink())
+            if CONFIG.get('instrumentation_trace_path'):
+                sinks.append(JSONLSink(CONFIG['instrumentation_trace_path']))
+        _sinks = sinks
+    return _sinks
+
+def get_prometheus_sink():
+    """
+    Returns the first Prometheus sink, or None when there is none.
+    """
+    return next((sink for sink in get_sinks() if isinstance(sink, PrometheusSink)), None)
+
+def get_route_summary():
+    """
+    Returns the per-route totals, or None when instrumentation is off.
+    """
+    sink = next((sink for sink in get_sinks() if isinstance(sink, RouteSummarySink)), None)
+    return sink.summary() if sink is not None else None
+
+def enabled():
+    return bool(get_sinks())
+
+def emit(record):
+    for sink in get_sinks():
+        sink.emit(record)
+
+def flush():
+    for sink in get_sinks():
+        sink.flush()
+
+atexit.register(lambda: _sinks and flush())
+
+def record_stage(name, started, **labels):
+    """
+    Records a stage that began at `started` (a time.perf_counter() reading) and ends now.
+    """
+    if get_sinks():
+        emit({'kind': 'stage', 'stage': name, 'time': time.time(),
+              'duration': time.perf_counter() - started, **labels})
+
+@contextmanager
+def stage(name, **labels):
+    """
+    Times a block of the reasoning loop and records it as a 'stage' record.
+    """
+    if not get_sinks():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit({'kind': 'stage', 'stage': name, 'time': time.time(),
+              'duration': time.perf_counter() - started, **labels})
+
+class CallTracker:
+    """
+    Collects the timings of one model call. Streams report every content delta
+    through delta(); each costs a clock read and a few additions, no allocation.
+
+    Token counts come from the server's usage report when it sends one. Otherwise
+    completion tokens are the number of content deltas and prompt tokens are
+    estimated as a quarter of the prompt characters, which avoids tokenizing
+    every prompt on the hot path.
+    """
+
+    def __init__(self, stage_name, messages, cached=False, route='default'):
+        self.started = time.perf_counter()
+        prompt_chars = sum(len(message['content']) for message in messages)
+        self.record = {
+            'kind': 'call', 'stage': stage_name, 'route': route, 'time': time.time(), 'cached': cached,
+            'prompt_chars': prompt_chars, 'prompt_tokens': (prompt_chars + 3) // 4, 'completion_tokens': 0,
+            'ttft': None, 'itl_mean': None, 'itl_max': None, 'duration': None, 'error': None, 'closed': False,
+        }
+        self._last = None
+        self._gaps = 0.0
+        self._completion_tokens = None
+        self._done = False
+
+    def delta(self):
+        now = time.perf_counter()
+        record = self.record
+        if self._last is None:
+            record['ttft'] = now - self.started
+        else:
+            gap = now - self._last
+            self._gaps += gap
+            if record['itl_max'] is None or gap > record['itl_max']:
+                record['itl_max'] = gap
+        self._last = now
+        record['completion_tokens'] += 1
+
+    def usage(self, usage):
+        """
+        Replaces the estimates with the token counts the server reported.
+        """
+        if getattr(usage, 'prompt_tokens', None):
+            self.record['prompt_tokens'] = usage.prompt_tokens
+        if getattr(usage, 'completion_tokens', None):
+            self._completion_tokens = usage.completion_tokens
+
+    def finish(self, error=None, closed=False):
+        if self._done:
+            return
+        self._done = True
+        record = self.record
+        record['duration'] = time.perf_counter() - self.started
+        record['error'] = error
+        record['closed'] = closed
+        deltas = record['completion_tokens']
+        if deltas > 1:
+            record['itl_mean'] = self._gaps / (deltas - 1)
+        if self._completion_tokens is not None:
+            record['completion_tokens'] = self._completion_tokens
+        emit(record)
+
+class InstrumentedStream:
+    """
+    Passes a completion stream through, sync or async, reporting its deltas to a
+    CallTracker. The call is recorded when the stream ends, fails or is closed.
+    """
+
+    def __init__(self, stream, tracker):
+        self._stream = stream
+        self._tracker = tracker
+
+    def _observe(self, chunk):
+        if chunk.choices and chunk.choices[0].delta.content:
+            self._tracker.delta()
+        elif getattr(chunk, 'usage', None) is not None:
+            self._tracker.usage(chunk.usage)
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                self._observe(chunk)
+                yield chunk
+        except Exception as e:
+            self._tracker.finish(error=str(e))
+            raise
+        self._tracker.finish()
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                self._observe(chunk)
+                yield chunk
+        except Exception as e:
+            self._tracker.finish(error=str(e))
+            raise
+        self._tracker.finish()
+
+    def close(self):
+        self._tracker.finish(closed=True)
+        return self._stream.close()
+
+def instrument_completion(completion, tracker, stream):
+    """
+    Attaches a tracker to a completion: streams are wrapped, full completions are recorded at once.
+    """
+    if stream:
+        return InstrumentedStream(completion, tracker)
+    if getattr(completion, 'usage', None) is not None:
+        tracker.usage(completion.usage)
+    tracker.finish()
+    return completion
@@ -1,67 +1,192 @@
 import os
-import openai
-from dotenv import load_dotenv
+from app.config import CONFIG
+from app.lexicon import TASK_KEYWORDS, get_matcher
+from app.prompts import get_iteration_instruction
+from app.services.context_manager import select_history
+from app.services import instrumentation
+from app.services.response_cache import get_response_cache, cache_key, replay_completion, record_completion
 
-load_dotenv()
+TEMPERATURE = 0.2
 
-# Verbose logging for environment variables
-if os.environ.get('VERBOSE_LOGGING') == '1':
-    print(f"OPENAI_BASE_URL: {os.getenv('OPENAI_BASE_URL')}")
-    print(f"OPENAI_API_KEY: {'*' * len(os.getenv('OPENAI_API_KEY', ''))}")
-    print(f"OPENAI_MODEL: {os.getenv('OPENAI_MODEL')}")
+_pool = None
 
-# Check if API key is missing
-if not os.getenv("OPENAI_API_KEY"):
-    # Import formatting only when needed to avoid circular imports
-    from app.utils import BOLD, RED, RESET
-    print(f"{BOLD}{RED}Error: OPENAI_API_KEY is not set. Please run the setup script again.{RESET}")
-    exit(1)
+def get_pool():
+    """
+    Returns the backend pool, building it on first use: the servers listed under
+    "backends" in the config, or OPENAI_BASE_URL alone. Nothing is read from the
+    environment and neither openai nor httpx is imported until a request is made.
+    """
+    global _pool
+    if _pool is None:
+        if os.environ.get('VERBOSE_LOGGING') == '1':
+            print(f"OPENAI_BASE_URL: {os.getenv('OPENAI_BASE_URL')}")
+            print(f"OPENAI_API_KEY: {'*' * len(os.getenv('OPENAI_API_KEY', ''))}")
+            print(f"OPENAI_MODEL: {os.getenv('OPENAI_MODEL')}")
+            if not os.getenv("OPENAI_MODEL"):
+                print("Warning: OPENAI_MODEL is not set. Using default model.")
+
+        if not os.getenv("OPENAI_API_KEY") and not CONFIG.get('backends'):
+            raise RuntimeError("OPENAI_API_KEY is not set. Please run the setup script again.")
+
+        from app.services import backends
+        _pool = backends.create_pool(
+            os.getenv("OPENAI_BASE_URL", "http://localhost:1234/v1"),
+            os.getenv("OPENAI_API_KEY"),
+            default_model=os.getenv("OPENAI_MODEL", "YOUR_MODEL_HERE")
+        )
+    return _pool
+
+def resolve_route(stage, task_type=None, config=None):
+    """
+    Returns (name, route) for a call: config['model_routes'] entries keyed 'default',
+    a stage ('iteration', 'branch', 'self_evaluation', 'final_answer') and
+    'stage:task_type', each overriding the one before. A route may set 'model',
+    'temperature', 'max_tokens' and 'backends' (names of the backends it may use).
+    """
+    routes = (config or CONFIG).get('model_routes') or {}
+    name = 'default'
+    route = dict(routes.get('default', {}))
+    for key in (stage, f"{stage}:{task_type}" if task_type else None):
+        if key in routes:
+            name = key
+            route.update(routes[key])
+    return name, route
+
+def _request_settings(stage, task_type, temperature, max_tokens, config=None):
+    """
+    Applies the call's route; temperature and max_tokens given by the caller take precedence.
+    Returns (route_name, model, temperature, max_tokens, backends); a model of None
+    leaves the choice to the backend (its own model, or OPENAI_MODEL).
+    """
+    name, route = resolve_route(stage, task_type, config)
+    if temperature is None:
+        temperature = route.get('temperature', TEMPERATURE)
+    return name, route.get('model'), temperature, max_tokens or route.get('max_tokens'), route.get('backends')
+
+def _cached_response(messages, stream, use_cache, temperature, max_tokens, model=None):
+    """
+    Returns (cache, key, cached_completion) for a request; cache is None when bypassed.
+    """
+    cache = get_response_cache() if use_cache else None
+    if cache is None:
+        return None, None, None
+    key = cache_key(model or os.getenv("OPENAI_MODEL", "YOUR_MODEL_HERE"), messages, temperature, stream, max_tokens)
+    value = cache.get(key)
+    return cache, key, replay_completion(value, stream) if value is not None else None
 
-# Initialize OpenAI client
-client = openai.OpenAI(
-    base_url=os.getenv("OPENAI_BASE_URL", "http://localhost:1234/v1"),
-    api_key=os.getenv("OPENAI_API_KEY")
-)
+def _tracker(messages, stage, route):
+    return instrumentation.CallTracker(stage, messages, route=route) if instrumentation.enabled() else None
+
+def _finish_call(completion, tracker, stream, cached=False):
+    if tracker is None:
+        return completion
+    tracker.record['cached'] = cached
+    return instrumentation.instrument_completion(completion, tracker, stream)
 
-# Warn if model is not set
-if not os.getenv("OPENAI_MODEL") and os.environ.get('VERBOSE_LOGGING') == '1':
-    from app.utils import BOLD, YELLOW, RESET
-    print(f"{BOLD}{YELLOW}Warning: OPENAI_MODEL is not set. Using default model.{RESET}")
+def _call_error(tracker, e):
+    if tracker is not None:
+        tracker.finish(error=str(e))
+    return {'error': str(e)}
 
-def call_openai(messages, stream=True):
+def call_openai(messages, stream=True, use_cache=True, temperature=None, max_tokens=None, stage='request',
+                task_type=None, config=None):
     """
     Calls the OpenAI API with provided messages and handles potential errors.
+    Identical requests are answered from the response cache when it is enabled;
+    pass use_cache=False to always reach the model. `stage` and `task_type` select
+    the model route (see resolve_route()) from the model_routes of `config`, the
+    session's config, or of the global CONFIG when None, and label the call's metrics.
+    Transient failures (429, 5xx, timeouts) are retried by the transport before an error is returned.
     """
+    # Deferred so that importing this module stays cheap; both are cached after the first call
+    import openai
+    from app.services import backends
+
+    route, model, temperature, max_tokens, route_backends = _request_settings(
+        stage, task_type, temperature, max_tokens, config
+    )
+    tracker = _tracker(messages, stage, route)
     try:
         if os.environ.get('VERBOSE_LOGGING') == '1':
-            print(f"Calling OpenAI with model: {os.getenv('OPENAI_MODEL', 'YOUR_MODEL_HERE')}")
+            print(f"Calling OpenAI with model: {model or os.getenv('OPENAI_MODEL', 'YOUR_MODEL_HERE')} (route {route})")
             print(f"Messages: {messages}")
-        
+
+        cache, key, cached = _cached_response(messages, stream, use_cache, temperature, max_tokens, model)
+        if cached is not None:
+            return _finish_call(cached, tracker, stream, cached=True)
+
         # API call to OpenAI
-        completion = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "YOUR_MODEL_HERE"),
+        completion = backends.create_completion(
+            get_pool(),
+            backends=route_backends,
+            model=model,
             messages=messages,
-            temperature=0.2,
-            stream=stream
+            temperature=temperature,
+            stream=stream,
+            **({'max_tokens': max_tokens} if max_tokens else {})
         )
-        return completion
+        if cache is not None:
+            completion = record_completion(completion, cache, key, stream)
+        return _finish_call(completion, tracker, stream)
     except openai.APIError as e:
         # Import formatting when an error occurs to avoid circular import at the top level
         from app.utils import BOLD, RED, RESET
         print(f"{BOLD}{RED}OpenAI API Error: {str(e)}{RESET}")
-        return {'error': str(e)}
+        return _call_error(tracker, e)
     except Exception as e:
         from app.utils import BOLD, RED, RESET
         print(f"{BOLD}{RED}Unexpected error in call_openai: {str(e)}{RESET}")
-        return {'error': str(e)}
+        return _call_error(tracker, e)
 
-def prepare_messages(chat_history, user_message, system_prompt, thought_process=None):
+async def call_openai_async(messages, stream=True, use_cache=True, temperature=None, max_tokens=None,
+                            stage='request', task_type=None, config=None):
+    """
+    Async counterpart of call_openai backed by the AsyncOpenAI client.
+    Errors are returned as {'error': ...} and left to the caller to report.
+    """
+    # Deferred so that importing this module stays cheap; both are cached after the first call
+    import openai
+    from app.services import backends
+
+    route, model, temperature, max_tokens, route_backends = _request_settings(
+        stage, task_type, temperature, max_tokens, config
+    )
+    tracker = _tracker(messages, stage, route)
+    try:
+        if os.environ.get('VERBOSE_LOGGING') == '1':
+            print(f"Calling OpenAI (async) with model: {model or os.getenv('OPENAI_MODEL', 'YOUR_MODEL_HERE')} "
+                  f"(route {route})")
+            print(f"Messages: {messages}")
+
+        cache, key, cached = _cached_response(messages, stream, use_cache, temperature, max_tokens, model)
+        if cached is not None:
+            return _finish_call(cached, tracker, stream, cached=True)
+
+        completion = await backends.create_completion_async(
+            get_pool(),
+            backends=route_backends,
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=stream,
+            **({'max_tokens': max_tokens} if max_tokens else {})
+        )
+        if cache is not None:
+            completion = record_completion(completion, cache, key, stream)
+        return _finish_call(completion, tracker, stream)
+    except openai.APIError as e:
+        return _call_error(tracker, e)
+    except Exception as e:
+        return _call_error(tracker, e)
+
+def prepare_messages(chat_history, user_message, system_prompt, thought_process=None,
+                     history_limit=10, history_token_budget=None):
     """
     Prepares the message payload for OpenAI API by organizing chat history and appending the latest user input.
+    At most history_limit entries are included, fewer when they exceed history_token_budget.
     """
     messages = []
-    history_limit = 10
-    recent_history = chat_history[-history_limit:]
+    recent_history = select_history(chat_history, history_limit, history_token_budget)
 
     for entry in recent_history:
         if entry['sender'] == 'user':
@@ -77,30 +202,60 @@ def prepare_messages(chat_history, user_message, system_prompt, thought_process=
 
     return messages
 
-def determine_task_type_and_criteria(user_message):
+def prepare_prefix_stable_messages(chat_history, user_message, system_prompt, thought_blocks, instruction,
+                                   history_limit=10, history_token_budget=None, instruction_suffix=""):
     """
-    Determines the task type based on the user's input and provides criteria to evaluate the task.
+    Prepares messages so that each request of a turn starts with the previous one, which
+    lets servers with prompt caching reuse it: the fixed system prompt, the history and the
+    user message come first, then every earlier iteration as an assistant turn followed by
+    the instruction of the iteration after it, and the new `instruction` comes last.
+    `instruction_suffix` is appended to the earlier iterations' instructions, as it was
+    to each of them when it was sent.
     """
-    user_message = user_message.lower()
-    
-    task_keywords = {
-        'product_development': ['product', 'business', 'market', 'customer', 'innovation'],
-        'scientific_research': ['research', 'experiment', 'hypothesis', 'data', 'analysis'],
-        'creative_writing': ['story', 'character', 'plot', 'writing', 'narrative'],
-        'coding': ['code', 'programming', 'function', 'algorithm', 'debug']
-    }
-    
-    counts = {task: sum(user_message.count(keyword) for keyword in keywords)
-              for task, keywords in task_keywords.items()}
-    
+    messages = [{'role': 'system', 'content': system_prompt}]
+    for entry in select_history(chat_history, history_limit, history_token_budget):
+        if entry['sender'] == 'user':
+            messages.append({'role': 'user', 'content': entry['text']})
+        elif entry['sender'] == 'assistant':
+            messages.append({'role': 'assistant', 'content': entry['text']})
+
+    # The first iteration's instruction travels with the user message, as it did when it was the tail
+    first = get_iteration_instruction(thought_blocks[0]['iteration']) + instruction_suffix if thought_blocks else instruction
+    messages.append({'role': 'user', 'content': f"{user_message}\n\n{first}"})
+    for position, block in enumerate(thought_blocks):
+        messages.append({'role': 'assistant', 'content': block['text']})
+        if position + 1 < len(thought_blocks):
+            messages.append({'role': 'user',
+                             'content': get_iteration_instruction(block['iteration'] + 1) + instruction_suffix})
+        else:
+            messages.append({'role': 'user', 'content': instruction})
+    return messages
+
+TASK_CRITERIA = {
+    'product_development': ['market viability', 'innovation', 'user needs', 'feasibility'],
+    'scientific_research': ['methodology', 'data analysis', 'hypothesis testing', 'literature review'],
+    'creative_writing': ['character development', 'plot coherence', 'narrative style', 'originality'],
+    'coding': ['functionality', 'efficiency', 'readability', 'best practices'],
+    'general': ['clarity', 'relevance', 'accuracy', 'completeness']
+}
+
+def _task_matcher(config=None):
+    return get_matcher((CONFIG if config is None else config).get('task_keywords') or TASK_KEYWORDS)
+
+def _task_from_counts(counts):
     task_type = max(counts, key=counts.get) if any(counts.values()) else 'general'
-    
-    criteria = {
-        'product_development': ['market viability', 'innovation', 'user needs', 'feasibility'],
-        'scientific_research': ['methodology', 'data analysis', 'hypothesis testing', 'literature review'],
-        'creative_writing': ['character development', 'plot coherence', 'narrative style', 'originality'],
-        'coding': ['functionality', 'efficiency', 'readability', 'best practices'],
-        'general': ['clarity', 'relevance', 'accuracy', 'completeness']
-    }
-    
-    return task_type, criteria[task_type]
\ No newline at end of file
+    return task_type, TASK_CRITERIA.get(task_type, TASK_CRITERIA['general'])
+
+def determine_task_type_and_criteria(user_message, config=None):
+    """
+    Determines the task type based on the user's input and provides criteria to evaluate the task.
+    Keywords come from config['task_keywords'] (CONFIG when no session config is given) when set
+    and are matched as whole words.
+    """
+    return _task_from_counts(_task_matcher(config).count(user_message))
+
+def determine_task_types_and_criteria(user_messages, config=None):
+    """
+    Batch form of determine_task_type_and_criteria(): classifies every message with one shared matcher.
+    """
+    return [_task_from_counts(counts) for counts in _task_matcher(config).count_many(user_messages)]
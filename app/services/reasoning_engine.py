@@ -0,0 +1,755 @@
+import asyncio
+import time
+import uuid
+from app.config import CONFIG, DEFAULT_BRANCHING
+from app.utils import (
+    calculate_confidence_score, generate_mind_map, stream_content_async, close_stream, IncrementalConfidence,
+    self_evaluate_async, TrailerParser
+)
+from app.services import instrumentation
+from app.services.context_manager import (
+    add_iteration, build_thought_process, estimate_tokens, prefix_overlap, thought_blocks, thought_outline
+)
+from app.services.openai_service import (
+    call_openai_async, prepare_messages, prepare_prefix_stable_messages, determine_task_type_and_criteria
+)
+from app.services.session_store import get_session_store
+from app.services.transcripts import get_transcript_recorder
+from app.prompts import (
+    get_thought_process_prompt, get_final_answer_prompt, get_stable_thought_process_prompt,
+    get_iteration_instruction, get_final_answer_instruction, get_trailer_instruction, TRAILER_MARKER
+)
+
+def create_session(config=None, session_id=None):
+    """
+    Creates the per-conversation state the engine works on.
+    Config overrides apply to this session only and never touch the global CONFIG.
+    With a session store configured, a new session is recorded there at once.
+    """
+    session = {
+        'id': session_id or uuid.uuid4().hex,
+        'config': {**CONFIG, **(config or {})},
+        'chat_history': [],
+        'history_offset': 0,
+        'last_prompt': None,
+        'prefix_stats': {'calls': 0, 'prompt_chars': 0, 'reused_chars': 0},
+        'dedup': {'segments': 0, 'duplicates': 0, 'bytes_saved': 0},
+        'speculation': {'drafts': 0, 'served': 0, 'discarded': 0},
+        'trailers': {'parsed': 0, 'fallbacks': 0},
+        'turn': 0,
+        'pending_turn': None,
+        'task_type': None,
+        'criteria': [],
+        'thought_process': '',
+        'iterations': [],
+        'iteration': 0,
+        'branch_stats': [],
+        'early_stop': {
+            'stops': 0,
+            'tokens_saved': 0,
+            'latency_saved': 0.0,
+            'completed_iterations': 0,
+            'completed_tokens': 0,
+            'completed_duration': 0.0,
+        },
+    }
+    store = get_session_store()
+    if store is not None and session_id is None:
+        store.create(session['id'], config or {})
+    return session
+
+def resume_session(session_id):
+    """
+    Rebuilds a session from the session store, or returns None when it is not there.
+    Only the most recent chat history is loaded; an unfinished turn is kept in
+    'pending_turn' and continues from its last iteration when run again.
+    """
+    store = get_session_store()
+    if store is None or not store.exists(session_id):
+        return None
+
+    window = max(CONFIG['session_history_window'], CONFIG['history_limit'])
+    state = store.load(session_id, window)
+    session = create_session(state['config'], session_id=session_id)
+    session['chat_history'] = state['chat_history']
+    session['history_offset'] = state['history_offset']
+    session['turn'] = state['turns']
+    session['task_type'] = state['task_type']
+    session['pending_turn'] = state['pending_turn']
+    return session
+
+def _persist(session, record):
+    store = get_session_store()
+    if store is not None:
+        store.append(session['id'], record)
+
+def _trim_history(session):
+    """
+    Keeps only the most recent history in memory once it is safely on disk.
+    """
+    if get_session_store() is None:
+        return
+    config = session['config']
+    window = max(config['session_history_window'], config['history_limit'])
+    excess = len(session['chat_history']) - window
+    if excess > 0:
+        del session['chat_history'][:excess]
+        session['history_offset'] += excess
+
+def _add_iteration(session, iterations, iteration, thoughts):
+    config = session['config']
+    threshold = config['thought_dedup_threshold'] if config['thought_dedup_enabled'] else None
+    return add_iteration(iterations, iteration, thoughts, threshold, config['thought_dedup_min_words'])
+
+def _semantic_cache(session):
+    if not session['config']['semantic_cache_enabled']:
+        return None
+    # Imported here so numpy is loaded only when the cache is used
+    from app.services.semantic_cache import get_semantic_cache
+    return get_semantic_cache()
+
+def _finish_turn(session, turn, user_message, final_answer):
+    session['chat_history'].append({'sender': 'user', 'text': user_message})
+    session['chat_history'].append({'sender': 'assistant', 'text': final_answer})
+    _persist(session, {'type': 'final_answer', 'turn': turn, 'message': user_message, 'answer': final_answer})
+    _trim_history(session)
+
+def _keyword_weights(config):
+    return config['confidence_keyword_weight'], config['uncertainty_keyword_weight']
+
+def _compacted_thoughts(session, iterations=None):
+    config = session['config']
+    return build_thought_process(
+        session['iterations'] if iterations is None else iterations,
+        token_budget=config['context_token_budget'],
+        keep_recent=config['context_recent_iterations'],
+        summary_tokens=config['context_summary_tokens']
+    )
+
+def _prepare(session, user_message, system_prompt, thought_process=None):
+    config = session['config']
+    return prepare_messages(
+        session['chat_history'], user_message, system_prompt, thought_process,
+        history_limit=config['history_limit'],
+        history_token_budget=config['history_token_budget']
+    )
+
+def _trailer_instruction(session):
+    if not session['config']['structured_trailer_enabled']:
+        return ""
+    return f"\n{get_trailer_instruction(session['criteria'])}"
+
+def _prepare_stable(session, user_message, task_type, iterations, instruction):
+    config = session['config']
+    blocks = thought_blocks(
+        iterations,
+        token_budget=config['context_token_budget'],
+        keep_recent=config['context_recent_iterations'],
+        summary_tokens=config['context_summary_tokens']
+    )
+    return prepare_prefix_stable_messages(
+        session['chat_history'], user_message, get_stable_thought_process_prompt(task_type), blocks, instruction,
+        history_limit=config['history_limit'],
+        history_token_budget=config['history_token_budget'],
+        # Earlier iterations are replayed as they were sent, trailer request included
+        instruction_suffix=_trailer_instruction(session)
+    )
+
+def _iteration_messages(session, user_message, iteration, task_type, iterations=None):
+    """
+    Builds an iteration's request in the session's prompt_layout ('classic' or 'prefix_stable').
+    """
+    config = session['config']
+    iterations = session['iterations'] if iterations is None else iterations
+    # The trailer request goes with the per-iteration part, never with the final answer instruction
+    trailer = _trailer_instruction(session)
+    if config['prompt_layout'] == 'prefix_stable':
+        return _prepare_stable(session, user_message, task_type, iterations,
+                               get_iteration_instruction(iteration) + trailer)
+    system_prompt = get_thought_process_prompt(iteration=iteration, task_type=task_type) + trailer
+    return _prepare(session, user_message, system_prompt, _compacted_thoughts(session, iterations))
+
+def _final_answer_messages(session, user_message, task_type, evaluation_criteria):
+    if session['config']['prompt_layout'] == 'prefix_stable':
+        return _prepare_stable(session, user_message, task_type, session['iterations'],
+                               get_final_answer_instruction(evaluation_criteria))
+    final_system_prompt = get_final_answer_prompt(_compacted_thoughts(session), evaluation_criteria)
+    return _prepare(session, user_message, final_system_prompt)
+
+def _track_prefix(session, stage, messages):
+    """
+    Measures how much of a request repeats the session's previous request from the start,
+    the upper bound of what a server-side prefix cache can skip.
+    """
+    previous = session['last_prompt']
+    reused = prefix_overlap(previous, messages) if previous is not None else 0
+    prompt_chars = sum(len(message['content']) for message in messages)
+    session['last_prompt'] = messages
+    stats = session['prefix_stats']
+    stats['calls'] += 1
+    stats['prompt_chars'] += prompt_chars
+    stats['reused_chars'] += reused
+    if instrumentation.enabled():
+        instrumentation.emit({'kind': 'prefix', 'stage': stage, 'time': time.time(), 'session': session['id'],
+                              'prompt_chars': prompt_chars, 'reused_chars': reused})
+
+def _early_stop_reason(tracker, config, plateau):
+    """
+    Applies the early stop policy to a stream's running confidence.
+    Returns 'threshold', 'plateau' or None; `plateau` holds the last point the score moved.
+    """
+    if tracker.words < config['early_stop_min_words']:
+        return None
+
+    policy = config['early_stop_policy']
+    if policy in ('threshold', 'both') and tracker.score > config['confidence_threshold']:
+        return 'threshold'
+    if policy in ('plateau', 'both'):
+        if abs(tracker.score - plateau['score']) > config['early_stop_plateau_epsilon']:
+            plateau['score'] = tracker.score
+            plateau['words'] = tracker.words
+        elif tracker.words - plateau['words'] >= config['early_stop_plateau_words']:
+            return 'plateau'
+    return None
+
+def _record_early_stop(session, reason, iteration, score, thoughts, elapsed):
+    """
+    Updates the session's savings, estimated against the average completed iteration.
+    """
+    stats = session['early_stop']
+    tokens = estimate_tokens(thoughts)
+    event = {'type': 'early_stop', 'iteration': iteration, 'reason': reason, 'score': score,
+             'tokens_received': tokens, 'tokens_saved': None, 'latency_saved': None}
+
+    if stats['completed_iterations']:
+        expected_tokens = stats['completed_tokens'] / stats['completed_iterations']
+        expected_duration = stats['completed_duration'] / stats['completed_iterations']
+        event['tokens_saved'] = max(0, round(expected_tokens - tokens))
+        event['latency_saved'] = max(0.0, expected_duration - elapsed)
+        stats['tokens_saved'] += event['tokens_saved']
+        stats['latency_saved'] += event['latency_saved']
+    stats['stops'] += 1
+    return event
+
+async def _draft_final_answer(messages, task_type, queue, config):
+    """
+    Streams a speculative final answer into `queue`: content strings, then None at
+    the end, or an {'error': ...} dict. Cancelling the task closes the stream.
+    """
+    response = await call_openai_async(messages, stage='final_answer', task_type=task_type, config=config)
+    if isinstance(response, dict) and 'error' in response:
+        queue.put_nowait(response)
+        return
+    try:
+        async for content in stream_content_async(response):
+            queue.put_nowait(content)
+    except asyncio.CancelledError:
+        await close_stream(response)
+        raise
+    except Exception as e:
+        queue.put_nowait({'error': str(e)})
+        return
+    queue.put_nowait(None)
+
+def _start_draft(session, messages, task_type):
+    session['speculation']['drafts'] += 1
+    queue = asyncio.Queue()
+    return {'messages': messages, 'queue': queue,
+            'task': asyncio.create_task(_draft_final_answer(messages, task_type, queue, session['config']))}
+
+def _discard_draft(session, draft):
+    """
+    Cancels a draft that will not be served, releasing its connection. Returns None.
+    """
+    if draft is not None:
+        draft['task'].cancel()
+        session['speculation']['discarded'] += 1
+    return None
+
+async def _draft_contents(draft, first):
+    """
+    Yields a served draft's content: what has already arrived at once, the rest as it streams.
+    """
+    item = first
+    while item is not None:
+        if isinstance(item, dict):
+            raise RuntimeError(item['error'])
+        yield item
+        item = await draft['queue'].get()
+
+def _evaluation_result(task):
+    """
+    Returns the score of a finished self-evaluation task, or 0.0 when it failed.
+    """
+    if task.cancelled() or task.exception() is not None:
+        return 0.0
+    return task.result()
+
+def branching_settings(config, task_type):
+    """
+    Returns the branching settings for a task type: the 'default' entry of
+    config['branching'] overlaid with the task type's own entry.
+    """
+    branching = config.get('branching') or {}
+    return {**DEFAULT_BRANCHING, **branching.get('default', {}), **branching.get(task_type, {})}
+
+async def _generate_candidate(session, path, user_message, iteration, task_type, parent, temperature,
+                              scorer='heuristic'):
+    """
+    Generates one candidate continuation of a beam path without streaming it to the consumer.
+    """
+    messages = _iteration_messages(session, user_message, iteration, task_type, path)
+    started = time.perf_counter()
+
+    # Identical prompts must not collapse into one cached answer
+    response = await call_openai_async(messages, use_cache=False, temperature=temperature, stage='branch',
+                                       task_type=task_type, config=session['config'])
+    if isinstance(response, dict) and 'error' in response:
+        return {'parent': parent, 'error': response['error']}
+
+    parts = []
+    first_token = None
+    async for content in stream_content_async(response):
+        if first_token is None:
+            first_token = time.perf_counter() - started
+        parts.append(content)
+    thoughts = "".join(parts)
+    completion_tokens = estimate_tokens(thoughts)
+
+    trailer = None
+    if session['config']['structured_trailer_enabled']:
+        parser = TrailerParser(TRAILER_MARKER)
+        thoughts = parser.feed(thoughts)
+        rest, trailer = parser.finish()
+        thoughts = thoughts.rstrip() if trailer is not None else thoughts + rest
+
+    # The candidate's own score spares a separate evaluation request
+    evaluation = trailer['score'] if trailer is not None else None
+    evaluated = evaluation is None and scorer != 'heuristic'
+    if evaluated:
+        evaluation = await self_evaluate_async(
+            _compacted_thoughts(session, path) + f"\n\nIteration {iteration}:\n{thoughts}", session['config'],
+            task_type
+        )
+
+    return {
+        'parent': parent,
+        'thoughts': thoughts,
+        'evaluation': evaluation,
+        'evaluated': evaluated,
+        'latency': time.perf_counter() - started,
+        'first_token': first_token,
+        'prompt_tokens': sum(estimate_tokens(message['content']) for message in messages),
+        'completion_tokens': completion_tokens,
+    }
+
+async def _explore_branches(session, beam, user_message, iteration, task_type, settings):
+    """
+    Expands every path in the beam into `branches` candidates concurrently, scores them
+    and returns (new_beam, stats). Paths are lists of iteration records, best first.
+    """
+    started = time.perf_counter()
+    candidates = await asyncio.gather(*(
+        _generate_candidate(session, path, user_message, iteration, task_type, parent,
+                            settings['temperature'], settings['scorer'])
+        for parent, path in enumerate(beam)
+        for _ in range(settings['branches'])
+    ))
+    wall_time = time.perf_counter() - started
+
+    scored = []
+    for index, candidate in enumerate(candidates):
+        candidate['branch'] = index
+        if 'error' in candidate:
+            continue
+        if settings['scorer'] == 'self_evaluation':
+            candidate['score'] = candidate['evaluation']
+        else:
+            # total_answers=0 leaves out the answer-accuracy factor, which would zero every branch
+            candidate['score'] = calculate_confidence_score(
+                candidate['thoughts'], iteration, session['config']['max_iterations'],
+                correct_answers=0, total_answers=0, self_evaluation_score=candidate['evaluation'] or 1.0,
+                weights=_keyword_weights(session['config']), config=session['config']
+            )
+        scored.append(candidate)
+
+    scored.sort(key=lambda c: (c['score'], len(c['thoughts'])), reverse=True)
+    new_beam = []
+    for candidate in scored[:settings['beam_width']]:
+        candidate['selected'] = True
+        path = list(beam[candidate['parent']])
+        _add_iteration(session, path, iteration, candidate['thoughts'])
+        new_beam.append(path)
+
+    stats = {
+        'iteration': iteration,
+        'wall_time': wall_time,
+        'candidates': [
+            {key: candidate.get(key) for key in (
+                'branch', 'parent', 'score', 'evaluation', 'latency', 'first_token',
+                'prompt_tokens', 'completion_tokens', 'error'
+            )} | {'selected': candidate.get('selected', False)}
+            for candidate in candidates
+        ],
+    }
+    stats['prompt_tokens'] = sum(c['prompt_tokens'] or 0 for c in stats['candidates'])
+    stats['completion_tokens'] = sum(c['completion_tokens'] or 0 for c in stats['candidates'])
+    stats['calls'] = len(candidates) + sum(1 for candidate in candidates if candidate.get('evaluated'))
+    return new_beam, stats
+
+async def run_turn(session, user_message, get_feedback=None):
+    """
+    Runs the thought iterations and the final answer for one user message.
+
+    Yields event dicts, each with a 'type' key, instead of printing:
+    task_type, resumed, semantic_cache, iteration_start, thought, iteration_end, early_stop, branches,
+    trailer, self_evaluation, dedup, confidence, mind_map, feedback_request, final_start, final,
+    final_answer and error.
+
+    When branching is configured for the task type, the first `depth` iterations
+    generate several candidates at once and continue from the best ones; the best
+    candidate is reported through the usual iteration events.
+
+    With early stopping enabled, each streamed delta updates a running confidence
+    score; once the policy fires, the stream is closed and the turn moves straight
+    to the final answer.
+
+    With self-evaluation enabled, each finished iteration is scored by a short
+    request that runs while the next iteration generates. Its result is only
+    used if it is ready when that iteration ends, so confidence lags one
+    iteration behind but the turn never waits on an evaluation.
+
+    With the structured trailer enabled, each iteration ends with a JSON assessment
+    after TRAILER_MARKER: a self-score, the criteria covered and whether it is ready to
+    finalize. The trailer is kept out of the thought events and the thoughts, and its
+    score stands in for self-evaluation; without a valid trailer the turn falls back to
+    the heuristic and, if enabled, the evaluation request.
+
+    With a transcript path configured, every finished turn is recorded with the raw
+    thoughts, scores, calls, tokens and timings of each iteration for offline replay.
+
+    With a session store configured, the turn, each iteration and the final answer
+    are written to it as they are produced. Running the message of a resumed
+    session's unfinished turn continues that turn after its last stored iteration.
+
+    With the semantic cache enabled, a first question close enough to one answered
+    before is served that stored answer, or in 'seed' mode starts from its stored
+    thoughts. Answers to first questions without feedback are added to the cache.
+
+    :param get_feedback: Async callable returning None to continue, 'finalize' or feedback text.
+                         When it is None the feedback step is skipped.
+    """
+    config = session['config']
+    chat_history = session['chat_history']
+
+    with instrumentation.stage('classification', session=session['id']):
+        task_type, evaluation_criteria = determine_task_type_and_criteria(user_message, config)
+    session['task_type'] = task_type
+    session['criteria'] = evaluation_criteria
+    yield {'type': 'task_type', 'task_type': task_type, 'criteria': evaluation_criteria}
+
+    session['thought_process'] = ""
+    session['iterations'] = []
+    pending = session['pending_turn']
+    session['pending_turn'] = None
+    if pending is not None and pending['message'] == user_message:
+        turn = pending['turn']
+        for record in pending['iterations']:
+            _add_iteration(session, session['iterations'], record['iteration'], record['thoughts'])
+        session['thought_process'] = build_thought_process(session['iterations'])
+        yield {'type': 'resumed', 'turn': turn, 'iterations': len(session['iterations'])}
+    else:
+        session['turn'] += 1
+        turn = session['turn']
+        _persist(session, {'type': 'turn', 'turn': turn, 'message': user_message, 'task_type': task_type})
+
+    # Only a first question without a resumed turn means the same on its own as in the cache
+    cache = _semantic_cache(session) if not chat_history and not session['iterations'] else None
+    cached = None
+    if cache is not None:
+        similarity, cached = cache.lookup(user_message, task_type, config['semantic_cache_threshold'])
+    if cached is not None:
+        mode = config['semantic_cache_mode']
+        seeded = 0
+        if mode != 'answer':
+            # The stored thoughts stand in for the first iterations; at least one iteration still runs
+            for thoughts in cached['thoughts'][:max(config['max_iterations'] - 1, 0)]:
+                seeded += 1
+                _add_iteration(session, session['iterations'], seeded, thoughts)
+                _persist(session, {'type': 'iteration', 'turn': turn, 'iteration': seeded,
+                                   'thoughts': thoughts, 'confidence': None})
+            session['thought_process'] = build_thought_process(session['iterations'])
+        yield {'type': 'semantic_cache', 'mode': mode, 'similarity': similarity,
+               'matched': cached['message'], 'seeded': seeded}
+        if mode == 'answer':
+            yield {'type': 'final_start', 'speculative': False, 'cached': True}
+            yield {'type': 'final', 'content': cached['answer']}
+            _finish_turn(session, turn, user_message, cached['answer'])
+            yield {'type': 'final_answer', 'answer': cached['answer']}
+            return
+
+    asked = user_message
+    iteration = len(session['iterations']) + 1
+    max_iterations = config['max_iterations']
+    iterations_before_feedback = config['iterations_before_feedback']
+    branching = branching_settings(config, task_type)
+    beam = [list(session['iterations'])]
+    evaluation = None
+    self_evaluation_score = 1.0
+    draft = None
+    stop = 'max_iterations'
+    recorder = get_transcript_recorder()
+    transcript = None
+    if recorder is not None:
+        transcript = {
+            'session': session['id'], 'turn': turn, 'time': time.time(), 'task_type': task_type,
+            'message': user_message, 'feedback': False, 'iterations': [], 'stop': None, 'final': None,
+            'config': {key: config[key] for key in (
+                'max_iterations', 'confidence_threshold', 'confidence_keyword_weight', 'uncertainty_keyword_weight',
+                'confidence_keywords'
+            )},
+        }
+
+    try:
+        while iteration <= max_iterations:
+            # Another iteration makes a speculative final answer stale
+            draft = _discard_draft(session, draft)
+            session['iteration'] = iteration
+            iteration_started = time.perf_counter()
+
+            stop_reason = None
+            trailer = None
+            branched = iteration <= branching['depth'] and branching['branches'] * len(beam) > 1
+            if branched:
+                beam, stats = await _explore_branches(session, beam, user_message, iteration, task_type, branching)
+                session['branch_stats'].append(stats)
+                yield {'type': 'branches', **stats}
+                if not beam:
+                    yield {'type': 'error', 'stage': 'iteration', 'iteration': iteration,
+                           'error': 'Every branch failed.'}
+                    stop = 'error'
+                    break
+
+                # The best path becomes the session's thought process; its newest record is this iteration
+                session['iterations'] = beam[0]
+                new_thoughts = beam[0][-1]['thoughts']
+                yield {'type': 'iteration_start', 'iteration': iteration}
+                yield {'type': 'thought', 'iteration': iteration, 'content': new_thoughts}
+                yield {'type': 'iteration_end', 'iteration': iteration, 'thoughts': new_thoughts}
+            else:
+                messages = _iteration_messages(session, user_message, iteration, task_type)
+                _track_prefix(session, 'iteration', messages)
+
+                response = await call_openai_async(messages, stage='iteration', task_type=task_type, config=config)
+                if isinstance(response, dict) and 'error' in response:
+                    yield {'type': 'error', 'stage': 'iteration', 'iteration': iteration, 'error': response['error']}
+                    stop = 'error'
+                    break
+
+                yield {'type': 'iteration_start', 'iteration': iteration}
+                tracker = None
+                if config['early_stop_enabled']:
+                    tracker = IncrementalConfidence(iteration, max_iterations, self_evaluation_score=self_evaluation_score,
+                                                    weights=_keyword_weights(config), config=config)
+                parser = TrailerParser(TRAILER_MARKER) if config['structured_trailer_enabled'] else None
+                plateau = {'score': 0, 'words': 0}
+                started = time.perf_counter()
+                parts = []
+                stream = stream_content_async(response)
+                async for content in stream:
+                    if parser is not None:
+                        content = parser.feed(content)
+                        if not content:
+                            continue
+                    parts.append(content)
+                    yield {'type': 'thought', 'iteration': iteration, 'content': content}
+                    if tracker is not None:
+                        tracker.feed(content)
+                        stop_reason = _early_stop_reason(tracker, config, plateau)
+                        if stop_reason:
+                            break
+
+                if parser is not None:
+                    rest, trailer = parser.finish()
+                    if rest:
+                        parts.append(rest)
+                        yield {'type': 'thought', 'iteration': iteration, 'content': rest}
+                new_thoughts = "".join(parts)
+                if trailer is not None:
+                    new_thoughts = new_thoughts.rstrip()
+                elapsed = time.perf_counter() - started
+                if stop_reason:
+                    await stream.aclose()
+                    await close_stream(response)
+                yield {'type': 'iteration_end', 'iteration': iteration, 'thoughts': new_thoughts}
+
+                if stop_reason:
+                    yield _record_early_stop(session, stop_reason, iteration, tracker.score, new_thoughts, elapsed)
+                else:
+                    early_stop = session['early_stop']
+                    early_stop['completed_iterations'] += 1
+                    early_stop['completed_tokens'] += estimate_tokens(new_thoughts)
+                    early_stop['completed_duration'] += elapsed
+
+            # The evaluation started after the previous iteration is used only if it has already finished
+            if evaluation is not None and evaluation[1].done():
+                evaluated_iteration, task = evaluation
+                evaluation = None
+                score = _evaluation_result(task)
+                yield {'type': 'self_evaluation', 'iteration': evaluated_iteration, 'score': score}
+                if score > 0:
+                    self_evaluation_score = score
+                _persist(session, {'type': 'self_evaluation', 'turn': turn, 'iteration': evaluated_iteration,
+                                   'score': score})
+
+            if trailer is not None:
+                session['trailers']['parsed'] += 1
+                self_evaluation_score = trailer['score']
+                yield {'type': 'trailer', 'iteration': iteration, **trailer}
+            elif config['structured_trailer_enabled'] and not branched and not stop_reason:
+                session['trailers']['fallbacks'] += 1
+
+            iteration_duration = time.perf_counter() - iteration_started
+            instrumentation.record_stage('iteration', iteration_started, session=session['id'], iteration=iteration,
+                                         branched=branched)
+
+            if not branched:
+                _add_iteration(session, session['iterations'], iteration, new_thoughts)
+            record = session['iterations'][-1]
+            if 'segments' in record:
+                dedup = session['dedup']
+                dedup['segments'] += len(record['segments'])
+                dedup['duplicates'] += record['duplicates']
+                dedup['bytes_saved'] += record['bytes_saved']
+                yield {'type': 'dedup', 'iteration': iteration, 'segments': len(record['segments']),
+                       'duplicates': record['duplicates'], 'bytes_saved': record['bytes_saved']}
+
+            with instrumentation.stage('scoring', session=session['id'], iteration=iteration):
+                confidence_score = calculate_confidence_score(
+                    new_thoughts,
+                    iteration,
+                    max_iterations,
+                    correct_answers=0,
+                    total_answers=0,
+                    self_evaluation_score=self_evaluation_score,
+                    weights=_keyword_weights(config),
+                    config=config
+                )
+            yield {'type': 'confidence', 'iteration': iteration, 'score': confidence_score}
+            if transcript is not None:
+                transcript['iterations'].append({
+                    'iteration': iteration, 'thoughts': new_thoughts, 'confidence': confidence_score,
+                    'self_evaluation_score': self_evaluation_score, 'trailer': trailer,
+                    'calls': stats['calls'] if branched else 1, 'evaluations': 0,
+                    'prompt_tokens': stats['prompt_tokens'] if branched else sum(
+                        estimate_tokens(message['content']) for message in messages),
+                    'completion_tokens': stats['completion_tokens'] if branched else estimate_tokens(new_thoughts),
+                    'duration': iteration_duration, 'early_stop': stop_reason,
+                })
+            with instrumentation.stage('mind_map', session=session['id'], iteration=iteration):
+                # Deduplicated thoughts are mapped as a whole: every distinct point so far
+                mind_map = generate_mind_map(
+                    thought_outline(session['iterations']) if 'segments' in record else new_thoughts
+                )
+            yield {'type': 'mind_map', 'iteration': iteration, 'mind_map': mind_map}
+
+            session['thought_process'] = build_thought_process(session['iterations'])
+            _persist(session, {'type': 'iteration', 'turn': turn, 'iteration': iteration,
+                               'thoughts': new_thoughts, 'confidence': confidence_score, 'trailer': trailer})
+
+            if stop_reason or confidence_score > config['confidence_threshold']:
+                stop = 'early_stop' if stop_reason else 'confidence'
+                break
+            # The model's own go-ahead counts once its score clears the same threshold
+            if trailer is not None and trailer['ready'] and trailer['score'] > config['confidence_threshold']:
+                stop = 'ready'
+                break
+
+            if get_feedback is not None:
+                if iterations_before_feedback <= 0:
+                    yield {'type': 'error', 'stage': 'config', 'fatal': True,
+                           'error': 'iterations_before_feedback must be a positive integer.'}
+                    return
+
+                if iteration % iterations_before_feedback == 0:
+                    # The final answer is drafted while the user reads and types, in case they finalize
+                    if config['speculative_final_answer']:
+                        draft = _start_draft(
+                            session, _final_answer_messages(session, user_message, task_type, evaluation_criteria),
+                            task_type
+                        )
+                    yield {'type': 'feedback_request', 'iteration': iteration}
+                    user_feedback = await get_feedback()
+                    if user_feedback == 'finalize':
+                        stop = 'finalize'
+                        break
+                    elif user_feedback:
+                        if transcript is not None:
+                            transcript['feedback'] = True
+                        draft = _discard_draft(session, draft)
+                        user_message += f"\n\nUser feedback: {user_feedback}"
+                        _persist(session, {'type': 'feedback', 'turn': turn, 'message': user_message})
+
+            # Scores this iteration while the next one generates; a pending evaluation is never replaced.
+            # A parsed trailer has already scored it.
+            if config['self_evaluation_enabled'] and evaluation is None and trailer is None:
+                evaluation = (iteration, asyncio.create_task(
+                    self_evaluate_async(_compacted_thoughts(session), config, task_type)
+                ))
+                if transcript is not None:
+                    transcript['iterations'][-1]['evaluations'] += 1
+
+            iteration += 1
+    except BaseException:
+        _discard_draft(session, draft)
+        raise
+    finally:
+        # A stale evaluation is of no use once the iterations are over
+        if evaluation is not None:
+            evaluation[1].cancel()
+
+    final_started = time.perf_counter()
+    final_messages = _final_answer_messages(session, user_message, task_type, evaluation_criteria)
+    _track_prefix(session, 'final_answer', final_messages)
+    try:
+        contents = None
+        # A draft is served only if it was asked for exactly this final answer and did not fail to start
+        if draft is not None and draft['messages'] == final_messages:
+            first = await draft['queue'].get()
+            if not isinstance(first, dict):
+                contents = _draft_contents(draft, first)
+                session['speculation']['served'] += 1
+        if contents is None:
+            draft = _discard_draft(session, draft)
+            final_response = await call_openai_async(final_messages, stage='final_answer', task_type=task_type,
+                                                     config=config)
+            if isinstance(final_response, dict) and 'error' in final_response:
+                yield {'type': 'error', 'stage': 'final_answer', 'error': final_response['error']}
+                return
+            contents = stream_content_async(final_response)
+
+        yield {'type': 'final_start', 'speculative': draft is not None}
+        parts = []
+        async for content in contents:
+            parts.append(content)
+            yield {'type': 'final', 'content': content}
+        final_answer = "".join(parts)
+    finally:
+        # Only has an effect when the turn is abandoned while a served draft is still streaming
+        if draft is not None:
+            draft['task'].cancel()
+    instrumentation.record_stage('final_answer', final_started, session=session['id'])
+
+    if transcript is not None:
+        transcript['stop'] = stop
+        transcript['final'] = {
+            'calls': 1, 'duration': time.perf_counter() - final_started,
+            'prompt_tokens': sum(estimate_tokens(message['content']) for message in final_messages),
+            'completion_tokens': estimate_tokens(final_answer),
+        }
+        recorder.record(transcript)
+    _finish_turn(session, turn, user_message, final_answer)
+    # Answers shaped by feedback are not answers to the question as asked
+    if cache is not None and cached is None and user_message == asked:
+        cache.put(asked, task_type, final_answer, [record['thoughts'] for record in session['iterations']])
+    yield {'type': 'final_answer', 'answer': final_answer}
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from app.config import CONFIG
+
+def cache_key(model, messages, temperature, stream, max_tokens=None):
+    """
+    Returns a stable hash of everything that determines a completion.
+    """
+    request = {'model': model, 'messages': messages, 'temperature': temperature, 'stream': stream}
+    if max_tokens is not None:
+        request['max_tokens'] = max_tokens
+    payload = json.dumps(request, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class MemoryCache:
+    """
+    In-memory LRU tier with a per-entry time to live.
+    """
+
+    def __init__(self, max_entries=256, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if self.ttl and time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class SQLiteCache:
+    """
+    On-disk tier. Entries expire after `ttl` seconds and the least recently used
+    ones are evicted once the stored values exceed `max_bytes`.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, ttl=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+            'created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT value, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl and now - created > self.ttl:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+        return json.loads(value)
+
+    def put(self, key, value):
+        now = time.time()
+        data = json.dumps(value)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, data, len(data), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl:
+            self._conn.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl,))
+
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall():
+            self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+
+class ResponseCache:
+    """
+    Two-tier cache: lookups try memory first, then disk, and disk hits are promoted.
+    Either tier may be None. Values are plain JSON-serializable dicts.
+    """
+
+    def __init__(self, memory=None, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self.counters = {'hits': 0, 'misses': 0, 'memory_hits': 0, 'disk_hits': 0, 'stores': 0}
+
+    def get(self, key):
+        value = self.memory.get(key) if self.memory is not None else None
+        if value is not None:
+            self.counters['hits'] += 1
+            self.counters['memory_hits'] += 1
+            return value
+
+        value = self.disk.get(key) if self.disk is not None else None
+        if value is not None:
+            self.counters['hits'] += 1
+            self.counters['disk_hits'] += 1
+            if self.memory is not None:
+                self.memory.put(key, value)
+            return value
+
+        self.counters['misses'] += 1
+        return None
+
+    def put(self, key, value):
+        self.counters['stores'] += 1
+        if self.memory is not None:
+            self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def stats(self):
+        lookups = self.counters['hits'] + self.counters['misses']
+        return {**self.counters, 'hit_rate': self.counters['hits'] / lookups if lookups else 0.0}
+
+    def clear(self):
+        for tier in (self.memory, self.disk):
+            if tier is not None:
+                tier.clear()
+
+_cache = None
+_cache_configured = False
+
+def set_response_cache(cache):
+    """
+    Installs the cache used by call_openai. Any object with get(key) and put(key, value)
+    works; pass None to disable caching.
+    """
+    global _cache, _cache_configured
+    _cache = cache
+    _cache_configured = True
+
+def get_response_cache():
+    """
+    Returns the active cache, building it from CONFIG on first use.
+    """
+    global _cache, _cache_configured
+    if not _cache_configured:
+        _cache_configured = True
+        if CONFIG.get('response_cache_enabled'):
+            ttl = CONFIG.get('response_cache_ttl') or None
+            memory = MemoryCache(CONFIG.get('response_cache_memory_entries', 256), ttl=ttl)
+            disk = None
+            if CONFIG.get('response_cache_path'):
+                disk = SQLiteCache(CONFIG['response_cache_path'],
+                                   max_bytes=CONFIG.get('response_cache_max_bytes', 64 * 1024 * 1024), ttl=ttl)
+            _cache = ResponseCache(memory, disk)
+    return _cache
+
+def _chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(
+        index=0, delta=SimpleNamespace(content=content, role='assistant'), finish_reason=None
+    )])
+
+class ReplayStream:
+    """
+    Replays cached deltas with the same chunk shape as a live stream, sync or async.
+    """
+
+    def __init__(self, deltas):
+        self._deltas = list(deltas)
+
+    def __iter__(self):
+        for content in self._deltas:
+            yield _chunk(content)
+
+    async def __aiter__(self):
+        for content in self._deltas:
+            yield _chunk(content)
+
+    def close(self):
+        self._deltas = []
+
+def replay_completion(value, stream):
+    if stream:
+        return ReplayStream(value['deltas'])
+    return SimpleNamespace(choices=[SimpleNamespace(
+        index=0, message=SimpleNamespace(content=value['content'], role='assistant'), finish_reason='stop'
+    )])
+
+class RecordingStream:
+    """
+    Passes a live stream through unchanged and stores it once it has been read to the end.
+    Streams that are closed early or fail are not cached.
+    """
+
+    def __init__(self, stream, cache, key):
+        self._stream = stream
+        self._cache = cache
+        self._key = key
+        self._deltas = []
+
+    def _record(self, chunk):
+        if chunk.choices and chunk.choices[0].delta.content is not None:
+            self._deltas.append(chunk.choices[0].delta.content)
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._record(chunk)
+            yield chunk
+        self._cache.put(self._key, {'deltas': self._deltas})
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._record(chunk)
+            yield chunk
+        self._cache.put(self._key, {'deltas': self._deltas})
+
+    def close(self):
+        return self._stream.close()
+
+def record_completion(completion, cache, key, stream):
+    if stream:
+        return RecordingStream(completion, cache, key)
+    cache.put(key, {'content': completion.choices[0].message.content})
+    return completion
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import numpy as np
+from app.config import CONFIG
+
+_WORD_RE = re.compile(r"\w+")
+
+# Words that change how a question is phrased rather than what it asks
+_STOP_WORDS = frozenset("""
+a an the is are was were be been do does did i you we my me your how what whats which who why when where
+can could would should will to of in on for with by about and or it its this that there way some any please
+tell explain
+""".split())
+
+def _normalize(message):
+    return " ".join(_WORD_RE.findall(message.lower()))
+
+def _terms(message):
+    """
+    Returns the content words, adjacent word pairs and character 4-grams of a message.
+    The 4-grams let "dict" match "dictionary" and reordered phrasings still overlap.
+    """
+    words = [word for word in _WORD_RE.findall(message.lower()) if word not in _STOP_WORDS]
+    terms = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+    for word in words:
+        padded = f"<{word}>"
+        terms.extend(padded[i:i + 4] for i in range(len(padded) - 3))
+    return terms
+
+class SemanticCache:
+    """
+    Similarity index over answered questions, for serving paraphrases without
+    running the whole reasoning loop again.
+
+    Questions are embedded with hashed TF-IDF over content words, word pairs and
+    character 4-grams: each term is hashed to one of `dimensions` buckets with a
+    random sign, so no vocabulary or embedding model is needed. Vectors are kept as rows of one matrix and a lookup
+    is a single matrix-vector product against the IDF-weighted, normalized rows,
+    which are recomputed only after the index changes. At most `max_entries`
+    questions are kept; the least recently used one is replaced. With a `path`,
+    entries are stored in SQLite and reloaded on start.
+    """
+
+    def __init__(self, path=None, max_entries=1000, dimensions=4096):
+        self.max_entries = max_entries
+        self.dimensions = dimensions
+        self._vectors = np.zeros((max_entries, dimensions), dtype=np.float32)
+        self._present = np.zeros((max_entries, dimensions), dtype=bool)
+        self._used = np.zeros(max_entries, dtype=np.float64)
+        self._task_types = np.full(max_entries, None, dtype=object)
+        self._entries = [None] * max_entries
+        self._slots = {}
+        self._weighted = None
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+        self._conn = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS questions ('
+                'key TEXT PRIMARY KEY, task_type TEXT NOT NULL, message TEXT NOT NULL, '
+                'answer TEXT NOT NULL, thoughts TEXT NOT NULL, accessed REAL NOT NULL)'
+            )
+            self._conn.commit()
+            self._load()
+
+    def _load(self):
+        # A smaller max_entries than last time drops the least recently used questions
+        self._conn.execute(
+            'DELETE FROM questions WHERE key NOT IN '
+            '(SELECT key FROM questions ORDER BY accessed DESC LIMIT ?)', (self.max_entries,)
+        )
+        self._conn.commit()
+        rows = self._conn.execute(
+            'SELECT key, task_type, message, answer, thoughts, accessed FROM questions '
+            'ORDER BY accessed DESC LIMIT ?', (self.max_entries,)
+        ).fetchall()
+        for key, task_type, message, answer, thoughts, accessed in reversed(rows):
+            self._store(key, {'task_type': task_type, 'message': message, 'answer': answer,
+                              'thoughts': json.loads(thoughts)}, accessed)
+
+    def embed(self, message):
+        """
+        Returns the sublinear term frequency vector of a message.
+        """
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for term in _terms(message):
+            digest = int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+            bucket = digest % self.dimensions
+            vector[bucket] += 1.0 if digest >> 63 else -1.0
+        return np.sign(vector) * np.log1p(np.abs(vector))
+
+    def _weights(self):
+        if self._weighted is None:
+            count = len(self._slots)
+            frequency = self._present.sum(axis=0)
+            idf = np.log((1 + count) / (1 + frequency)).astype(np.float32) + 1.0
+            weighted = self._vectors * idf
+            norms = np.linalg.norm(weighted, axis=1)
+            norms[norms == 0] = 1.0
+            self._weighted = (weighted / norms[:, None], idf)
+        return self._weighted
+
+    def _best(self, vector, task_type):
+        if not self._slots:
+            return 0.0, None
+        weighted, idf = self._weights()
+        query = vector * idf
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return 0.0, None
+        scores = weighted @ (query / norm)
+        scores[self._task_types != task_type] = -1.0
+        slot = int(np.argmax(scores))
+        return float(scores[slot]), slot
+
+    def lookup(self, message, task_type, threshold):
+        """
+        Returns (similarity, entry) for the most similar stored question of the same task
+        type; entry is None when the similarity is below `threshold`. Entries are dicts
+        with the message, the answer and the thoughts of each iteration.
+        """
+        vector = self.embed(message)
+        with self._lock:
+            similarity, slot = self._best(vector, task_type)
+            if slot is None or similarity < threshold:
+                self.counters['misses'] += 1
+                return similarity, None
+
+            self.counters['hits'] += 1
+            now = time.time()
+            self._used[slot] = now
+            entry = self._entries[slot]
+            if self._conn is not None:
+                self._conn.execute('UPDATE questions SET accessed = ? WHERE key = ?', (now, entry['key']))
+                self._conn.commit()
+            return similarity, entry
+
+    def _store(self, key, entry, accessed):
+        slot = self._slots.get(key)
+        evicted = None
+        if slot is None:
+            if len(self._slots) < self.max_entries:
+                slot = len(self._slots)
+            else:
+                slot = int(np.argmin(self._used))
+                evicted = self._entries[slot]['key']
+                del self._slots[evicted]
+                self.counters['evictions'] += 1
+        vector = self.embed(entry['message'])
+        self._vectors[slot] = vector
+        self._present[slot] = vector != 0
+        self._used[slot] = accessed
+        self._task_types[slot] = entry['task_type']
+        self._entries[slot] = {'key': key, **entry}
+        self._slots[key] = slot
+        self._weighted = None
+        return evicted
+
+    def put(self, message, task_type, answer, thoughts):
+        """
+        Stores an answered question with the thoughts of each iteration that led to the answer.
+        """
+        key = hashlib.sha256(f"{task_type}\n{_normalize(message)}".encode('utf-8')).hexdigest()
+        now = time.time()
+        entry = {'task_type': task_type, 'message': message, 'answer': answer, 'thoughts': thoughts}
+        with self._lock:
+            self.counters['stores'] += 1
+            evicted = self._store(key, entry, now)
+            if self._conn is not None:
+                if evicted is not None:
+                    self._conn.execute('DELETE FROM questions WHERE key = ?', (evicted,))
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO questions (key, task_type, message, answer, thoughts, accessed) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, task_type, message, answer, json.dumps(thoughts), now)
+                )
+                self._conn.commit()
+
+    def stats(self):
+        lookups = self.counters['hits'] + self.counters['misses']
+        return {**self.counters, 'entries': len(self._slots),
+                'hit_rate': self.counters['hits'] / lookups if lookups else 0.0}
+
+_cache = None
+_cache_configured = False
+
+def set_semantic_cache(cache):
+    """
+    Installs the semantic cache; pass None to disable it.
+    """
+    global _cache, _cache_configured
+    _cache = cache
+    _cache_configured = True
+
+def get_semantic_cache():
+    """
+    Returns the active semantic cache, building it from CONFIG on first use.
+    """
+    global _cache, _cache_configured
+    if not _cache_configured:
+        _cache_configured = True
+        if CONFIG.get('semantic_cache_enabled'):
+            _cache = SemanticCache(CONFIG.get('semantic_cache_path') or None,
+                                   max_entries=CONFIG['semantic_cache_max_entries'],
+                                   dimensions=CONFIG['semantic_cache_dimensions'])
+    return _cache
@@ -0,0 +1,143 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from app.config import CONFIG
+
+# Session ids become file names, so only plain hex/word ids are accepted
+_SESSION_ID_RE = re.compile(r"^[\w-]{1,64}$")
+
+class SessionStore:
+    """
+    Append-only JSONL log per session in `directory`. Every turn, iteration,
+    score and final answer is written as it is produced, so a session can be
+    rebuilt after a restart or a crash. Records carry a 'type':
+
+    session        {'id', 'created', 'config'}: the session's config overrides
+    turn           {'turn', 'message', 'task_type'}: a user message was received
+    iteration      {'turn', 'iteration', 'thoughts', 'confidence'}
+    self_evaluation {'turn', 'iteration', 'score'}
+    feedback       {'turn', 'message'}: the message with the feedback appended
+    final_answer   {'turn', 'message', 'answer'}: the turn is complete
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path(self, session_id):
+        if not _SESSION_ID_RE.match(session_id or ''):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        return os.path.join(self.directory, f"{session_id}.jsonl")
+
+    def exists(self, session_id):
+        try:
+            return os.path.exists(self.path(session_id))
+        except ValueError:
+            return False
+
+    def append(self, session_id, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            with open(self.path(session_id), 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def delete(self, session_id):
+        """
+        Removes a session's log. Returns False when there was none.
+        """
+        with self._lock:
+            try:
+                os.remove(self.path(session_id))
+            except FileNotFoundError:
+                return False
+        return True
+
+    def create(self, session_id, overrides):
+        self.append(session_id, {'type': 'session', 'id': session_id, 'created': time.time(), 'config': overrides})
+
+    def records(self, session_id):
+        """
+        Yields a session's records in order, skipping a partially written last line.
+        """
+        with open(self.path(session_id), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def load(self, session_id, window):
+        """
+        Replays a session's log. Only the last `window` chat history entries are
+        kept, so memory stays bounded however long the session is. Returns a dict
+        with the config overrides, that history window, the number of older
+        entries left on disk, the turn count, the last task type and the
+        unfinished turn if the log ends in one.
+        """
+        state = {'config': {}, 'task_type': None, 'turns': 0, 'pending_turn': None}
+        history = deque(maxlen=window)
+        total = 0
+        for record in self.records(session_id):
+            kind = record.get('type')
+            if kind == 'session':
+                state['config'] = record.get('config') or {}
+            elif kind == 'turn':
+                state['turns'] = record['turn']
+                state['task_type'] = record.get('task_type')
+                state['pending_turn'] = {'turn': record['turn'], 'message': record['message'], 'iterations': []}
+            elif kind == 'feedback' and state['pending_turn'] is not None:
+                state['pending_turn']['message'] = record['message']
+            elif kind == 'iteration' and state['pending_turn'] is not None:
+                state['pending_turn']['iterations'].append(record)
+            elif kind == 'final_answer':
+                history.append({'sender': 'user', 'text': record['message']})
+                history.append({'sender': 'assistant', 'text': record['answer']})
+                total += 2
+                state['pending_turn'] = None
+        state['chat_history'] = list(history)
+        state['history_offset'] = total - len(history)
+        return state
+
+    def history(self, session_id, start=0, end=None):
+        """
+        Reads chat history entries [start:end] back from disk.
+        """
+        entries = []
+        index = 0
+        for record in self.records(session_id):
+            if record.get('type') != 'final_answer':
+                continue
+            for entry in ({'sender': 'user', 'text': record['message']},
+                          {'sender': 'assistant', 'text': record['answer']}):
+                if index >= start and (end is None or index < end):
+                    entries.append(entry)
+                index += 1
+            if end is not None and index >= end:
+                break
+        return entries
+
+_store = None
+_store_configured = False
+
+def set_session_store(store):
+    """
+    Installs the session store; pass None to keep sessions in memory only.
+    """
+    global _store, _store_configured
+    _store = store
+    _store_configured = True
+
+def get_session_store():
+    """
+    Returns the active store, building it from CONFIG on first use.
+    """
+    global _store, _store_configured
+    if not _store_configured:
+        _store_configured = True
+        if CONFIG.get('session_store_path'):
+            _store = SessionStore(CONFIG['session_store_path'])
+    return _store
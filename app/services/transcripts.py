@@ -0,0 +1,69 @@
+import json
+import os
+import threading
+from app.config import CONFIG
+
+class TranscriptRecorder:
+    """
+    Appends one JSON line per finished turn to `path`, for replaying the scoring
+    and stop logic offline (benchmarks/replay_sweep.py). A transcript holds:
+
+    task_type, message, feedback  the question and whether feedback changed it
+    config        max_iterations, confidence_threshold, the keyword weights and the
+                  confidence_keywords override in effect
+    iterations    per iteration: the raw thoughts, confidence, the self-evaluation
+                  score it was scored with, trailer, model calls, the self-evaluation
+                  request started after it (0 or 1), estimated prompt and completion
+                  tokens and duration in seconds
+    stop          why the loop ended: confidence, ready, early_stop, finalize,
+                  max_iterations or error
+    final         calls, tokens and duration of the final answer
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def record(self, transcript):
+        line = json.dumps(transcript, ensure_ascii=False) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+def load_transcripts(path):
+    """
+    Reads the transcripts in a file, skipping a partially written last line.
+    """
+    transcripts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                transcripts.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return transcripts
+
+_recorder = None
+_recorder_configured = False
+
+def set_transcript_recorder(recorder):
+    """
+    Installs the transcript recorder; pass None to stop recording.
+    """
+    global _recorder, _recorder_configured
+    _recorder = recorder
+    _recorder_configured = True
+
+def get_transcript_recorder():
+    """
+    Returns the active recorder, building it from CONFIG on first use.
+    """
+    global _recorder, _recorder_configured
+    if not _recorder_configured:
+        _recorder_configured = True
+        if CONFIG.get('transcript_path'):
+            _recorder = TranscriptRecorder(CONFIG['transcript_path'])
+    return _recorder
@@ -0,0 +1,258 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+import httpx
+import openai
+from app.config import CONFIG
+
+# Statuses worth retrying: rate limiting, timeouts and an overloaded or restarting server
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+stats = {'requests': 0, 'retries': 0, 'rate_limited': 0, 'throttled_seconds': 0.0, 'failures': 0}
+
+def timeout():
+    return httpx.Timeout(
+        connect=CONFIG['transport_connect_timeout'],
+        read=CONFIG['transport_read_timeout'],
+        write=CONFIG['transport_connect_timeout'],
+        pool=CONFIG['transport_read_timeout']
+    )
+
+def limits():
+    return httpx.Limits(
+        max_connections=CONFIG['transport_max_connections'],
+        max_keepalive_connections=CONFIG['transport_max_keepalive'],
+        keepalive_expiry=CONFIG['transport_keepalive_expiry']
+    )
+
+def create_clients(base_url, api_key):
+    """
+    Returns (client, async_client) sharing the tuned pool and timeouts.
+    The SDK's own retries are off; create_completion() retries instead.
+    """
+    client = openai.OpenAI(
+        base_url=base_url, api_key=api_key, max_retries=0, timeout=timeout(),
+        http_client=httpx.Client(limits=limits(), timeout=timeout())
+    )
+    async_client = openai.AsyncOpenAI(
+        base_url=base_url, api_key=api_key, max_retries=0, timeout=timeout(),
+        http_client=httpx.AsyncClient(limits=limits(), timeout=timeout())
+    )
+    return client, async_client
+
+class TokenBucket:
+    """
+    Shared request rate limiter. Callers reserve a token and wait until it is due,
+    so bursts above `rate` queue up instead of failing. pause() holds every caller
+    back, which is how a 429 with Retry-After slows the whole process down.
+    A rate of 0 disables the rate limit but still honours pauses.
+    """
+
+    def __init__(self, rate=0, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Takes a token and returns the number of seconds to wait before using it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.rate > 0:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = -self.tokens / self.rate
+            return max(wait, self.blocked_until - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            stats['throttled_seconds'] += wait
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self.reserve()
+        if wait > 0:
+            stats['throttled_seconds'] += wait
+            await asyncio.sleep(wait)
+
+_limiter = None
+_stream_slots = None
+_async_stream_slots = weakref.WeakKeyDictionary()
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        _limiter = TokenBucket(CONFIG['transport_rate_limit'], CONFIG['transport_rate_burst'])
+    return _limiter
+
+def _sync_slots():
+    global _stream_slots
+    if _stream_slots is None and CONFIG['transport_max_streams']:
+        _stream_slots = threading.BoundedSemaphore(CONFIG['transport_max_streams'])
+    return _stream_slots
+
+def _async_slots():
+    # asyncio primitives belong to one event loop, so each loop gets its own semaphore
+    if not CONFIG['transport_max_streams']:
+        return None
+    loop = asyncio.get_running_loop()
+    slots = _async_stream_slots.get(loop)
+    if slots is None:
+        slots = _async_stream_slots[loop] = asyncio.Semaphore(CONFIG['transport_max_streams'])
+    return slots
+
+def retry_after(error):
+    """
+    Returns the delay a server asked for through Retry-After (seconds or an HTTP date), or None.
+    """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def retry_delay(error, attempt):
+    """
+    Returns how long to wait before retrying after `error`, or None when the error
+    is not transient or the retries are used up. Backoff is exponential with full jitter.
+    """
+    if attempt >= CONFIG['transport_max_retries']:
+        return None
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code not in RETRYABLE_STATUSES:
+            return None
+    elif not isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return None
+
+    backoff = min(CONFIG['transport_backoff_max'], CONFIG['transport_backoff_base'] * 2 ** attempt)
+    delay = random.uniform(0, backoff)
+    requested = retry_after(error)
+    if requested is not None:
+        delay = min(requested, CONFIG['transport_retry_after_max'])
+    if getattr(error, 'status_code', None) == 429:
+        stats['rate_limited'] += 1
+        # Everyone waits, not just this request, so the server gets room to recover
+        get_limiter().pause(delay)
+    return delay
+
+class SlottedStream:
+    """
+    Holds a concurrent stream slot until the stream ends, fails or is closed.
+    """
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def _done(self):
+        if self._release is not None:
+            release, self._release = self._release, None
+            release()
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self._done()
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            self._done()
+
+    def close(self):
+        self._done()
+        return self._stream.close()
+
+def create_completion(create, **kwargs):
+    """
+    Calls create(**kwargs) through the rate limiter and stream slots, retrying transient failures.
+    """
+    stream = kwargs.get('stream')
+    slots = _sync_slots() if stream else None
+    if slots is not None:
+        slots.acquire()
+    try:
+        attempt = 0
+        while True:
+            get_limiter().acquire()
+            stats['requests'] += 1
+            try:
+                completion = create(**kwargs)
+                break
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                if delay is None:
+                    stats['failures'] += 1
+                    raise
+                attempt += 1
+                stats['retries'] += 1
+                time.sleep(delay)
+    except BaseException:
+        if slots is not None:
+            slots.release()
+        raise
+    return SlottedStream(completion, slots.release) if slots is not None else completion
+
+async def create_completion_async(create, **kwargs):
+    """
+    Async counterpart of create_completion() for the AsyncOpenAI client.
+    """
+    stream = kwargs.get('stream')
+    slots = _async_slots() if stream else None
+    if slots is not None:
+        await slots.acquire()
+    try:
+        attempt = 0
+        while True:
+            await get_limiter().acquire_async()
+            stats['requests'] += 1
+            try:
+                completion = await create(**kwargs)
+                break
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                if delay is None:
+                    stats['failures'] += 1
+                    raise
+                attempt += 1
+                stats['retries'] += 1
+                await asyncio.sleep(delay)
+    except BaseException:
+        if slots is not None:
+            slots.release()
+        raise
+    return SlottedStream(completion, slots.release) if slots is not None else completion
@@ -1,7 +1,13 @@
-from app.services.openai_service import call_openai as send_request
 from app.config import CONFIG
 from app.prompts import evaluation_prompt
+from app.lexicon import CONFIDENCE_KEYWORDS, get_matcher
+from collections import OrderedDict
+import hashlib
+import inspect
+import json
 import re
+import sys
+import time
 
 BOLD = '\033[1m'
 RED = '\033[31m'
@@ -10,31 +16,218 @@ CYAN = '\033[36m'
 YELLOW = '\033[33m'
 RESET = '\033[0m'
 
+# Characters that can start markup; everything between them is copied in one slice
+_MARKUP_RE = re.compile(r"[*`\n#]")
+
+class MarkdownRenderer:
+    """
+    Incremental markdown-to-ANSI renderer for streamed text.
+
+    Each delta passed to feed() is scanned once and rendered immediately, so the cost is
+    O(len(delta)). Only a possible markup prefix at the very end of a delta (a single '*',
+    a run of backticks, or '#'s at the start of a line) is held back until the next one.
+    Supports **bold**, `inline code`, ``` fences and # headings.
+    """
+
+    def __init__(self):
+        self._reset_state()
+
+    def _reset_state(self):
+        self.bold = False
+        self.code = False
+        self.heading = False
+        self._line_start = True
+        self._pending = ""
+        self._styled = False
+
+    def _style(self):
+        codes = []
+        if self.bold or self.heading:
+            codes.append(BOLD)
+        if self.heading:
+            codes.append(YELLOW)
+        if self.code:
+            codes.append(CYAN)
+        style = "".join(codes)
+        # Only pay for a RESET when something was switched on before
+        prefix = RESET if self._styled else ""
+        self._styled = bool(codes)
+        return prefix + style
+
+    def feed(self, delta):
+        text = self._pending + delta if self._pending else delta
+        self._pending = ""
+        out = []
+        pos = 0
+        n = len(text)
+
+        while pos < n:
+            if self._line_start and text[pos] == '#' and not self.code:
+                end = pos
+                while end < n and text[end] == '#':
+                    end += 1
+                if end == n:
+                    self._pending = text[pos:]
+                    break
+                self._line_start = False
+                if text[end] == ' ':
+                    self.heading = True
+                    out.append(self._style())
+                    pos = end + 1
+                else:
+                    out.append(text[pos:end])
+                    pos = end
+                continue
+
+            match = _MARKUP_RE.search(text, pos)
+            if match is None:
+                out.append(text[pos:])
+                self._line_start = False
+                break
+
+            start = match.start()
+            if start > pos:
+                out.append(text[pos:start])
+                self._line_start = False
+            char = text[start]
+
+            if char == '\n':
+                if self.heading:
+                    self.heading = False
+                    out.append(self._style())
+                out.append('\n')
+                self._line_start = True
+                pos = start + 1
+            elif char == '*':
+                if start + 1 == n:
+                    self._pending = '*'
+                    break
+                if text[start + 1] == '*' and not self.code:
+                    self.bold = not self.bold
+                    out.append(self._style())
+                    pos = start + 2
+                else:
+                    out.append('*')
+                    pos = start + 1
+                self._line_start = False
+            elif char == '`':
+                end = start
+                while end < n and text[end] == '`':
+                    end += 1
+                if end == n:
+                    self._pending = text[start:]
+                    break
+                self.code = not self.code
+                if end - start >= 3:
+                    # Fences stay visible so code blocks keep their shape
+                    out.append(text[start:end] if self.code else "")
+                    out.append(self._style())
+                    if not self.code:
+                        out.append(text[start:end])
+                else:
+                    out.append(self._style())
+                pos = end
+                self._line_start = False
+            else:
+                out.append('#')
+                pos = start + 1
+                self._line_start = False
+
+        return "".join(out)
+
+    def flush(self):
+        """
+        Emits anything held back, closes open styles and resets for the next stream.
+        """
+        pending = self._pending
+        closing = RESET if self._styled else ""
+        self._reset_state()
+        return pending + closing
+
+_ANSI_RE = re.compile(r"\033\[[0-9;]*m")
+
+class OutputSink:
+    """
+    Coalesces terminal output into few writes.
+
+    On a terminal, text is buffered and written at most once per `frame_interval`
+    seconds; inside an event loop a timer writes whatever is left once the frame is
+    over, so a stalled stream is never held back. When the output is not a terminal
+    (or `plain` is set), ANSI styling is dropped and complete lines are written as
+    they end, which suits log files. flush() writes everything at once.
+    """
+
+    def __init__(self, stream=None, frame_interval=0.033, plain=None):
+        self.stream = stream or sys.stdout
+        if plain is None:
+            isatty = getattr(self.stream, 'isatty', None)
+            plain = not (isatty and isatty())
+        self.plain = plain
+        self.frame_interval = frame_interval
+        self.writes = 0
+        self._buffer = []
+        self._flushed = time.monotonic()
+        self._timer = None
+
+    def styled(self, text):
+        """
+        Returns text as it would be shown: without ANSI codes in plain mode.
+        """
+        return _ANSI_RE.sub("", text) if self.plain else text
+
+    def write(self, text):
+        if not text:
+            return
+        if self.plain:
+            self._buffer.append(_ANSI_RE.sub("", text))
+            if '\n' in text:
+                self._write_lines()
+            return
+
+        self._buffer.append(text)
+        if time.monotonic() - self._flushed >= self.frame_interval:
+            self.flush()
+        elif self._timer is None:
+            # Imported here: the CLI's --help path loads this module and must stay light
+            import asyncio
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._timer = loop.call_later(self.frame_interval, self.flush)
+
+    def line(self, text=""):
+        self.write(text + "\n")
+
+    def _write_lines(self):
+        text = "".join(self._buffer)
+        end = text.rfind('\n') + 1
+        self._buffer = [text[end:]] if end < len(text) else []
+        self._emit(text[:end])
+
+    def _emit(self, text):
+        self.stream.write(text)
+        self.stream.flush()
+        self.writes += 1
+        self._flushed = time.monotonic()
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._buffer:
+            text = "".join(self._buffer)
+            self._buffer = []
+            self._emit(text)
+
 def format_bold_text(text):
-    state = {'bold': False}
-    formatted_text = ""
-
-    def toggle_bold():
-        state['bold'] = not state['bold']
-        return BOLD if state['bold'] else RESET
-
-    i = 0
-    while i < len(text):
-        if text[i:i+2] == '**':
-            formatted_text += toggle_bold()
-            i += 2
-        else:
-            formatted_text += text[i]
-            i += 1
-    
-    if state['bold']:  # Ensure we close any open bold tags
-        formatted_text += RESET
-    
-    return formatted_text
+    renderer = MarkdownRenderer()
+    return renderer.feed(text) + renderer.flush()
 
-def get_user_feedback():
+def get_user_feedback(sink=None):
+    prompt = f"{BOLD}{CYAN}Your feedback (or press Enter to continue, type 'finalize' to get the final answer): {RESET}"
     while True:
-        feedback = input(f"{BOLD}{CYAN}Your feedback (or press Enter to continue, type 'finalize' to get the final answer): {RESET}").strip()
+        feedback = input(sink.styled(prompt) if sink is not None else prompt).strip()
         if feedback.lower() in ['', 'continue', 'next']:
             return None
         elif feedback.lower() in ['stop', 'exit', 'finalize']:
@@ -42,21 +235,44 @@ def get_user_feedback():
         else:
             return feedback
 
-def calculate_confidence_score(thought_process, iteration, max_iterations, correct_answers, total_answers, self_evaluation_score):
-    confidence_keywords = ['certain', 'confident', 'sure', 'likely', 'probable', 'definitely', 'undoubtedly']
-    uncertainty_keywords = ['uncertain', 'unsure', 'maybe', 'perhaps', 'possible', 'might', 'could']
+# Matches the end of a text that may still be the start of a longer word
+_TRAILING_WORD_RE = re.compile(r"\w*\Z")
+
+# Merged confidence tables by id() of the confidence_keywords override they were built from
+_confidence_tables = {}
+_CONFIDENCE_TABLES_SIZE = 64
 
-    # Count confidence and uncertainty keyword occurrences
-    confidence_score = sum(thought_process.lower().count(word) for word in confidence_keywords)
-    uncertainty_score = sum(thought_process.lower().count(word) for word in uncertainty_keywords)
+def confidence_matcher(config=None):
+    """
+    Returns the compiled matcher for the 'confidence' and 'uncertainty' keyword families.
+    Families in config['confidence_keywords'] (CONFIG when no session config is given) replace
+    the defaults; a missing one keeps its default list.
+    """
+    overrides = (CONFIG if config is None else config).get('confidence_keywords')
+    if not overrides:
+        return get_matcher(CONFIDENCE_KEYWORDS)
+    cached = _confidence_tables.get(id(overrides))
+    if cached is None or cached[0] is not overrides:
+        if len(_confidence_tables) >= _CONFIDENCE_TABLES_SIZE:
+            _confidence_tables.clear()
+        cached = _confidence_tables[id(overrides)] = (overrides, {**CONFIDENCE_KEYWORDS, **overrides})
+    return get_matcher(cached[1])
 
-    # Total words in thought process (avoid division by zero)
-    total_words = len(thought_process.split())
+def confidence_from_counts(confidence_count, uncertainty_count, total_words, iteration, max_iterations,
+                           correct_answers, total_answers, self_evaluation_score, weights=None):
+    """
+    The confidence formula behind calculate_confidence_score(), applied to precomputed counts.
+    `weights` is a (confidence, uncertainty) pair of keyword weights, taken from CONFIG when None.
+    """
+    # Avoid division by zero
     if total_words == 0:
         return 0
 
+    if weights is None:
+        weights = (CONFIG.get('confidence_keyword_weight', 1.0), CONFIG.get('uncertainty_keyword_weight', 1.0))
+
     # Calculate confidence ratio
-    confidence_ratio = (confidence_score - uncertainty_score) / total_words
+    confidence_ratio = (weights[0] * confidence_count - weights[1] * uncertainty_count) / total_words
     base_confidence = max(0, min(1, (confidence_ratio + 0.1) / 0.2))  # Ensuring it's between 0 and 1
 
     # Introduce a scaling factor for iteration progress
@@ -73,59 +289,278 @@ def calculate_confidence_score(thought_process, iteration, max_iterations, corre
 
     return max(0, min(1, adjusted_confidence))
 
-def self_evaluate(thought_process):
+def calculate_confidence_score(thought_process, iteration, max_iterations, correct_answers, total_answers, self_evaluation_score,
+                               weights=None, config=None):
+    # Count confidence and uncertainty keywords in a single pass
+    counts = confidence_matcher(config).count(thought_process)
+
+    return confidence_from_counts(
+        counts['confidence'], counts['uncertainty'], len(thought_process.split()), iteration, max_iterations,
+        correct_answers, total_answers, self_evaluation_score, weights
+    )
+
+class IncrementalConfidence:
+    """
+    Tracks calculate_confidence_score() over a streamed text, one delta at a time.
+
+    Keywords are counted once their word is complete, so only the new delta plus any
+    unfinished word from the previous one is scanned. Whenever the text fed so far ends
+    outside a word, the score equals calculate_confidence_score() on all of it.
+    """
+
+    def __init__(self, iteration, max_iterations, correct_answers=0, total_answers=0, self_evaluation_score=1.0,
+                 weights=None, config=None):
+        self.iteration = iteration
+        self.weights = weights
+        self.max_iterations = max_iterations
+        self.correct_answers = correct_answers
+        self.total_answers = total_answers
+        self.self_evaluation_score = self_evaluation_score
+        self.confidence_count = 0
+        self.uncertainty_count = 0
+        self.words = 0
+        self.score = 0
+        self._in_word = False
+        self._pending = ""
+        self._matcher = confidence_matcher(config)
+
+    def feed(self, delta):
+        if not delta:
+            return self.score
+
+        window = self._pending + delta
+        cut = _TRAILING_WORD_RE.search(window).start()
+        if cut:
+            counts = self._matcher.count(window, 0, cut)
+            self.confidence_count += counts['confidence']
+            self.uncertainty_count += counts['uncertainty']
+        self._pending = window[cut:]
+
+        words = len(delta.split())
+        if words and self._in_word and not delta[0].isspace():
+            words -= 1  # The delta continues a word started in the previous one
+        self.words += words
+        self._in_word = not delta[-1].isspace()
+
+        self.score = confidence_from_counts(
+            self.confidence_count, self.uncertainty_count, self.words, self.iteration, self.max_iterations,
+            self.correct_answers, self.total_answers, self.self_evaluation_score, self.weights
+        )
+        return self.score
+
+class TrailerParser:
+    """
+    Separates a streamed iteration into its thoughts and the assessment trailer that
+    follows `marker` (see get_trailer_instruction()).
+
+    feed() returns the part of each delta that can be displayed at once. Only text that
+    could be the start of the marker is held back, never more than len(marker) - 1
+    characters; everything after the marker is collected instead of displayed.
+    """
+
+    def __init__(self, marker):
+        self.marker = marker
+        self._held = ""
+        self._trailer = None
+
+    def feed(self, delta):
+        if self._trailer is not None:
+            self._trailer.append(delta)
+            return ""
+
+        window = self._held + delta
+        index = window.find(self.marker)
+        if index >= 0:
+            self._held = ""
+            self._trailer = [window[index + len(self.marker):]]
+            return window[:index]
+
+        # Hold back the longest ending of the window that the marker starts with
+        start = window.find(self.marker[0], max(0, len(window) - len(self.marker) + 1))
+        while start >= 0 and not self.marker.startswith(window[start:]):
+            start = window.find(self.marker[0], start + 1)
+        if start < 0:
+            self._held = ""
+            return window
+        self._held = window[start:]
+        return window[:start]
+
+    def finish(self):
+        """
+        Returns (text still to display, trailer). The trailer is None when the marker
+        never arrived or what followed it is malformed.
+        """
+        held, self._held = self._held, ""
+        if self._trailer is None:
+            return held, None
+        return "", parse_trailer("".join(self._trailer))
+
+# A number, optionally written as a fraction ("8/10", "8 out of 10") or a percentage ("85%")
+_SCORE_RE = re.compile(r"(\d+(?:\.\d+)?|\.\d+)\s*(?:(/|out of)\s*(\d+(?:\.\d+)?)|(%))?")
+_EVALUATION_CACHE_SIZE = 512
+_evaluation_cache = OrderedDict()
+
+def parse_evaluation_score(text):
+    """
+    Extracts a 0-1 score from a model reply such as "0.85", "Score: 0.8", "8/10", "8 out of 10" or "85%".
+    A decimal from 0 to 1 is preferred, then a number with an explicit scale, then a bare 0 or 1.
+    Other numbers are not guessed at: returns None when the reply contains no usable score.
+    """
+    scaled = whole = None
+    for match in _SCORE_RE.finditer(text or ""):
+        value = float(match.group(1))
+        if match.group(2):
+            if scaled is None and float(match.group(3)) > 0 and 0 <= value / float(match.group(3)) <= 1:
+                scaled = value / float(match.group(3))
+        elif match.group(4):
+            if scaled is None and value <= 100:
+                scaled = value / 100
+        elif '.' in match.group(1):
+            if value <= 1:
+                return value
+        elif whole is None and value <= 1:
+            whole = value
+    return scaled if scaled is not None else whole
+
+def parse_trailer(text):
+    """
+    Parses the JSON object of an assessment trailer into {'score', 'criteria_covered', 'ready'}.
+    Returns None when there is no object or a field is missing or of the wrong type.
+    """
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end < start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    score = data.get('score')
+    criteria = data.get('criteria_covered', [])
+    ready = data.get('ready')
+    # The protocol asks for a number from 0 to 1; only strings that say their scale ("8/10", "80%") are converted
+    if isinstance(score, str) and ('/' in score or '%' in score):
+        score = parse_evaluation_score(score)
+    elif isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 1:
+        score = None
+    if score is None or not isinstance(ready, bool):
+        return None
+    if not isinstance(criteria, list) or not all(isinstance(item, str) for item in criteria):
+        return None
+    return {'score': float(score), 'criteria_covered': criteria, 'ready': ready}
+
+def _evaluation_request(thought_process):
+    key = hashlib.sha256(thought_process.encode('utf-8')).hexdigest()
+    messages = [{'role': 'user', 'content': evaluation_prompt.format(thought_process=thought_process)}]
+    return key, messages
+
+def _adjusted_evaluation(evaluation_score, config):
+    # Compare the score with the confidence threshold and adjust
+    if evaluation_score < config['confidence_threshold']:
+        evaluation_score *= 0.9  # Penalize low confidence score
+    return max(0, min(1, evaluation_score))
+
+def _cached_evaluation(key, config):
+    # The model's own score is cached; the threshold adjustment depends on the caller's config
+    score = _evaluation_cache.get(key)
+    if score is None:
+        return None
+    _evaluation_cache.move_to_end(key)
+    return _adjusted_evaluation(score, config)
+
+def _finish_evaluation(key, response, config):
+    if isinstance(response, dict) or not response.choices:
+        return 0.0
+    evaluation_score = parse_evaluation_score(response.choices[0].message.content)
+    if evaluation_score is None:
+        return 0.0
+
+    _evaluation_cache[key] = evaluation_score
+    if len(_evaluation_cache) > _EVALUATION_CACHE_SIZE:
+        _evaluation_cache.popitem(last=False)
+    return _adjusted_evaluation(evaluation_score, config)
+
+def _evaluation_max_tokens(config, task_type):
+    # A self_evaluation route's own max_tokens wins over self_evaluation_max_tokens
+    from app.services.openai_service import resolve_route
+
+    _, route = resolve_route('self_evaluation', task_type, config)
+    return None if route.get('max_tokens') else config['self_evaluation_max_tokens']
+
+def self_evaluate(thought_process, config=None, task_type=None):
     """
     Evaluates the thought process by sending it to an LLM API and getting a score between 0 and 1.
-    
-    :param thought_process: A string or list representing the thought process to be evaluated.
-    :return: A score between 0 and 1, indicating the quality of the thought process.
+    Scores are cached by a hash of the thought process.
+
+    :param thought_process: A string representing the thought process to be evaluated.
+    :param config: The session's config; the global CONFIG when None.
+    :param task_type: Selects a 'self_evaluation:<task_type>' model route when one is configured.
+    :return: A score between 0 and 1, or 0.0 when no score could be obtained.
     """
-    
-    # Construct the evaluation prompt
-    prompt = evaluation_prompt.format(thought_process=thought_process)
-
-    # Send the request to OpenAI or other LLM via the existing API call infrastructure
-    response = send_request(prompt)  # Assuming send_request handles API call, response parsing, and errors
-
-    # Ensure valid response format
-    if 'score' in response:
-        try:
-            evaluation_score = float(response['score'])
-        except ValueError:
-            evaluation_score = 0.0  # Fallback if score is not a valid float
-
-        # Compare the score with the confidence threshold and adjust
-        if evaluation_score < CONFIG['confidence_threshold']:
-            evaluation_score *= 0.9  # Penalize low confidence score
-        return max(0, min(1, evaluation_score))  # Keep it between 0 and 1
-    
-    # If no score is returned, return a default low score
-    return 0.0
-
-def process_buffer(buffer):
-    formatted_content = ""
-    while '**' in buffer:
-        parts = buffer.split('**', 2)
-        if len(parts) >= 2:
-            formatted_content += format_bold_text(parts[0] + '**' + parts[1] + '**')
-            buffer = ''.join(parts[2:])
-        else:
-            break
-    return formatted_content, buffer
+    config = config or CONFIG
+    key, messages = _evaluation_request(thought_process)
+    cached = _cached_evaluation(key, config)
+    if cached is not None:
+        return cached
+
+    # Imported here so that app.utils does not pull in the client stack
+    from app.services.openai_service import call_openai
+
+    # A short, non-streaming request: only a single number is expected back
+    response = call_openai(messages, stream=False, max_tokens=_evaluation_max_tokens(config, task_type),
+                           stage='self_evaluation', task_type=task_type, config=config)
+    return _finish_evaluation(key, response, config)
+
+async def self_evaluate_async(thought_process, config=None, task_type=None):
+    """
+    Async counterpart of self_evaluate(), so scoring can overlap with generation.
+    """
+    config = config or CONFIG
+    key, messages = _evaluation_request(thought_process)
+    cached = _cached_evaluation(key, config)
+    if cached is not None:
+        return cached
+
+    from app.services.openai_service import call_openai_async
 
-def stream_format(response, process_func):
-    buffer = ""
+    response = await call_openai_async(messages, stream=False, max_tokens=_evaluation_max_tokens(config, task_type),
+                                       stage='self_evaluation', task_type=task_type, config=config)
+    return _finish_evaluation(key, response, config)
+
+def stream_format(response, renderer=None):
+    """
+    Yields the rendered text of a streaming completion as it arrives.
+    """
+    renderer = renderer or MarkdownRenderer()
     for chunk in response:
-        if chunk.choices[0].delta.content is not None:
-            content = chunk.choices[0].delta.content
-            buffer += content
-            formatted_content, remaining_buffer = process_func(buffer)
+        if chunk.choices and chunk.choices[0].delta.content is not None:
+            formatted_content = renderer.feed(chunk.choices[0].delta.content)
             if formatted_content:
                 yield formatted_content
-            buffer = remaining_buffer
-    
-    if buffer:
-        yield format_bold_text(buffer)
+
+    remaining = renderer.flush()
+    if remaining:
+        yield remaining
+
+async def stream_content_async(response):
+    """
+    Yields the raw text deltas of an async streaming completion.
+    """
+    async for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content is not None:
+            yield chunk.choices[0].delta.content
+
+async def close_stream(response):
+    """
+    Closes a streaming completion early, releasing its HTTP connection and the server's slot.
+    """
+    close = getattr(response, 'close', None)
+    if close is not None:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
 
 def generate_mind_map(thought_process):
     lines = thought_process.split('\n')
@@ -0,0 +1,82 @@
+"""
+Benchmark for keyword classification and confidence scoring.
+
+Times the KeywordMatcher paths against the substring-counting implementations
+they replaced, on synthetic user messages and thought texts. --extra-keywords
+grows every keyword family, which the old code pays for once per keyword.
+
+    python -m benchmarks.bench_lexicon --messages 20000 --thought-words 2000
+    python -m benchmarks.bench_lexicon --extra-keywords 50
+"""
+import argparse
+import random
+import time
+
+from app.config import CONFIG
+from app.lexicon import TASK_KEYWORDS, CONFIDENCE_KEYWORDS
+from app.utils import calculate_confidence_score
+from app.services.openai_service import determine_task_type_and_criteria, determine_task_types_and_criteria
+
+FILLER = ['the', 'a', 'we', 'should', 'consider', 'database', "couldn't", 'approach', 'results', 'users']
+
+def legacy_task_type(user_message, task_keywords):
+    user_message = user_message.lower()
+    counts = {task: sum(user_message.count(keyword) for keyword in keywords)
+              for task, keywords in task_keywords.items()}
+    return max(counts, key=counts.get) if any(counts.values()) else 'general'
+
+def legacy_confidence_counts(thought_process, confidence_keywords):
+    confidence = sum(thought_process.lower().count(word) for word in confidence_keywords['confidence'])
+    uncertainty = sum(thought_process.lower().count(word) for word in confidence_keywords['uncertainty'])
+    return confidence, uncertainty, len(thought_process.split())
+
+def extended(table, extra):
+    return {family: keywords + [f"{family[:4]}term{i}" for i in range(extra)] for family, keywords in table.items()}
+
+def synthetic_text(rng, words, tables, keyword_rate=0.08):
+    keywords = [k for table in tables for ks in table.values() for k in ks]
+    return " ".join(rng.choice(keywords) if rng.random() < keyword_rate else rng.choice(FILLER)
+                    for _ in range(words))
+
+def timed(name, func, repeat, unit):
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<32} {elapsed:8.4f}s {elapsed / repeat * 1e6:10.2f} us/{unit}")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark keyword classification and confidence scoring')
+    parser.add_argument('--messages', type=int, default=20000, help='Number of user messages to classify')
+    parser.add_argument('--message-words', type=int, default=40, help='Words per user message')
+    parser.add_argument('--thoughts', type=int, default=500, help='Number of thought texts to score')
+    parser.add_argument('--thought-words', type=int, default=2000, help='Words per thought text')
+    parser.add_argument('--extra-keywords', type=int, default=0, help='Synthetic keywords added to every family')
+    args = parser.parse_args()
+
+    # Extended tables go through CONFIG, the same way user-supplied tables do
+    task_keywords = CONFIG['task_keywords'] = extended(TASK_KEYWORDS, args.extra_keywords)
+    confidence_keywords = CONFIG['confidence_keywords'] = extended(CONFIDENCE_KEYWORDS, args.extra_keywords)
+    tables = (task_keywords, confidence_keywords)
+
+    rng = random.Random(0)
+    messages = [synthetic_text(rng, args.message_words, tables) for _ in range(args.messages)]
+    thoughts = [synthetic_text(rng, args.thought_words, tables) for _ in range(args.thoughts)]
+
+    print(f"Classification of {len(messages)} messages")
+    legacy = timed('legacy substring counts', lambda: [legacy_task_type(m, task_keywords) for m in messages],
+                   len(messages), 'msg')
+    single = timed('keyword matcher, per message',
+                   lambda: [determine_task_type_and_criteria(m) for m in messages], len(messages), 'msg')
+    batch = timed('keyword matcher, batch', lambda: determine_task_types_and_criteria(messages), len(messages), 'msg')
+    print(f"speedup: {legacy / single:.2f}x per message, {legacy / batch:.2f}x batch")
+
+    print(f"\nConfidence scoring of {len(thoughts)} texts")
+    legacy = timed('legacy substring counts', lambda: [legacy_confidence_counts(t, confidence_keywords) for t in thoughts],
+                   len(thoughts), 'text')
+    compiled = timed('keyword matcher', lambda: [calculate_confidence_score(t, 1, 5, 0, 0, 1.0) for t in thoughts],
+                     len(thoughts), 'text')
+    print(f"speedup: {legacy / compiled:.2f}x")
+
+if __name__ == '__main__':
+    main()
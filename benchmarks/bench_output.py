@@ -0,0 +1,107 @@
+"""
+Terminal output benchmark: write syscalls and CPU time per 10k streamed tokens.
+
+Feeds a synthetic markdown stream through the renderer the way the CLI does and
+compares printing every fragment with print(..., flush=True), as chat() used to,
+with the frame-throttled OutputSink on a terminal and in plain (non-TTY) mode.
+Output goes to /dev/null through a file object that counts its write calls.
+
+    python -m benchmarks.bench_output --tokens 10000 --tokens-per-sec 2000
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+
+from app.utils import MarkdownRenderer, OutputSink
+from benchmarks.bench_render import synthetic_stream
+
+class CountingFile(io.FileIO):
+    """
+    A raw file that counts write() calls, each of which is one system call.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = 0
+
+    def write(self, data):
+        self.calls += 1
+        return super().write(data)
+
+def _stdout_like():
+    raw = CountingFile(os.devnull, 'w')
+    return raw, io.TextIOWrapper(io.BufferedWriter(raw), encoding='utf-8')
+
+async def _paced(deltas, tokens_per_sec, emit):
+    """
+    Calls emit(delta) for every delta, at tokens_per_sec when it is set.
+    """
+    started = time.perf_counter()
+    for index, delta in enumerate(deltas):
+        emit(delta)
+        # Sleeping in batches keeps the pacing from dominating the measurement
+        if tokens_per_sec and index % 20 == 19:
+            delay = started + (index + 1) / tokens_per_sec - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+async def run_legacy(deltas, tokens_per_sec):
+    raw, stream = _stdout_like()
+    renderer = MarkdownRenderer()
+
+    def emit(delta):
+        formatted = renderer.feed(delta)
+        if formatted:
+            print(formatted, end="", flush=True, file=stream)
+
+    cpu = time.process_time()
+    await _paced(deltas, tokens_per_sec, emit)
+    print(renderer.flush(), file=stream, flush=True)
+    return raw.calls, time.process_time() - cpu
+
+async def run_sink(deltas, tokens_per_sec, plain, frame_interval):
+    raw, stream = _stdout_like()
+    out = OutputSink(stream, frame_interval=frame_interval, plain=plain)
+    renderer = MarkdownRenderer()
+
+    def emit(delta):
+        out.write(delta if plain else renderer.feed(delta))
+
+    cpu = time.process_time()
+    await _paced(deltas, tokens_per_sec, emit)
+    out.line("" if plain else renderer.flush())
+    out.flush()
+    return raw.calls, time.process_time() - cpu
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark terminal output')
+    parser.add_argument('--tokens', type=int, default=10000, help='Streamed deltas (about one token each)')
+    parser.add_argument('--tokens-per-sec', type=float, default=2000, help='Delivery rate (0 for unpaced)')
+    parser.add_argument('--frame-interval', type=float, default=0.033, help='OutputSink frame interval in seconds')
+    parser.add_argument('--json', metavar='PATH', help='Write the results to a JSON file')
+    args = parser.parse_args()
+
+    deltas = synthetic_stream(args.tokens * 4, 4)
+    scale = 10000 / len(deltas)
+    modes = {
+        'print_flush': lambda: run_legacy(deltas, args.tokens_per_sec),
+        'sink_tty': lambda: run_sink(deltas, args.tokens_per_sec, False, args.frame_interval),
+        'sink_plain': lambda: run_sink(deltas, args.tokens_per_sec, True, args.frame_interval),
+    }
+
+    results = {'benchmark': 'output', 'settings': vars(args), 'modes': {}}
+    print(f"{'mode':<14}{'writes/10k':>12}{'cpu ms/10k':>12}")
+    for name, run in modes.items():
+        writes, cpu = asyncio.run(run())
+        results['modes'][name] = {'writes_per_10k': writes * scale, 'cpu_ms_per_10k': cpu * 1e3 * scale}
+        print(f"{name:<14}{writes * scale:>12.0f}{cpu * 1e3 * scale:>12.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
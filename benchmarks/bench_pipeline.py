@@ -0,0 +1,262 @@
+"""
+End-to-end benchmark of the reasoning pipeline against the bundled mock server.
+
+Starts app.mock_server in a subprocess, runs N concurrent sessions through the
+same iteration/final-answer turns chat() drives (headless, without feedback),
+renders their output like the CLI does and reports the time spent in each
+local stage next to end-to-end throughput.
+
+    python -m benchmarks.bench_pipeline --sessions 8 --turns 2 --json results.json
+    python -m benchmarks.bench_pipeline --baseline results.json --ttft 0 --tokens-per-sec 0
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+PROMPTS = [
+    "Design a business plan for a new product in the coffee market.",
+    "Write a function and algorithm to debug slow code.",
+    "Propose an experiment to test the hypothesis that sleep improves memory.",
+    "Write a short story with a surprising plot twist.",
+]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_mock_server(port, args):
+    command = [
+        sys.executable, '-m', 'app.mock_server', '--port', str(port),
+        '--ttft', str(args.ttft), '--tokens-per-sec', str(args.tokens_per_sec),
+        '--completion-tokens', str(args.completion_tokens), '--failure-rate', str(args.failure_rate),
+        '--seed', '0',
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/v1/models", timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError('The mock server did not start.')
+
+class StageTimer:
+    """
+    Accumulates wall time per stage; wrap() times every call of a function.
+    """
+
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, stage, elapsed):
+        self.samples.setdefault(stage, []).append(elapsed)
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+        return timed
+
+    def summary(self):
+        result = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            result[stage] = {
+                'calls': len(samples),
+                'total': sum(samples),
+                'mean': statistics.fmean(samples),
+                'p50': ordered[len(ordered) // 2],
+                'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            }
+        return result
+
+def install_timers(timer):
+    """
+    Wraps the engine's local stages so their cost can be told apart from model latency.
+    """
+    from app.services import reasoning_engine
+
+    for stage, name in (('prepare_messages', 'prepare_messages'),
+                        ('prepare_messages', 'prepare_prefix_stable_messages'),
+                        ('scoring', 'calculate_confidence_score'),
+                        ('mind_map', 'generate_mind_map')):
+        setattr(reasoning_engine, name, timer.wrap(stage, getattr(reasoning_engine, name)))
+
+async def run_session(index, args, timer, turns, prefix):
+    from app.services.reasoning_engine import create_session, run_turn
+    from app.utils import MarkdownRenderer
+
+    # A threshold above 1 makes every turn run all of its iterations, so runs are comparable
+    session = create_session({
+        'max_iterations': args.iterations,
+        'confidence_threshold': 1.01,
+        'self_evaluation_enabled': args.self_evaluation,
+        'structured_trailer_enabled': args.structured_trailer,
+        'prompt_layout': args.layout,
+    })
+    for turn in range(args.turns):
+        renderer = MarkdownRenderer()
+        output = []
+        record = {'session': index, 'turn': turn, 'tokens': 0, 'errors': 0, 'first_token': None}
+        started = time.perf_counter()
+        async for event in run_turn(session, PROMPTS[(index + turn) % len(PROMPTS)]):
+            kind = event['type']
+            if kind in ('thought', 'final'):
+                if record['first_token'] is None:
+                    record['first_token'] = time.perf_counter() - started
+                record['tokens'] += 1
+                render_started = time.perf_counter()
+                output.append(renderer.feed(event['content']))
+                timer.add('render', time.perf_counter() - render_started)
+            elif kind in ('iteration_end', 'final_answer'):
+                render_started = time.perf_counter()
+                output.append(renderer.flush())
+                timer.add('render', time.perf_counter() - render_started)
+            elif kind == 'error':
+                record['errors'] += 1
+        record['duration'] = time.perf_counter() - started
+        turns.append(record)
+    prefix[index] = session['prefix_stats']
+
+async def run_benchmark(args, timer):
+    turns = []
+    prefix = {}
+    started = time.perf_counter()
+    await asyncio.gather(*(run_session(index, args, timer, turns, prefix) for index in range(args.sessions)))
+    wall_time = time.perf_counter() - started
+
+    durations = sorted(turn['duration'] for turn in turns)
+    first_tokens = sorted(turn['first_token'] for turn in turns if turn['first_token'] is not None)
+    deltas = sum(turn['tokens'] for turn in turns)
+    prompt_chars = sum(stats['prompt_chars'] for stats in prefix.values())
+    return {
+        'wall_time': wall_time,
+        'turns': len(turns),
+        'errors': sum(turn['errors'] for turn in turns),
+        'turns_per_sec': len(turns) / wall_time,
+        'deltas_per_sec': deltas / wall_time,
+        'turn_latency_p50': durations[len(durations) // 2],
+        'turn_latency_p95': durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+        'first_token_p50': first_tokens[len(first_tokens) // 2] if first_tokens else None,
+        'prompt_chars': prompt_chars,
+        'prefix_reuse': sum(stats['reused_chars'] for stats in prefix.values()) / prompt_chars if prompt_chars else 0.0,
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, baseline=None):
+    print(f"{'stage':<18}{'calls':>8}{'total s':>10}{'mean us':>10}{'p95 us':>10}")
+    for stage, stats in sorted(results['stages'].items()):
+        line = (f"{stage:<18}{stats['calls']:>8}{stats['total']:>10.3f}"
+                f"{stats['mean'] * 1e6:>10.1f}{stats['p95'] * 1e6:>10.1f}")
+        previous = (baseline or {}).get('stages', {}).get(stage)
+        if previous and previous['mean']:
+            line += f"   x{stats['mean'] / previous['mean']:.2f} vs {baseline.get('commit') or 'baseline'}"
+        print(line)
+
+    throughput = results['throughput']
+    print(f"\n{throughput['turns']} turns in {throughput['wall_time']:.2f}s: "
+          f"{throughput['turns_per_sec']:.2f} turns/s, {throughput['deltas_per_sec']:.0f} deltas/s, "
+          f"p50 turn {throughput['turn_latency_p50']:.2f}s, p95 turn {throughput['turn_latency_p95']:.2f}s, "
+          f"{throughput['errors']} errors")
+    for route, stats in sorted((results.get('routes') or {}).items()):
+        ttft = f"{stats['ttft_mean'] * 1e3:.0f}ms" if stats['ttft_mean'] is not None else "-"
+        print(f"Route {route}: {stats['calls']} calls, mean {stats['duration_mean']:.2f}s, first token {ttft}, "
+              f"{stats['prompt_tokens']} prompt / {stats['completion_tokens']} completion tokens")
+    if 'prefix_reuse' in throughput:
+        print(f"Prompt prefix reuse {throughput['prefix_reuse']:.1%} of {throughput['prompt_chars']} prompt chars")
+    if baseline:
+        previous = baseline['throughput']['turns_per_sec']
+        print(f"Throughput x{throughput['turns_per_sec'] / previous:.2f} vs {baseline.get('commit') or 'baseline'}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the reasoning pipeline end to end')
+    parser.add_argument('--sessions', type=int, default=4, help='Concurrent sessions')
+    parser.add_argument('--turns', type=int, default=2, help='Turns per session')
+    parser.add_argument('--iterations', type=int, default=3, help='Thought iterations per turn')
+    parser.add_argument('--self-evaluation', action='store_true', help='Enable the self-evaluation stage')
+    parser.add_argument('--structured-trailer', action='store_true',
+                        help='Ask for a self-assessment trailer after each iteration')
+    parser.add_argument('--layout', choices=['classic', 'prefix_stable'], default='classic',
+                        help='Prompt layout (prompt_layout)')
+    parser.add_argument('--ttft', type=float, default=0.05, help='Mock time to first token in seconds')
+    parser.add_argument('--tokens-per-sec', type=float, default=500, help='Mock streaming rate (0 for unthrottled)')
+    parser.add_argument('--completion-tokens', type=int, default=200, help='Mock tokens per completion')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Share of mock requests that fail')
+    parser.add_argument('--no-instrumentation', action='store_true', help='Disable the metric sinks')
+    parser.add_argument('--record', metavar='PATH',
+                        help='Append transcripts of every turn for benchmarks.replay_sweep')
+    parser.add_argument('--base-url', help='Benchmark an already running server instead of starting the mock')
+    parser.add_argument('--json', metavar='PATH', help='Write the results to a JSON file')
+    parser.add_argument('--baseline', metavar='PATH', help='Compare with results written by an earlier run')
+    args = parser.parse_args()
+
+    process = None
+    if args.base_url:
+        os.environ['OPENAI_BASE_URL'] = args.base_url
+    else:
+        port = free_port()
+        process = start_mock_server(port, args)
+        os.environ['OPENAI_BASE_URL'] = f"http://127.0.0.1:{port}/v1"
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    os.environ.setdefault('OPENAI_MODEL', 'mock')
+
+    try:
+        # The backend pool reads the environment when the first request is made
+        from app.services.response_cache import set_response_cache
+        set_response_cache(None)
+        if args.record:
+            from app.services.transcripts import TranscriptRecorder, set_transcript_recorder
+            set_transcript_recorder(TranscriptRecorder(args.record))
+        if args.no_instrumentation:
+            from app.services.instrumentation import set_sinks
+            set_sinks([])
+        timer = StageTimer()
+        install_timers(timer)
+        throughput = asyncio.run(run_benchmark(args, timer))
+        from app.services.instrumentation import get_route_summary
+        routes = get_route_summary()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    results = {
+        'benchmark': 'pipeline',
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': vars(args),
+        'stages': timer.summary(),
+        'throughput': throughput,
+        'routes': routes,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Micro-benchmark for the streaming markdown renderer.
+
+Renders a multi-megabyte synthetic stream, fed in small deltas like a fast local
+model produces them, with the current MarkdownRenderer and with the buffer-based
+approach it replaced (process_buffer + per-character format_bold_text).
+
+    python -m benchmarks.bench_render --size-mb 4 --chunk-size 4
+"""
+import argparse
+import random
+import time
+
+from app.utils import MarkdownRenderer, BOLD, RESET
+
+WORDS = ['analysis', 'market', 'the', 'of', 'hypothesis', 'a', 'feasibility', 'data', 'and', 'user']
+
+def synthetic_stream(size, chunk_size, seed=0):
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        roll = rng.random()
+        if roll < 0.02:
+            piece = f"\n## {rng.choice(WORDS).title()}\n"
+        elif roll < 0.06:
+            piece = f"**{rng.choice(WORDS)}** "
+        elif roll < 0.08:
+            piece = f"`{rng.choice(WORDS)}()` "
+        elif roll < 0.12:
+            piece = "\n- "
+        else:
+            piece = rng.choice(WORDS) + " "
+        parts.append(piece)
+        length += len(piece)
+    text = "".join(parts)[:size]
+    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+def legacy_format_bold_text(text):
+    state = {'bold': False}
+    formatted_text = ""
+
+    def toggle_bold():
+        state['bold'] = not state['bold']
+        return BOLD if state['bold'] else RESET
+
+    i = 0
+    while i < len(text):
+        if text[i:i+2] == '**':
+            formatted_text += toggle_bold()
+            i += 2
+        else:
+            formatted_text += text[i]
+            i += 1
+    if state['bold']:
+        formatted_text += RESET
+    return formatted_text
+
+def legacy_process_buffer(buffer):
+    formatted_content = ""
+    while '**' in buffer:
+        parts = buffer.split('**', 2)
+        if len(parts) >= 2:
+            formatted_content += legacy_format_bold_text(parts[0] + '**' + parts[1] + '**')
+            buffer = ''.join(parts[2:])
+        else:
+            break
+    return formatted_content, buffer
+
+def run_legacy(deltas):
+    buffer = ""
+    output = ""
+    for content in deltas:
+        buffer += content
+        formatted_content, buffer = legacy_process_buffer(buffer)
+        output += formatted_content
+    if buffer:
+        output += legacy_format_bold_text(buffer)
+    return output
+
+def run_renderer(deltas):
+    renderer = MarkdownRenderer()
+    output = [renderer.feed(content) for content in deltas]
+    output.append(renderer.flush())
+    return "".join(output)
+
+def measure(name, func, deltas, size):
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    func(deltas)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    print(f"{name:<10} {elapsed:8.3f}s wall {cpu:8.3f}s cpu "
+          f"{size / elapsed / 1e6:8.2f} MB/s {elapsed / len(deltas) * 1e6:8.3f} us/delta")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the streaming markdown renderer')
+    parser.add_argument('--size-mb', type=float, default=4, help='Size of the synthetic stream in MB')
+    parser.add_argument('--chunk-size', type=int, default=4, help='Characters per streamed delta')
+    parser.add_argument('--skip-legacy', action='store_true', help='Only time the current renderer')
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1e6)
+    deltas = synthetic_stream(size, args.chunk_size)
+    print(f"{len(deltas)} deltas, {size / 1e6:.1f} MB")
+    measure('renderer', run_renderer, deltas, size)
+    if not args.skip_legacy:
+        measure('legacy', run_legacy, deltas, size)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Startup benchmark: how long a fresh process takes to be useful.
+
+Measures a cold `python -m app.main --help`, the import of the main entry
+modules, and the time from spawning a process to the first streamed token of
+a request against the mock server. Batch workers pay these costs per process.
+
+    python -m benchmarks.bench_startup --runs 10 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+from benchmarks.bench_pipeline import free_port, start_mock_server
+
+IMPORTS = ['app.main', 'app.services.reasoning_engine', 'app.server']
+
+FIRST_REQUEST = """
+import asyncio
+from app.services.openai_service import call_openai_async
+from app.utils import stream_content_async
+
+async def first_token():
+    response = await call_openai_async([{'role': 'user', 'content': 'Hello'}], use_cache=False)
+    async for _ in stream_content_async(response):
+        return
+    raise SystemExit(response)
+
+asyncio.run(first_token())
+"""
+
+def _timed_runs(command, runs, env):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - started)
+    return {'min': min(samples), 'median': statistics.median(samples), 'max': max(samples)}
+
+def _import_time(module, env):
+    """
+    Returns the cumulative import time of a module in seconds, from -X importtime.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            env=env, check=True, capture_output=True, text=True)
+    for line in reversed(result.stderr.splitlines()):
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1e6
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark process startup')
+    parser.add_argument('--runs', type=int, default=10, help='Processes spawned per measurement')
+    parser.add_argument('--json', metavar='PATH', help='Write the results to a JSON file')
+    args = parser.parse_args()
+
+    # No key or endpoint: --help and imports must not need them
+    env = {key: value for key, value in os.environ.items() if not key.startswith('OPENAI_')}
+    results = {
+        'benchmark': 'startup',
+        'help': _timed_runs([sys.executable, '-m', 'app.main', '--help'], args.runs, env),
+        'python': _timed_runs([sys.executable, '-c', 'pass'], args.runs, env),
+        'imports': {module: _import_time(module, env) for module in IMPORTS},
+    }
+
+    port = free_port()
+    mock = start_mock_server(port, SimpleNamespace(ttft=0, tokens_per_sec=0, completion_tokens=20, failure_rate=0))
+    try:
+        request_env = {**env, 'OPENAI_API_KEY': 'benchmark', 'OPENAI_MODEL': 'mock',
+                       'OPENAI_BASE_URL': f"http://127.0.0.1:{port}/v1"}
+        results['first_token'] = _timed_runs([sys.executable, '-c', FIRST_REQUEST], args.runs, request_env)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    print(f"{'measurement':<34}{'min ms':>10}{'median ms':>12}")
+    for name in ('python', 'help', 'first_token'):
+        print(f"{name:<34}{results[name]['min'] * 1e3:>10.1f}{results[name]['median'] * 1e3:>12.1f}")
+    for module, seconds in results['imports'].items():
+        print(f"{'import ' + module:<34}{'':>10}{seconds * 1e3 if seconds is not None else float('nan'):>12.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Offline replay of recorded turns: re-runs the confidence score and the stop logic
+of run_turn() over transcripts written in record mode (`python -m app.main --record
+PATH`, `transcript_path` or `bench_pipeline --record PATH`) and sweeps the settings
+that decide how many model calls a question costs.
+
+For every combination of confidence_threshold, max_iterations and the confidence
+and uncertainty keyword weights it reports the expected calls, tokens and latency
+per turn and how often the stop point moves from the recorded one, and prints the
+settings that are cheapest for a given share of moved stop points. Keywords are
+counted once per iteration with the keyword tables the turn was recorded with; the
+scores and stop points of all thresholds are then computed at once as numpy arrays,
+one task per (max_iterations, weights) combination on a process pool.
+
+Transcripts only hold the iterations that ran. A setting that would go on past the
+last recorded iteration stops there and the turn is counted as truncated, so its
+costs are a lower bound. Record with a confidence_threshold above 1 to keep every
+iteration up to max_iterations. Turns with feedback, a finalize or an error are
+left out: their stop point was not decided by the score.
+
+    python -m benchmarks.replay_sweep transcripts.jsonl --thresholds 0.5:0.95:0.05 --max-iterations 2,3,5
+    python -m benchmarks.replay_sweep transcripts.jsonl --confidence-weights 0.5,1,2 --workers 8 --json sweep.json
+"""
+import argparse
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from app.config import CONFIG
+from app.services.transcripts import load_transcripts
+from app.utils import confidence_matcher
+
+_arrays = None
+
+def _values(text, cast=float):
+    """
+    Parses "a,b,c" or an inclusive range "start:stop:step".
+    """
+    if ':' in text:
+        start, stop, step = (float(part) for part in text.split(':'))
+        return [cast(round(value, 10)) for value in np.arange(start, stop + step / 2, step)]
+    return [cast(value) for value in text.split(',')]
+
+def build_arrays(transcripts):
+    """
+    Packs the replayable turns into (turns, iterations) arrays padded to the longest turn.
+    """
+    turns = [t for t in transcripts
+             if t['iterations'] and not t.get('feedback') and t.get('stop') not in ('finalize', 'error')]
+    length = max((len(t['iterations']) for t in turns), default=0)
+    shape = (len(turns), length)
+    arrays = {name: np.zeros(shape) for name in (
+        'iteration', 'confidence_count', 'uncertainty_count', 'words', 'self_evaluation', 'ready_score',
+        'early_stop', 'calls', 'evaluations', 'prompt_tokens', 'completion_tokens', 'duration', 'recorded_score'
+    )}
+    arrays['valid'] = np.zeros(shape, dtype=bool)
+    arrays['ready_score'][:] = -1.0
+    for name in ('final_calls', 'final_prompt_tokens', 'final_completion_tokens', 'final_duration',
+                 'recorded_max_iterations', 'recorded_confidence_weight', 'recorded_uncertainty_weight'):
+        arrays[name] = np.zeros(len(turns))
+
+    for row, transcript in enumerate(turns):
+        # Transcripts recorded before the keyword tables were stored are counted with the current ones
+        matcher = confidence_matcher({**CONFIG, **transcript['config']})
+        for column, record in enumerate(transcript['iterations']):
+            counts = matcher.count(record['thoughts'])
+            trailer = record.get('trailer')
+            values = {
+                'iteration': record['iteration'],
+                'confidence_count': counts['confidence'],
+                'uncertainty_count': counts['uncertainty'],
+                'words': len(record['thoughts'].split()),
+                'self_evaluation': record['self_evaluation_score'],
+                'ready_score': trailer['score'] if trailer and trailer['ready'] else -1.0,
+                'early_stop': bool(record.get('early_stop')),
+                'calls': record['calls'],
+                'evaluations': record.get('evaluations', 0),
+                'prompt_tokens': record['prompt_tokens'],
+                'completion_tokens': record['completion_tokens'],
+                'duration': record['duration'],
+                'recorded_score': record['confidence'],
+            }
+            for name, value in values.items():
+                arrays[name][row, column] = value
+            arrays['valid'][row, column] = True
+
+        config = transcript['config']
+        final = transcript['final']
+        arrays['final_calls'][row] = final['calls']
+        arrays['final_prompt_tokens'][row] = final['prompt_tokens']
+        arrays['final_completion_tokens'][row] = final['completion_tokens']
+        arrays['final_duration'][row] = final['duration']
+        arrays['recorded_max_iterations'][row] = config['max_iterations']
+        arrays['recorded_confidence_weight'][row] = config.get('confidence_keyword_weight', 1.0)
+        arrays['recorded_uncertainty_weight'][row] = config.get('uncertainty_keyword_weight', 1.0)
+
+    arrays['last'] = arrays['valid'].sum(axis=1) - 1
+    return arrays, len(transcripts) - len(turns)
+
+def confidence_scores(arrays, max_iterations, confidence_weight, uncertainty_weight):
+    """
+    confidence_from_counts() over every recorded iteration at once. The arguments are
+    numbers or per-turn arrays of shape (turns, 1).
+    """
+    words = arrays['words']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = (confidence_weight * arrays['confidence_count']
+                 - uncertainty_weight * arrays['uncertainty_count']) / words
+    base = np.clip((ratio + 0.1) / 0.2, 0, 1)
+    initial = base * (1 + (1 - arrays['iteration'] / max_iterations))
+    self_evaluation = np.where(arrays['self_evaluation'] > 0, arrays['self_evaluation'], 1)
+    return np.where(words > 0, np.clip(initial * self_evaluation, 0, 1), 0)
+
+def replay(arrays, thresholds, max_iterations, confidence_weight, uncertainty_weight):
+    """
+    Returns per-threshold means of calls, tokens and latency per turn, the share of
+    turns whose stop point changed and the share that ran out of recorded iterations.
+    """
+    thresholds = np.asarray(thresholds)[:, None, None]
+    scores = confidence_scores(arrays, max_iterations, confidence_weight, uncertainty_weight)
+    # The loop's break conditions, checked after each iteration in order
+    stops = ((scores[None] > thresholds) | (arrays['ready_score'][None] > thresholds)
+             | (arrays['early_stop'][None] > 0) | (arrays['iteration'][None] >= max_iterations))
+    stops &= arrays['valid'][None]
+    stopped = stops.any(axis=2)
+    last = np.broadcast_to(arrays['last'], stopped.shape)
+    stop = np.where(stopped, stops.argmax(axis=2), last)
+
+    def at_stop(values):
+        return np.take_along_axis(np.broadcast_to(values, stops.shape), stop[..., None], axis=2)[..., 0]
+
+    def upto(name, inclusive=True):
+        # Sum of a per-iteration array over the iterations up to the stop point
+        taken = at_stop(np.cumsum(arrays[name], axis=1))
+        return taken if inclusive else taken - at_stop(arrays[name])
+
+    completion = upto('completion_tokens')
+    # The final prompt carries the thoughts, so iterations that no longer run leave it shorter
+    dropped = arrays['completion_tokens'].sum(axis=1)[None] - completion
+    final_prompt = np.maximum(arrays['final_prompt_tokens'][None] - dropped, 0)
+    # The evaluation started after an iteration is only requested if the loop goes on
+    calls = upto('calls') + upto('evaluations', inclusive=False) + arrays['final_calls'][None]
+    tokens = upto('prompt_tokens') + completion + final_prompt + arrays['final_completion_tokens'][None]
+    latency = upto('duration') + arrays['final_duration'][None]
+    truncated = ~stopped & (arrays['iteration'][np.arange(len(arrays['last'])), arrays['last']] < max_iterations)[None]
+    return {
+        'calls': calls.mean(axis=1),
+        'tokens': tokens.mean(axis=1),
+        'latency': latency.mean(axis=1),
+        'stop_iteration': (stop + 1).mean(axis=1),
+        # A truncated turn would have stopped later than recorded, so its stop point moved too
+        'changed': ((stop != last) | truncated).mean(axis=1),
+        'truncated': truncated.mean(axis=1),
+    }
+
+def recorded_costs(arrays):
+    calls = arrays['calls'].sum(axis=1) + arrays['evaluations'].sum(axis=1) + arrays['final_calls']
+    tokens = (arrays['prompt_tokens'].sum(axis=1) + arrays['completion_tokens'].sum(axis=1)
+              + arrays['final_prompt_tokens'] + arrays['final_completion_tokens'])
+    latency = arrays['duration'].sum(axis=1) + arrays['final_duration']
+    return {'calls': calls.mean(), 'tokens': tokens.mean(), 'latency': latency.mean(),
+            'stop_iteration': (arrays['last'] + 1).mean()}
+
+def reproduced(arrays):
+    """
+    Returns the share of recorded confidence scores the replayed formula reproduces with the
+    settings each turn was recorded with; below 1 means the lexicon or formula changed since.
+    """
+    scores = confidence_scores(arrays, arrays['recorded_max_iterations'][:, None],
+                               arrays['recorded_confidence_weight'][:, None],
+                               arrays['recorded_uncertainty_weight'][:, None])
+    matches = np.isclose(scores, arrays['recorded_score'], atol=1e-6)[arrays['valid']]
+    return matches.mean() if matches.size else 1.0
+
+def _init_worker(arrays):
+    global _arrays
+    _arrays = arrays
+
+def _sweep_task(thresholds, max_iterations, confidence_weight, uncertainty_weight):
+    results = replay(_arrays, thresholds, max_iterations, confidence_weight, uncertainty_weight)
+    return [
+        {'confidence_threshold': float(threshold), 'max_iterations': max_iterations,
+         'confidence_keyword_weight': confidence_weight, 'uncertainty_keyword_weight': uncertainty_weight,
+         **{name: float(values[index]) for name, values in results.items()}}
+        for index, threshold in enumerate(thresholds)
+    ]
+
+def sweep(arrays, thresholds, max_iterations, confidence_weights, uncertainty_weights, workers):
+    combinations = list(itertools.product(max_iterations, confidence_weights, uncertainty_weights))
+    if workers <= 1:
+        _init_worker(arrays)
+        chunks = [_sweep_task(thresholds, *combination) for combination in combinations]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(arrays,)) as pool:
+            futures = [pool.submit(_sweep_task, thresholds, *combination) for combination in combinations]
+            chunks = [future.result() for future in futures]
+    return [row for chunk in chunks for row in chunk]
+
+def pareto_front(rows):
+    """
+    Returns the settings no other setting beats on both tokens and stop point changes,
+    cheapest first; settings with identical outcomes are listed once.
+    """
+    front = []
+    for row in sorted(rows, key=lambda row: (row['tokens'], row['changed'])):
+        if not front or row['changed'] < front[-1]['changed']:
+            front.append(row)
+    return front
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded turns under other stop settings')
+    parser.add_argument('transcripts', help='JSONL file written in record mode')
+    parser.add_argument('--thresholds', default='0.3:0.95:0.05', help='confidence_threshold values')
+    parser.add_argument('--max-iterations', default='1,2,3,4,5', help='max_iterations values')
+    parser.add_argument('--confidence-weights', default='0.5,1,1.5,2', help='confidence_keyword_weight values')
+    parser.add_argument('--uncertainty-weights', default='0.5,1,1.5,2', help='uncertainty_keyword_weight values')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--top', type=int, default=15, help='Settings of the cost/change front to print')
+    parser.add_argument('--json', metavar='PATH', help='Write every setting to a JSON file')
+    args = parser.parse_args()
+
+    arrays, skipped = build_arrays(load_transcripts(args.transcripts))
+    turns = len(arrays['last'])
+    if not turns:
+        print(f"No replayable turns in {args.transcripts} ({skipped} skipped).")
+        return
+
+    rows = sweep(arrays, _values(args.thresholds), _values(args.max_iterations, int),
+                 _values(args.confidence_weights), _values(args.uncertainty_weights), args.workers)
+    recorded = recorded_costs(arrays)
+    print(f"{turns} turns replayed, {skipped} skipped; {reproduced(arrays):.1%} of recorded scores reproduced")
+    print(f"Recorded: {recorded['calls']:.2f} calls, {recorded['tokens']:.0f} tokens, "
+          f"{recorded['latency']:.2f}s and {recorded['stop_iteration']:.2f} iterations per turn\n")
+
+    print("Cheapest settings for each share of changed stop points:")
+    print(f"{'threshold':>9}{'max it':>7}{'w conf':>7}{'w unc':>7}{'calls':>8}{'tokens':>9}{'latency':>9}"
+          f"{'iters':>7}{'changed':>9}{'truncated':>10}")
+    for row in pareto_front(rows)[:args.top]:
+        print(f"{row['confidence_threshold']:>9.2f}{row['max_iterations']:>7}"
+              f"{row['confidence_keyword_weight']:>7.2f}{row['uncertainty_keyword_weight']:>7.2f}"
+              f"{row['calls']:>8.2f}{row['tokens']:>9.0f}{row['latency']:>8.2f}s{row['stop_iteration']:>7.2f}"
+              f"{row['changed']:>9.1%}{row['truncated']:>10.1%}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'replay_sweep', 'turns': turns, 'skipped': skipped,
+                       'recorded': recorded, 'settings': rows}, f, indent=2)
+
+if __name__ == '__main__':
+    main()